@@ -0,0 +1,359 @@
+"""Offline compiler for the question flow.
+
+`apply_question_flow` expresses the questionnaire as experta rules, so every
+declared Answer makes Rete re-match the whole rule chain just to pick the
+next NextQuestion. The flow itself is a finite tree, so it can be compiled
+once into a transition table and walked with plain dict lookups.
+
+Usage:
+    python -m ExpertSystem.Questions.flow_compiler --out flow_table.json
+    python -m ExpertSystem.Questions.flow_compiler --verify
+"""
+
+import argparse
+import hashlib
+import json
+from functools import lru_cache
+
+from experta import AND, NOT, OR, Fact, KnowledgeEngine, Rule
+from ExpertSystem.facts import Answer, NextQuestion
+from ExpertSystem.Questions.question import get_question_by_ident
+from ExpertSystem.Questions.question_flow import apply_question_flow
+
+TABLE_VERSION = 1
+WILDCARD = "*"
+
+
+class FlowCompileError(Exception):
+    pass
+
+
+class _DeclareRecorder:
+    """Stands in for the engine to capture what a rule's RHS declares."""
+
+    def __init__(self):
+        self.declared = []
+
+    def declare(self, *facts):
+        self.declared.extend(facts)
+
+
+def rule_declarations(rule):
+    """Facts declared by the RHS of a rule that takes no bound variables."""
+    recorder = _DeclareRecorder()
+    rule._wrapped(recorder)
+    return recorder.declared
+
+
+def extract_flow_rules():
+    """Return (name, salience, conditions, target ident) for every flow rule."""
+
+    class _FlowOnly(KnowledgeEngine):
+        pass
+
+    apply_question_flow(_FlowOnly)
+
+    rules = []
+    for name, rule in sorted(vars(_FlowOnly).items()):
+        if not isinstance(rule, Rule):
+            continue
+        targets = [
+            f["ident"] for f in rule_declarations(rule) if isinstance(f, NextQuestion)
+        ]
+        if len(targets) != 1:
+            raise FlowCompileError(f"Rule {name} must declare exactly one NextQuestion")
+        rules.append((name, rule.salience, tuple(rule), targets[0]))
+    return rules
+
+
+def rules_signature(rules):
+    """Stable hash of the flow rules, used to detect stale compiled tables."""
+    digest = hashlib.sha256()
+    for name, salience, conditions, target in rules:
+        digest.update(repr((name, salience, conditions, target)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _matches(ce, answers):
+    if isinstance(ce, NOT):
+        return not all(_matches(c, answers) for c in ce)
+    if isinstance(ce, OR):
+        return any(_matches(c, answers) for c in ce)
+    if isinstance(ce, AND):
+        return all(_matches(c, answers) for c in ce)
+    if isinstance(ce, Answer):
+        texts = answers.get(ce["ident"])
+        if texts is None:
+            return False
+        return "text" not in ce or ce["text"] in texts
+    if type(ce) is Fact and dict(ce.as_dict()) == {"start": True}:
+        # Fact(start=True) is declared by every session before the first run.
+        return True
+    raise FlowCompileError(f"Unsupported condition in question flow: {ce!r}")
+
+
+def _referenced_texts(rules):
+    referenced = {}
+
+    def visit(ce):
+        if isinstance(ce, (NOT, OR, AND)):
+            for c in ce:
+                visit(c)
+        elif isinstance(ce, Answer) and "text" in ce:
+            referenced.setdefault(ce["ident"], set()).add(ce["text"])
+
+    for _, _, conditions, _ in rules:
+        for ce in conditions:
+            visit(ce)
+    return referenced
+
+
+def _answer_domain(ident, referenced):
+    """The answers that lead to distinct transitions out of `ident`.
+
+    Values no flow rule tests for are folded into a single WILDCARD edge.
+    """
+    texts = referenced.get(ident, set())
+    question_data = get_question_by_ident(ident)
+    valid = list(question_data["valid"]) if question_data else []
+    domain = sorted(texts)
+    if not valid or any(v not in texts for v in valid):
+        domain.append(WILDCARD)
+    return domain
+
+
+def _select_next(rules, answers):
+    candidates = [
+        (salience, target)
+        for _, salience, conditions, target in rules
+        if target not in answers and all(_matches(ce, answers) for ce in conditions)
+    ]
+    if not candidates:
+        return None
+    best = max(salience for salience, _ in candidates)
+    targets = {target for salience, target in candidates if salience == best}
+    if len(targets) > 1:
+        raise FlowCompileError(
+            f"Ambiguous next question at salience {best}: {sorted(targets)}"
+        )
+    return targets.pop()
+
+
+def compile_question_flow(rules=None):
+    """Walk every reachable answer path and build the transition table.
+
+    States are nodes of the question tree rather than question idents,
+    because the same question (e.g. `locations`) can be reached from
+    several branches with different continuations.
+    """
+    if rules is None:
+        rules = extract_flow_rules()
+    referenced = _referenced_texts(rules)
+
+    questions = []
+    transitions = []
+    state_ids = {}
+
+    def state_for(answers):
+        key = frozenset((ident, frozenset(texts)) for ident, texts in answers.items())
+        if key in state_ids:
+            return state_ids[key], False
+        state = len(questions)
+        state_ids[key] = state
+        questions.append(_select_next(rules, answers))
+        transitions.append({})
+        return state, True
+
+    start, _ = state_for({})
+    pending = [(start, {})]
+    while pending:
+        state, answers = pending.pop()
+        ident = questions[state]
+        if ident is None:
+            continue
+        for answer in _answer_domain(ident, referenced):
+            next_answers = dict(answers)
+            next_answers[ident] = frozenset([answer])
+            next_state, is_new = state_for(next_answers)
+            transitions[state][answer] = next_state
+            if is_new:
+                pending.append((next_state, next_answers))
+
+    return {
+        "version": TABLE_VERSION,
+        "rules_hash": rules_signature(rules),
+        "start": start,
+        "questions": questions,
+        "transitions": transitions,
+    }
+
+
+class NextQuestionResolver:
+    """Constant-time next-question lookups over a compiled flow table."""
+
+    def __init__(self, table):
+        if table.get("version") != TABLE_VERSION:
+            raise ValueError(f"Unsupported flow table version: {table.get('version')}")
+        self.rules_hash = table["rules_hash"]
+        self.start_state = table["start"]
+        self._questions = list(table["questions"])
+        self._transitions = [dict(edges) for edges in table["transitions"]]
+
+    @classmethod
+    def from_rules(cls):
+        return cls(compile_question_flow())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def question(self, state):
+        """The question pending in `state`, or None once the flow is complete."""
+        return self._questions[state]
+
+    def is_complete(self, state):
+        return self._questions[state] is None
+
+    @property
+    def state_count(self):
+        return len(self._questions)
+
+    def edges(self, state):
+        """{answer: next state} out of `state`; WILDCARD matches any other answer."""
+        return dict(self._transitions[state])
+
+    def advance(self, state, ident, answer):
+        """Return the state reached by answering `ident` with `answer`."""
+        expected = self._questions[state]
+        if ident != expected:
+            raise ValueError(f"Expected an answer for '{expected}', got '{ident}'")
+        edges = self._transitions[state]
+        next_state = edges.get(str(answer).strip().lower())
+        if next_state is None:
+            next_state = edges.get(WILDCARD)
+        if next_state is None:
+            raise ValueError(f"Unexpected answer '{answer}' for '{ident}'")
+        return next_state
+
+    def paths(self):
+        """Yield every root-to-leaf path as a list of (ident, answer) pairs."""
+        stack = [(self.start_state, [])]
+        while stack:
+            state, path = stack.pop()
+            ident = self._questions[state]
+            if ident is None:
+                yield path
+                continue
+            for answer, next_state in sorted(self._transitions[state].items()):
+                stack.append((next_state, path + [(ident, answer)]))
+
+
+@lru_cache(maxsize=1)
+def get_resolver():
+    """Process-wide resolver, from the knowledge base artifact when one is set."""
+    from ExpertSystem.kb_artifact import get_knowledge_base
+
+    knowledge_base = get_knowledge_base()
+    if knowledge_base is not None:
+        return NextQuestionResolver(knowledge_base.flow_table)
+    return NextQuestionResolver.from_rules()
+
+
+def _concrete_answer(ident, answer, referenced, number="30"):
+    if answer != WILDCARD:
+        return answer
+    question_data = get_question_by_ident(ident)
+    if question_data and question_data["Type"] == "number":
+        return number
+    for value in question_data["valid"] if question_data else []:
+        if value not in referenced.get(ident, set()):
+            return value
+    raise FlowCompileError(f"No concrete answer available for wildcard on '{ident}'")
+
+
+def concrete_paths(resolver=None, number="30"):
+    """Yield every path with WILDCARD edges replaced by real answers.
+
+    Numeric questions (age) are answered with `number`.
+    """
+    if resolver is None:
+        resolver = get_resolver()
+    referenced = _referenced_texts(extract_flow_rules())
+    for path in resolver.paths():
+        yield [
+            (ident, _concrete_answer(ident, answer, referenced, number))
+            for ident, answer in path
+        ]
+
+
+def verify_against_engine(resolver=None):
+    """Replay every reachable path through the experta rules.
+
+    Returns a list of mismatch descriptions; an empty list means the compiled
+    table and the rule engine agree on every step of every path.
+    """
+    from ExpertSystem.engine_factory import get_engine_factory
+
+    factory = get_engine_factory()
+    if resolver is None:
+        resolver = get_resolver()
+
+    mismatches = []
+    for path in concrete_paths(resolver):
+        engine = factory.fork()
+        engine.declare(Fact(start=True))
+        engine.run()
+
+        state = resolver.start_state
+        for step, (ident, answer) in enumerate(path + [(None, None)]):
+            expected = resolver.question(state)
+            actual = engine.pending_question()
+            if expected != actual:
+                mismatches.append(
+                    f"path {path[:step]}: table asks {expected!r}, engine asks {actual!r}"
+                )
+                break
+            if ident is None:
+                break
+            state = resolver.advance(state, ident, answer)
+            engine.retract_next_question(ident)
+            engine.declare(Answer(ident=ident, text=answer))
+            engine.run()
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the question flow rules")
+    parser.add_argument("--out", help="write the compiled transition table to this path")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="check the table against the experta rules on every reachable path",
+    )
+    args = parser.parse_args()
+
+    table = compile_question_flow()
+    resolver = NextQuestionResolver(table)
+    paths = list(resolver.paths())
+    print(
+        f"Compiled {len(table['questions'])} states, {len(paths)} paths "
+        f"(rules {table['rules_hash'][:12]})"
+    )
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(table, f, indent=2)
+        print(f"Wrote {args.out}")
+
+    if args.verify:
+        mismatches = verify_against_engine(resolver)
+        for mismatch in mismatches:
+            print(f"MISMATCH {mismatch}")
+        if mismatches:
+            raise SystemExit(1)
+        print("Transition table matches the experta rules on every path.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Typed values of the answers the certainty factor modifiers depend on.
+
+The modifiers used to re-parse the answer text every time they were checked:
+`int(age)` per diagnosis, a `DURATION_MAPPING.get(...)` list scan for
+duration and a list membership test for severity. Answers are normalized
+once when they are declared, and every DiseaseInfo is compiled once into a
+DiseaseProfile holding the matching values in the same types:
+
+* age      -> int
+* duration -> bucket id, the position of the answer in DURATION_MAPPING
+              (None for an answer the mapping does not list)
+* severity -> Severity (None for an unknown level)
+"""
+
+import enum
+
+from ExpertSystem.Data.disease import DURATION_MAPPING
+
+
+class Severity(enum.Enum):
+    MILD = "mild"
+    MODERATE = "moderate"
+    SEVERE = "severe"
+
+
+# duration answer text -> bucket id
+DURATION_BUCKETS = {text: bucket for bucket, text in enumerate(DURATION_MAPPING)}
+# bucket id -> disease `common_duration` values the bucket matches
+DURATION_MATCHES = tuple(frozenset(durations) for durations in DURATION_MAPPING.values())
+
+
+def parse_severity(text):
+    try:
+        return Severity(text)
+    except ValueError:
+        return None
+
+
+NORMALIZERS = {
+    "age": int,
+    "duration": DURATION_BUCKETS.get,
+    "severity": parse_severity,
+}
+
+
+def normalize_answer(ident, text):
+    """Typed value of a modifier answer; raises ValueError for a non-numeric age."""
+    return NORMALIZERS[ident](text)
+
+
+def validate_answer(ident, text):
+    """Raise ValueError if a modifier answer cannot be normalized.
+
+    Called where an answer is accepted, so a bad age is rejected up front
+    rather than failing inside the engine's declare.
+    """
+    if ident not in NORMALIZERS:
+        return
+    try:
+        value = normalize_answer(ident, text)
+    except ValueError:
+        raise ValueError(f"Expected a whole number for '{ident}', got '{text}'") from None
+    if ident == "age" and value < 0:
+        raise ValueError(f"Expected a non-negative age, got '{text}'")
+
+
+class DiseaseProfile:
+    """A DiseaseInfo fact with its modifier criteria in the normalized types."""
+
+    __slots__ = ("info", "age_min", "age_max", "duration_buckets", "severities")
+
+    def __init__(self, info):
+        self.info = info
+        self.age_min = info["age_min"]
+        self.age_max = info["age_max"]
+        self.duration_buckets = frozenset(
+            bucket
+            for bucket, durations in enumerate(DURATION_MATCHES)
+            if info["common_duration"] in durations
+        )
+        self.severities = frozenset(
+            severity for severity in Severity if severity.value in info["severity_levels"]
+        )
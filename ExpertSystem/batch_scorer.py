@@ -0,0 +1,422 @@
+"""Vectorized scoring of many answer sets at once.
+
+Running one KnowledgeEngine per patient is far too slow for offline
+screening. The diagnostic rules are all conjunctions of Answer tests, so a
+batch of answer sets is encoded as a patient x feature matrix and the rules as
+a rule x feature mask; a rule fires for a patient when every feature in its
+mask is present. The age/duration/severity modifiers and the certainty factor
+merge then run column-wise over the whole batch, following the semantics of
+ExpertSystem.evidence.DiagnosisAccumulator.
+
+`best` breaks certainty factor ties like the engine does, in favour of the
+disease whose evidence came first. With every answer declared up front, as
+`engine_best` and cli_main do, the agenda fires the diagnostic rules by
+salience and then by the fact ids of their answers, newest first (experta's
+DepthStrategy); the scorer ranks the rules that fired for a patient the same
+way, taking an answer's fact id from its position in the answer dict.
+
+Usage:
+    python -m ExpertSystem.batch_scorer --verify
+"""
+
+import argparse
+import time
+from functools import lru_cache
+
+import numpy as np
+from experta import NOT, KnowledgeEngine, Rule
+from ExpertSystem.answers import DURATION_BUCKETS, DiseaseProfile
+from ExpertSystem.engine import disease_info_facts
+from ExpertSystem.facts import Answer, Diagnosis, Stop
+from ExpertSystem.kb_artifact import get_knowledge_base
+from ExpertSystem.Questions.diagnosis import apply_diagnostic_rules
+from ExpertSystem.Questions.flow_compiler import rule_declarations
+
+
+class UnsupportedRuleError(Exception):
+    pass
+
+
+def extract_diagnostic_rules():
+    """Return (name, features, disease, cf, salience) for every diagnostic rule.
+
+    `features` is a tuple of (ident, text) pairs that must all be answered.
+    Rules that declare no Diagnosis (stop_engine_flag) are skipped.
+    """
+
+    class _DiagnosticOnly(KnowledgeEngine):
+        pass
+
+    apply_diagnostic_rules(_DiagnosticOnly)
+
+    rules = []
+    for name, rule in vars(_DiagnosticOnly).items():
+        if not isinstance(rule, Rule):
+            continue
+        diagnoses = [f for f in rule_declarations(rule) if isinstance(f, Diagnosis)]
+        if not diagnoses:
+            continue
+        if len(diagnoses) != 1:
+            raise UnsupportedRuleError(f"Rule {name} declares more than one Diagnosis")
+
+        features = []
+        for ce in rule:
+            if isinstance(ce, NOT) and len(ce) == 1 and isinstance(ce[0], Stop):
+                continue
+            if isinstance(ce, Answer) and set(ce) == {"ident", "text"}:
+                features.append((ce["ident"], ce["text"]))
+                continue
+            raise UnsupportedRuleError(f"Rule {name} has an unsupported condition: {ce!r}")
+        rules.append(
+            (name, tuple(features), diagnoses[0]["disease"], diagnoses[0]["cf"], rule.salience)
+        )
+    return rules
+
+
+def combine_cf(cf1, cf2):
+    """Element-wise `ExpertSystem.evidence.combine_cf`."""
+    both_positive = (cf1 >= 0) & (cf2 >= 0)
+    both_negative = (cf1 < 0) & (cf2 < 0)
+    denominator = 1 - np.minimum(np.abs(cf1), np.abs(cf2))
+    safe = np.where(denominator != 0, denominator, 1.0)
+    with np.errstate(invalid="ignore"):
+        return np.where(
+            both_positive,
+            cf1 + cf2 * (1 - cf1),
+            np.where(both_negative, cf1 + cf2 * (1 + cf1), (cf1 + cf2) / safe),
+        )
+
+
+def _answer_values(value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return value
+    return (value,)
+
+
+class BatchScorer:
+    """Scores batches of answer dicts against the diagnostic rules."""
+
+    def __init__(self, rules=None):
+        if rules is None:
+            knowledge_base = get_knowledge_base()
+            if knowledge_base is not None:
+                rules = knowledge_base.diagnostic_rules
+            else:
+                rules = extract_diagnostic_rules()
+
+        self.rule_names = [name for name, _, _, _, _ in rules]
+        self.diseases = list(dict.fromkeys(disease for _, _, disease, _, _ in rules))
+        self.features = sorted({f for _, features, _, _, _ in rules for f in features})
+        self._feature_index = {f: i for i, f in enumerate(self.features)}
+        disease_index = {d: i for i, d in enumerate(self.diseases)}
+
+        self.rule_mask = np.zeros((len(rules), len(self.features)), dtype=bool)
+        for r, (_, features, _, _, _) in enumerate(rules):
+            for feature in features:
+                self.rule_mask[r, self._feature_index[feature]] = True
+        self._rule_sizes = self.rule_mask.sum(axis=1)
+        self._rule_disease = np.array([disease_index[d] for _, _, d, _, _ in rules])
+        self._rule_cf = np.array([cf for _, _, _, cf, _ in rules], dtype=float)
+        self._rule_salience = np.array([salience for _, _, _, _, salience in rules])
+
+        # Modifier lookup tables: one row per known answer plus a last row for
+        # answers the knowledge base does not mention.
+        infos = [disease_info_facts.get(d) for d in self.diseases]
+        self._has_info = np.array([info is not None for info in infos])
+        self._age_min = np.array([info["age_min"] if info else 0 for info in infos])
+        self._age_max = np.array([info["age_max"] if info else 0 for info in infos])
+
+        self._duration_index = DURATION_BUCKETS
+        self._duration_match = np.zeros((len(DURATION_BUCKETS) + 1, len(infos)), dtype=bool)
+        for column, info in enumerate(infos):
+            if info is not None:
+                for bucket in DiseaseProfile(info).duration_buckets:
+                    self._duration_match[bucket, column] = True
+
+        levels = [info["severity_levels"] if info else [] for info in infos]
+        severities = sorted({level for disease_levels in levels for level in disease_levels})
+        self._severity_index = {text: i for i, text in enumerate(severities)}
+        self._severity_match = np.zeros((len(severities) + 1, len(infos)), dtype=bool)
+        for text, row in self._severity_index.items():
+            for column, disease_levels in enumerate(levels):
+                self._severity_match[row, column] = text in disease_levels
+        self._has_levels = np.array([bool(disease_levels) for disease_levels in levels])
+
+    def encode(self, answer_sets):
+        """Return the patient x feature matrix for a list of answer dicts."""
+        return self.answer_positions(answer_sets) >= 0
+
+    def answer_positions(self, answer_sets):
+        """Return the patient x feature matrix of declaration positions.
+
+        A feature's position is the order in which the engine would declare
+        it (and so the order of its fact id) among the patient's features;
+        -1 where the feature is not answered.
+        """
+        feature_index = self._feature_index
+        matrix = np.full((len(answer_sets), len(self.features)), -1, dtype=np.int64)
+        for p, answers in enumerate(answer_sets):
+            row = matrix[p]
+            position = 0
+            for ident, value in answers.items():
+                for text in (value,) if isinstance(value, str) else value:
+                    column = feature_index.get((ident, text))
+                    # A repeated answer is not declared twice.
+                    if column is not None and row[column] < 0:
+                        row[column] = position
+                        position += 1
+        return matrix
+
+    def _fired(self, features):
+        return features.astype(np.int32) @ self.rule_mask.T.astype(np.int32) == self._rule_sizes
+
+    def _first_evidence(self, positions, fired):
+        """Patient x disease rank of each disease's first firing; higher fires first.
+
+        A rule's agenda key is its salience, then the positions of its
+        answers sorted newest first and compared as a sequence. The sequence
+        is packed into one integer with one digit per answer, so a rule whose
+        answers are a prefix of another's ranks below it, as in Python.
+        """
+        base = int(positions.max(initial=-1)) + 2
+        width = int(self._rule_sizes.max(initial=0))
+        saliences = np.unique(self._rule_salience)
+        span = base**width
+        if len(saliences) * span > np.iinfo(np.int64).max:
+            raise OverflowError("Too many answers per patient to rank the rule firings")
+        keys = np.zeros(fired.shape, dtype=np.int64)
+        for r, mask in enumerate(self.rule_mask):
+            rows = np.flatnonzero(fired[:, r])
+            if not len(rows):
+                continue
+            digits = -np.sort(-positions[np.ix_(rows, np.flatnonzero(mask))], axis=1) + 1
+            packed = np.zeros(len(rows), dtype=np.int64)
+            for i in range(width):
+                packed = packed * base + (digits[:, i] if i < digits.shape[1] else 0)
+            keys[rows, r] = packed
+
+        salience_rank = np.searchsorted(saliences, self._rule_salience)
+        keys = np.where(fired, salience_rank * span + keys, -1)
+
+        first = np.full((fired.shape[0], len(self.diseases)), -1, dtype=np.int64)
+        for column in range(len(self.diseases)):
+            rules = self._rule_disease == column
+            if rules.any():
+                first[:, column] = keys[:, rules].max(axis=1)
+        return first
+
+    def _modifier_deltas(self, answer_sets):
+        count = len(answer_sets)
+        ages = np.zeros(count, dtype=np.int64)
+        has_age = np.zeros(count, dtype=bool)
+        durations = np.full(count, -1)
+        severities = np.full(count, -1)
+        unknown_duration = len(self._duration_index)
+        unknown_severity = len(self._severity_index)
+
+        for p, answers in enumerate(answer_sets):
+            if "age" in answers:
+                has_age[p] = True
+                ages[p] = int(_answer_values(answers["age"])[0])
+            if "duration" in answers:
+                text = _answer_values(answers["duration"])[0]
+                durations[p] = self._duration_index.get(text, unknown_duration)
+            if "severity" in answers:
+                text = _answer_values(answers["severity"])[0]
+                severities[p] = self._severity_index.get(text, unknown_severity)
+
+        # Nothing applies before the age modifier, and nothing to diseases
+        # without a DiseaseInfo.
+        age_applied = has_age[:, None] & self._has_info
+        in_range = (self._age_min <= ages[:, None]) & (ages[:, None] <= self._age_max)
+        age_delta = np.where(age_applied, np.where(in_range, 0.15, -0.2), 0.0)
+
+        has_duration = durations >= 0
+        duration_applied = age_applied & has_duration[:, None]
+        duration_match = self._duration_match[durations]
+        duration_delta = np.where(duration_applied, np.where(duration_match, 0.1, -0.4), 0.0)
+
+        severity_considered = age_applied & (severities >= 0)[:, None] & self._has_levels
+        severity_match = self._severity_match[severities]
+        severity_delta = np.where(
+            severity_considered & ~severity_match,
+            -0.15,
+            np.where(severity_considered & duration_applied, 0.15, 0.0),
+        )
+        return age_delta, duration_delta, severity_delta
+
+    def score(self, answer_sets):
+        """Return the patient x disease CF matrix; NaN where nothing fired."""
+        answer_sets = list(answer_sets)
+        return self._score(answer_sets, self._fired(self.encode(answer_sets)))
+
+    def _score(self, answer_sets, fired):
+        deltas = self._modifier_deltas(answer_sets)
+
+        def modify(cf, rows, column):
+            for delta in deltas:
+                cf = combine_cf(cf, delta[rows, column])
+            return cf
+
+        # Rules are folded in declaration order, one column slice at a time,
+        # touching only the patients the rule fired for.
+        cfs = np.full((len(answer_sets), len(self.diseases)), np.nan)
+        for r, column in enumerate(self._rule_disease):
+            rows = np.flatnonzero(fired[:, r])
+            if not len(rows):
+                continue
+            evidence = modify(np.full(len(rows), self._rule_cf[r]), rows, column)
+            current = cfs[rows, column]
+            merged = modify(combine_cf(current, evidence), rows, column)
+            cfs[rows, column] = np.where(np.isnan(current), evidence, merged)
+        return cfs
+
+    def best(self, answer_sets):
+        """Return (disease, cf) per patient, or None where nothing fired.
+
+        Among diseases with the highest CF, the one whose evidence fired
+        first is chosen, as in the engine.
+        """
+        answer_sets = list(answer_sets)
+        positions = self.answer_positions(answer_sets)
+        fired = self._fired(positions >= 0)
+        cfs = self._score(answer_sets, fired)
+        diagnosed = ~np.isnan(cfs).all(axis=1)
+        ranked = np.where(np.isnan(cfs), -np.inf, cfs)
+        tied = ranked == ranked.max(axis=1, keepdims=True)
+        first = self._first_evidence(positions, fired)
+        columns = np.argmax(np.where(tied & diagnosed[:, None], first, -1), axis=1)
+        return [
+            (self.diseases[c], float(cfs[p, c])) if diagnosed[p] else None
+            for p, c in enumerate(columns)
+        ]
+
+
+@lru_cache(maxsize=1)
+def get_batch_scorer():
+    return BatchScorer()
+
+
+def corpus(ages=("8", "35", "70")):
+    """Answer dicts for every concrete question-flow path at a few ages."""
+    from ExpertSystem.Questions.flow_compiler import concrete_paths
+
+    return [dict(path) for age in ages for path in concrete_paths(number=age)]
+
+
+def synthetic_corpus(count, seed=0):
+    """Answer dicts of `count` synthetic patients (ExpertSystem.patient_generator)."""
+    from ExpertSystem.patient_generator import generate_patients
+
+    return [patient["answers"] for patient in generate_patients(count, seed)]
+
+
+def random_corpus(count, seed=0):
+    """Answer dicts of `count` patients answering every question at random.
+
+    Unlike the flow and synthetic corpora these ignore the question flow, so
+    they fire rules of several branches together and produce many ties.
+    """
+    import random
+
+    from ExpertSystem.Questions.question import questions_list
+    from ExpertSystem.result_cache import MULTI_VALUED_IDENTS
+
+    rng = random.Random(seed)
+    answer_sets = []
+    for _ in range(count):
+        answers = {}
+        for q in questions_list:
+            if q["Type"] == "number":
+                answers[q["ident"]] = str(rng.randint(1, 90))
+            elif q["ident"] in MULTI_VALUED_IDENTS:
+                answers[q["ident"]] = rng.sample(q["valid"], rng.randint(1, 2))
+            else:
+                answers[q["ident"]] = rng.choice(q["valid"])
+        answer_sets.append(answers)
+    return answer_sets
+
+
+def engine_best(answers, factory=None):
+    """best_diagnosis from the rule engine, declaring answers like cli_main."""
+    from ExpertSystem.engine_factory import get_engine_factory
+
+    engine = (factory or get_engine_factory()).fork()
+    for ident, value in answers.items():
+        for text in _answer_values(value):
+            engine.declare(Answer(ident=ident, text=text))
+    engine.run()
+    best = engine.best_diagnosis
+    return None if best is None else (best["disease"], best["cf"])
+
+
+def verify_against_engine(answer_sets, scorer=None, tolerance=1e-9):
+    """Return mismatch descriptions between the scorer and the rule engine."""
+    scorer = scorer or get_batch_scorer()
+    mismatches = []
+    for answers, scored in zip(answer_sets, scorer.best(answer_sets)):
+        expected = engine_best(answers)
+        same = (expected is None and scored is None) or (
+            expected is not None
+            and scored is not None
+            and expected[0] == scored[0]
+            and abs(expected[1] - scored[1]) <= tolerance
+        )
+        if not same:
+            mismatches.append(f"{answers}: engine {expected}, scorer {scored}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized batch diagnosis scorer")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="compare with the rule engine on the flow corpus, synthetic and random patients",
+    )
+    parser.add_argument(
+        "--patients", type=int, default=20000, help="synthetic patients for the timing run"
+    )
+    parser.add_argument(
+        "--verify-patients",
+        type=int,
+        default=200,
+        help="synthetic patients verified in addition to the flow corpus",
+    )
+    parser.add_argument(
+        "--verify-random",
+        type=int,
+        default=300,
+        help="patients answering every question at random, verified as well",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    scorer = get_batch_scorer()
+    print(
+        f"{len(scorer.rule_names)} rules, {len(scorer.features)} features, "
+        f"{len(scorer.diseases)} diseases"
+    )
+
+    batch = synthetic_corpus(args.patients, args.seed)
+    started = time.perf_counter()
+    scorer.score(batch)
+    elapsed = time.perf_counter() - started
+    print(f"Scored {len(batch)} patients in {elapsed * 1000:.1f} ms")
+
+    if args.verify:
+        answer_sets = (
+            corpus()
+            + batch[: args.verify_patients]
+            + random_corpus(args.verify_random, args.seed)
+        )
+        mismatches = verify_against_engine(answer_sets, scorer)
+        for mismatch in mismatches:
+            print(f"MISMATCH {mismatch}")
+        if mismatches:
+            raise SystemExit(1)
+        print(f"best_diagnosis matches the rule engine on all {len(answer_sets)} answer sets.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Rule sets partitioned by triage branch, built lazily per branch.
+
+Every engine used to carry every flow and diagnostic rule, so a growth
+patient still had the rash, nail and pigment rules in its Rete network. The
+triage questions (`ask_triage_1` .. `ask_triage_4_branch_d`) settle which
+branch a patient is on, and after that only that branch's rules can fire.
+
+A session starts on a TRIAGE engine, which holds the rules that can match
+before the branch is known. The answer that settles the branch switches the
+session to that branch's engine: a fork of its own golden snapshot with
+every answer given so far declared again. Each partition keeps a rule when:
+
+* every Answer it requires at the top level is for a question the flow can
+  ask in that partition, and
+* none of those Answers contradicts the partition's triage answers.
+
+Answers under OR or NOT are not used to drop a rule, so each partition keeps
+every rule that can fire on its answers, and a session diagnoses exactly
+what the full engine would. That relies on answers following the question
+flow, as they do in API sessions; one-shot requests with arbitrary answers
+keep using the full engine of ExpertSystem.engine_factory.
+
+Usage:
+    python -m ExpertSystem.branch_rules
+"""
+
+import threading
+from functools import lru_cache
+
+from ExpertSystem.engine_factory import DermatologyEngineFactory
+from ExpertSystem.facts import Answer
+from ExpertSystem.Questions.flow_compiler import WILDCARD, get_resolver
+
+TRIAGE = "triage"
+# branch -> the triage answers that select it, in the order they are asked
+BRANCH_ANSWERS = {
+    "A": (("has_symptom_lump_or_growth", "yes"),),
+    "B": (("has_symptom_lump_or_growth", "no"), ("affects_nails_or_hair", "yes")),
+    "C": (
+        ("has_symptom_lump_or_growth", "no"),
+        ("affects_nails_or_hair", "no"),
+        ("has_symptom_rash", "yes"),
+    ),
+    "D": (
+        ("has_symptom_lump_or_growth", "no"),
+        ("affects_nails_or_hair", "no"),
+        ("has_symptom_rash", "no"),
+    ),
+}
+PARTITIONS = (TRIAGE, *BRANCH_ANSWERS)
+
+
+def branch_for(answer_facts):
+    """The branch the (ident, text) answers select, or None while undecided."""
+    answered = set(answer_facts)
+    for branch, answers in BRANCH_ANSWERS.items():
+        if answered.issuperset(answers):
+            return branch
+    return None
+
+
+def required_answers(rule):
+    """(ident, text or None) of the Answers a rule requires at the top level."""
+    for ce in rule:
+        if isinstance(ce, Answer) and isinstance(ce.get("ident"), str):
+            text = ce.get("text")
+            yield ce["ident"], text if isinstance(text, str) else None
+
+
+def askable_idents(partition, resolver=None):
+    """Every question the flow can ask in `partition`."""
+    resolver = resolver or get_resolver()
+    fixed = dict(BRANCH_ANSWERS.get(partition, ()))
+    idents = set()
+    seen = set()
+    stack = [(resolver.start_state, ())]
+    while stack:
+        state, path = stack.pop()
+        ident = resolver.question(state)
+        if ident is None or state in seen:
+            continue
+        seen.add(state)
+        idents.add(ident)
+        for answer, next_state in resolver.edges(state).items():
+            if ident in fixed and answer not in (fixed[ident], WILDCARD):
+                continue
+            next_path = path + ((ident, answer),)
+            if partition == TRIAGE and branch_for(next_path) is not None:
+                continue
+            stack.append((next_state, next_path))
+    return frozenset(idents)
+
+
+def rule_filter(partition, resolver=None):
+    """Predicate keeping the rules that can fire in `partition`."""
+    askable = askable_idents(partition, resolver)
+    fixed = dict(BRANCH_ANSWERS.get(partition, ()))
+
+    def keep(rule):
+        for ident, text in required_answers(rule):
+            if ident not in askable:
+                return False
+            if text is not None and fixed.get(ident, text) != text:
+                return False
+        return True
+
+    return keep
+
+
+class BranchRuleSets:
+    """Engine factories of the triage stage and of each branch, built on first use."""
+
+    def __init__(self, resolver=None):
+        self._resolver = resolver or get_resolver()
+        self._factories = {}
+        self._lock = threading.Lock()
+        self._shared_ids = None  # (factories built, their shared ids)
+
+    def factory(self, partition):
+        with self._lock:
+            factory = self._factories.get(partition)
+            if factory is None:
+                factory = DermatologyEngineFactory(
+                    rule_filter=rule_filter(partition, self._resolver),
+                    class_name=f"DermatologyExpert_{partition}",
+                )
+                self._factories[partition] = factory
+            return factory
+
+    def fork(self):
+        """A new session engine, on the triage rules."""
+        engine = self.factory(TRIAGE).fork()
+        engine.rule_partition = TRIAGE
+        return engine
+
+    def advance(self, engine, answer_facts):
+        """The engine to continue with after `answer_facts` were declared on `engine`.
+
+        Once the answers settle the branch, a triage engine is replaced by a
+        fork of the branch engine with all answers declared again; otherwise
+        `engine` is returned unchanged. Neither is run.
+
+        The branch engine takes over the triage engine's event log, so a
+        session's trace keeps its events and sequence numbers across the
+        switch.
+        """
+        if getattr(engine, "rule_partition", None) != TRIAGE:
+            return engine
+        branch = branch_for(answer_facts)
+        if branch is None:
+            return engine
+        branch_engine = self.factory(branch).fork()
+        branch_engine.rule_partition = branch
+        branch_engine.event_log = branch_engine.evidence.log = engine.event_log
+        branch_engine.declare(*(Answer(ident=ident, text=text) for ident, text in answer_facts))
+        return branch_engine
+
+    def shared_ids(self):
+        """Ids of the objects shared by the forks of every partition built so far."""
+        with self._lock:
+            factories = tuple(self._factories.values())
+            shared = self._shared_ids
+        if shared is None or shared[0] != len(factories):
+            ids = frozenset().union(*(factory.shared_ids() for factory in factories))
+            shared = self._shared_ids = (len(factories), ids)
+        return shared[1]
+
+    def stats(self):
+        with self._lock:
+            factories = dict(self._factories)
+        return {
+            partition: {
+                "flow_rules": len(factory.flow_rule_names),
+                "diagnostic_rules": len(factory.diagnostic_rule_names),
+                **factory.timings(),
+            }
+            for partition, factory in factories.items()
+        }
+
+
+@lru_cache(maxsize=1)
+def get_branch_rule_sets():
+    """The process-wide partitioned rule sets; each partition is built on first use."""
+    return BranchRuleSets()
+
+
+def main():
+    rule_sets = get_branch_rule_sets()
+    full = DermatologyEngineFactory()
+    print(
+        f"{'full':<8} {len(full.flow_rule_names):3} flow rules, "
+        f"{len(full.diagnostic_rule_names):3} diagnostic rules"
+    )
+    for partition in PARTITIONS:
+        factory = rule_sets.factory(partition)
+        print(
+            f"{partition:<8} {len(factory.flow_rule_names):3} flow rules, "
+            f"{len(factory.diagnostic_rule_names):3} diagnostic rules"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,541 @@
+"""Exhaustive path enumeration into a versioned decision-DAG artifact.
+
+The compiled question flow (see Questions/flow_compiler.py) is a DAG of
+question states. This module walks every root-to-leaf path of it through
+the real engine, `apply_question_flow` and `apply_diagnostic_rules`
+included, and attaches to every leaf a table of final results, so the
+server can answer both "next question" and "final diagnosis" with lookups.
+
+A leaf is reached through fixed answers (the flow branches on them) and
+free ones (wildcard edges: age, duration, severity, locations, ...). The
+result still depends on the free answers, so each leaf table is indexed by:
+
+* age          -> bucket between the age limits of the diseases at the leaf
+* a choice     -> each valid answer the flow does not branch on
+* a selection  -> bitmask of the selected values any diagnostic rule tests
+
+Enumerating all of that through Rete would take hours, so the engine only
+walks the answers the diagnostic rules can tell apart, with snapshot forks
+shared between paths. Each walk records the evidence it produced and the
+order of the age/duration/severity answers, and every table cell replays
+that record through a DiagnosisAccumulator with the cell's answers. The
+age text is kept as an AGE_PLACEHOLDER in the stored reasoning.
+
+Leaves are enumerated in parallel on a process pool. Each leaf also gets
+the distribution of its diagnoses over its table.
+
+The API server loads the artifact named by DERMATOLOGY_DECISION_DAG, if set
+and compiled from the current knowledge base, and falls back to the engine
+for anything the artifact does not cover.
+
+Usage:
+    python -m ExpertSystem.decision_dag --out decision_dag.json.gz [--workers N]
+    python -m ExpertSystem.decision_dag --verify decision_dag.json.gz [--samples N]
+"""
+
+import argparse
+import bisect
+import gzip
+import json
+import logging
+import os
+import random
+import threading
+import time
+from functools import lru_cache
+
+from experta import Fact
+from ExpertSystem.answers import normalize_answer
+from ExpertSystem.diagnose import DIFFERENTIAL_SIZE, result_from_diagnoses, result_from_engine
+from ExpertSystem.engine import disease_info_facts
+from ExpertSystem.engine_factory import get_engine_factory
+from ExpertSystem.event_log import RuleEventLog
+from ExpertSystem.evidence import MODIFIER_IDENTS, DiagnosisAccumulator
+from ExpertSystem.facts import Answer
+from ExpertSystem.Questions.flow_compiler import (
+    WILDCARD,
+    NextQuestionResolver,
+    _referenced_texts,
+    compile_question_flow,
+    extract_flow_rules,
+)
+from ExpertSystem.Questions.question import get_question_by_ident
+from ExpertSystem.result_cache import knowledge_base_version
+from ExpertSystem.snapshot import fork_engine
+
+logger = logging.getLogger(__name__)
+
+DAG_ENV = "DERMATOLOGY_DECISION_DAG"
+DAG_VERSION = 1
+AGE_PLACEHOLDER = "{age}"
+REPRESENTATIVE_AGE = "30"
+
+AGE, CHOICE, SELECTION = "age", "choice", "selection"
+
+
+class DecisionDAGError(Exception):
+    pass
+
+
+# --- compiling ---------------------------------------------------------------
+
+
+def _free_kind(ident):
+
+    question_data = get_question_by_ident(ident)
+    if question_data is None:
+        raise DecisionDAGError(f"Unknown question '{ident}' on a flow path")
+    if question_data["Type"] == "number":
+        return AGE
+    if "Select all that apply" in question_data["text"]:
+        return SELECTION
+    return CHOICE
+
+
+def _leaf_specs(resolver, flow_rules, diagnostic_rules):
+    """Yield (leaf state, path, free answer specs) for every flow leaf.
+
+    A free spec is (ident, kind, domain, engine options), where the engine
+    options are (key, texts) pairs the engine walk declares and `key` is the
+    choice / mask the table cells for that option map to.
+    """
+
+    flow_referenced = _referenced_texts(flow_rules)
+
+    for path in resolver.paths():
+        state = resolver.start_state
+        for ident, answer in path:
+            state = resolver.advance(state, ident, answer)
+        fixed = {ident: answer for ident, answer in path if answer != WILDCARD}
+        free = {ident: _free_kind(ident) for ident, answer in path if answer == WILDCARD}
+
+        domains = {}
+        for ident, kind in free.items():
+            valid = list(get_question_by_ident(ident)["valid"])
+            if kind == CHOICE:
+                domains[ident] = [v for v in valid if v not in flow_referenced.get(ident, ())]
+            elif kind == SELECTION:
+                domains[ident] = valid
+
+        # Values the diagnostic rules that can still fire at this leaf test.
+        tested = {ident: set() for ident in free}
+        for _, features, _, _, _ in diagnostic_rules:
+            if all(
+                fixed.get(ident) == text
+                if ident in fixed
+                else ident in free and (free[ident] == AGE or text in domains[ident])
+                for ident, text in features
+            ):
+                for ident, text in features:
+                    if ident in free:
+                        tested[ident].add(text)
+
+        specs = []
+        for ident, answer in path:
+            if answer != WILDCARD:
+                continue
+            kind = free[ident]
+            if kind == AGE:
+                if tested[ident]:
+                    raise DecisionDAGError(f"Diagnostic rules test the numeric answer '{ident}'")
+                specs.append((ident, kind, None, [(None, [REPRESENTATIVE_AGE])]))
+            elif kind == CHOICE:
+                domain = domains[ident]
+                if not domain:
+                    raise DecisionDAGError(f"No answers to enumerate for '{ident}'")
+                options = [(text, [text]) for text in domain if text in tested[ident]]
+                untested = [text for text in domain if text not in tested[ident]]
+                if untested:
+                    options.append((None, [untested[0]]))
+                specs.append((ident, kind, domain, options))
+            else:
+                relevant = sorted(tested[ident])
+                fillers = [text for text in domains[ident] if text not in tested[ident]]
+                if not fillers:
+                    raise DecisionDAGError(f"No neutral answer available for '{ident}'")
+                options = []
+                for mask in range(1 << len(relevant)):
+                    texts = [text for bit, text in enumerate(relevant) if mask >> bit & 1]
+                    options.append((mask, texts or fillers[:1]))
+                specs.append((ident, kind, relevant, options))
+        yield state, path, specs
+
+
+class _RecordingAccumulator(DiagnosisAccumulator):
+    """Also records its inputs, in order, for replay."""
+
+    def __init__(self, disease_info, log):
+        super().__init__(disease_info, log)
+        self.trace = []
+
+    def __deepcopy__(self, memo):
+        clone = super().__deepcopy__(memo)
+        clone.trace = list(self.trace)
+        return clone
+
+    def set_answer(self, ident, text, value=None):
+        if ident in MODIFIER_IDENTS:
+            self.trace.append(("answer", ident))
+        super().set_answer(ident, text, value)
+
+    def add(self, disease, cf, reasoning):
+        self.trace.append(("add", disease, cf, reasoning))
+        super().add(disease, cf, reasoning)
+
+
+def _walk_leaf(path, specs):
+    """Run the engine over every option combination of one leaf.
+
+    Returns {tuple of option keys: (trace, finished)}.
+    """
+
+    spec_by_ident = {spec[0]: spec for spec in specs}
+    root = get_engine_factory().fork()
+    root.evidence = _RecordingAccumulator(disease_info_facts, root.event_log)
+    root.declare(Fact(start=True))
+    root.run()
+
+    walks = {}
+    pending = [(root, 0, ())]
+    while pending:
+        engine, step, keys = pending.pop()
+        if step == len(path):
+            walks[keys] = (engine.evidence.trace, bool(engine.results_processed()))
+            continue
+        ident, answer = path[step]
+        spec = spec_by_ident.get(ident) if answer == WILDCARD else None
+        options = spec[3] if spec else [(None, [answer])]
+        for key, texts in options:
+            child = fork_engine(engine) if len(options) > 1 else engine
+            child.retract_next_question(ident)
+            for text in texts:
+                child.declare(Answer(ident=ident, text=text))
+            child.run()
+            pending.append((child, step + 1, keys + ((key,) if spec else ())))
+    return walks
+
+
+def _age_limits(walks):
+    limits = set()
+    for trace, _ in walks.values():
+        for event in trace:
+            info = disease_info_facts.get(event[1]) if event[0] == "add" else None
+            if info is not None:
+                limits.update((info["age_min"], info["age_max"] + 1))
+    return sorted(limits)
+
+
+def _replay(accumulator, trace, finished, answers):
+    """Final result of `trace` when the modifier answers are `answers`."""
+    accumulator.clear()
+    for event in trace:
+        if event[0] == "answer":
+            text, value = answers[event[1]]
+            accumulator.set_answer(event[1], text, value)
+        else:
+            accumulator.add(*event[1:])
+    best = accumulator.best() if finished else None
+    return result_from_diagnoses(best, accumulator.top(DIFFERENTIAL_SIZE))
+
+
+def compile_leaf(leaf):
+    """Enumerate one leaf; return its table entry and its distinct outcomes."""
+    state, path, specs = leaf
+    walks = _walk_leaf(path, specs)
+    for trace, _ in walks.values():
+        if any(event[0] == "add" and AGE_PLACEHOLDER in event[3] for event in trace):
+            raise DecisionDAGError("Rule reasoning contains the age placeholder")
+
+    keys = []
+    cell_options = []
+    for ident, kind, domain, options in specs:
+        if kind == AGE:
+            limits = _age_limits(walks)
+            keys.append([ident, kind, limits])
+            ages = [limits[0] - 1 if limits else int(REPRESENTATIVE_AGE)] + limits
+            cell_options.append([(None, (AGE_PLACEHOLDER, age)) for age in ages])
+        elif kind == CHOICE:
+            keys.append([ident, kind, domain])
+            option_keys = {key for key, _ in options}
+            cell_options.append(
+                [
+                    (
+                        text if text in option_keys else None,
+                        (text, normalize_answer(ident, text)) if ident in MODIFIER_IDENTS else None,
+                    )
+                    for text in domain
+                ]
+            )
+        else:
+            keys.append([ident, kind, domain])
+            cell_options.append([(mask, None) for mask in range(1 << len(domain))])
+
+    fixed_answers = {
+        ident: (answer, normalize_answer(ident, answer))
+        for ident, answer in path
+        if answer != WILDCARD and ident in MODIFIER_IDENTS
+    }
+
+    accumulator = DiagnosisAccumulator(disease_info_facts, RuleEventLog(capacity=0))
+    outcomes = {}
+    cells = []
+    counts = {}
+
+    def fill(index, walk_keys, answers):
+        if index == len(specs):
+            trace, finished = walks[walk_keys]
+            result = _replay(accumulator, trace, finished, answers)
+            raw = json.dumps(result, sort_keys=True)
+            cells.append(outcomes.setdefault(raw, len(outcomes)))
+            disease = result.get("disease")
+            counts[disease] = counts.get(disease, 0) + 1
+            return
+        ident = specs[index][0]
+        for key, answer in cell_options[index]:
+            next_answers = answers if answer is None else dict(answers, **{ident: answer})
+            fill(index + 1, walk_keys + (key,), next_answers)
+
+    fill(0, (), fixed_answers)
+
+    total = len(cells)
+    entry = {
+        "fixed": {ident: answer for ident, answer in path if answer != WILDCARD},
+        "keys": keys,
+        "cells": cells,
+        "distribution": {
+            disease or "no diagnosis": round(count / total, 6)
+            for disease, count in sorted(counts.items(), key=lambda item: -item[1])
+        },
+    }
+    return state, entry, [json.loads(raw) for raw in outcomes]
+
+
+def _init_worker():
+    get_engine_factory()
+
+
+def compile_decision_dag(workers=None):
+    """Enumerate every leaf and return the decision-DAG artifact."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    from ExpertSystem.batch_scorer import extract_diagnostic_rules
+
+    flow_rules = extract_flow_rules()
+    table = compile_question_flow(flow_rules)
+    resolver = NextQuestionResolver(table)
+    leaves = list(_leaf_specs(resolver, flow_rules, extract_diagnostic_rules()))
+    # Biggest leaves first, so the pool does not end on one long straggler.
+    leaves.sort(key=lambda leaf: -sum(len(spec[3]) for spec in leaf[2]))
+
+    outcomes = []
+    outcome_index = {}
+    entries = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for state, entry, leaf_outcomes in pool.map(compile_leaf, leaves):
+            remap = []
+            for outcome in leaf_outcomes:
+                raw = json.dumps(outcome, sort_keys=True)
+                if raw not in outcome_index:
+                    outcome_index[raw] = len(outcomes)
+                    outcomes.append(outcome)
+                remap.append(outcome_index[raw])
+            entry["cells"] = [remap[cell] for cell in entry["cells"]]
+            entries[str(state)] = entry
+
+    return {
+        "version": DAG_VERSION,
+        "kb_version": knowledge_base_version(),
+        "flow": table,
+        "outcomes": outcomes,
+        "leaves": {state: entries[state] for state in sorted(entries, key=int)},
+    }
+
+
+# --- lookups -----------------------------------------------------------------
+
+
+def _open_artifact(path, mode):
+    """Artifacts whose name ends in .gz are gzip-compressed."""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class DecisionDAG:
+    """Next-question and final-diagnosis lookups over a compiled artifact.
+
+    `diagnosis()` returns None whenever the answers fall outside the table
+    (an unparsable age, an unknown choice, ...), and callers fall back to
+    the engine.
+    """
+
+    def __init__(self, artifact):
+        if artifact.get("version") != DAG_VERSION:
+            raise ValueError(f"Unsupported decision DAG version: {artifact.get('version')}")
+        if artifact.get("kb_version") != knowledge_base_version():
+            raise ValueError("Decision DAG was compiled from a different knowledge base")
+        self.resolver = NextQuestionResolver(artifact["flow"])
+        self._outcomes = [json.dumps(outcome) for outcome in artifact["outcomes"]]
+        self._leaves = {int(state): leaf for state, leaf in artifact["leaves"].items()}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.fallbacks = 0
+
+    @classmethod
+    def load(cls, path):
+        with _open_artifact(path, "rt") as f:
+            return cls(json.load(f))
+
+    def _cell(self, leaf, answers):
+        for ident, answer in leaf["fixed"].items():
+            if answers.get(ident) != [answer]:
+                return None, None
+
+        cell = 0
+        age_text = None
+        for ident, kind, domain in leaf["keys"]:
+            texts = answers.get(ident)
+            if not texts:
+                return None, None
+            if kind == AGE:
+                if len(texts) != 1:
+                    return None, None
+                try:
+                    years = int(texts[0])
+                except (TypeError, ValueError):
+                    return None, None
+                age_text = texts[0]
+                cell = cell * (len(domain) + 1) + bisect.bisect_right(domain, years)
+            elif kind == CHOICE:
+                if len(texts) != 1 or texts[0] not in domain:
+                    return None, None
+                cell = cell * len(domain) + domain.index(texts[0])
+            else:
+                mask = sum(1 << bit for bit, text in enumerate(domain) if text in texts)
+                cell = cell * (1 << len(domain)) + mask
+        return leaf["cells"][cell], age_text
+
+    def diagnosis(self, state, answers):
+        """Final result for a completed flow `state`, or None to use the engine.
+
+        `answers` maps each answered ident to the list of Answer texts the
+        session declared for it.
+        """
+        leaf = self._leaves.get(state)
+        outcome, age_text = self._cell(leaf, answers) if leaf else (None, None)
+        with self._lock:
+            self.lookups += 1
+            if outcome is None:
+                self.fallbacks += 1
+                return None
+        result = json.loads(self._outcomes[outcome])
+        if age_text is not None and "reasoning" in result:
+            result["reasoning"] = result["reasoning"].replace(AGE_PLACEHOLDER, str(age_text))
+        return result
+
+    def distribution(self, state):
+        leaf = self._leaves.get(state)
+        return dict(leaf["distribution"]) if leaf else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "leaves": len(self._leaves),
+                "outcomes": len(self._outcomes),
+                "lookups": self.lookups,
+                "fallbacks": self.fallbacks,
+            }
+
+
+@lru_cache(maxsize=1)
+def get_decision_dag():
+    """The artifact named by DAG_ENV, or None if unset, missing or stale."""
+    path = os.environ.get(DAG_ENV)
+    if not path:
+        return None
+    try:
+        return DecisionDAG.load(path)
+    except (OSError, ValueError) as e:
+        logger.warning("Not using the decision DAG at %s: %s", path, e)
+        return None
+
+
+# --- verification --------------------------------------------------------------
+
+
+def _random_answer(ident, answer, rng, flow_referenced):
+    if answer != WILDCARD:
+        return [answer]
+    kind = _free_kind(ident)
+    valid = list(get_question_by_ident(ident)["valid"])
+    if kind == AGE:
+        return [str(rng.randint(0, 100))]
+    if kind == SELECTION:
+        return rng.sample(valid, rng.randint(1, min(4, len(valid))))
+    return [rng.choice([text for text in valid if text not in flow_referenced.get(ident, ())])]
+
+
+def verify_against_engine(dag, samples=200, seed=0):
+    """Replay random sessions on every leaf through the engine and the DAG."""
+
+    rng = random.Random(seed)
+    factory = get_engine_factory()
+    paths = list(dag.resolver.paths())
+    flow_referenced = _referenced_texts(extract_flow_rules())
+    mismatches = []
+    for sample in range(samples):
+        path = paths[sample % len(paths)]
+        answers = {
+            ident: _random_answer(ident, answer, rng, flow_referenced) for ident, answer in path
+        }
+
+        engine = factory.fork()
+        engine.declare(Fact(start=True))
+        engine.run()
+        state = dag.resolver.start_state
+        for ident, answer in path:
+            state = dag.resolver.advance(state, ident, answer)
+            engine.retract_next_question(ident)
+            for text in answers[ident]:
+                engine.declare(Answer(ident=ident, text=text))
+            engine.run()
+
+        expected = result_from_engine(engine)
+        actual = dag.diagnosis(state, answers)
+        if actual != expected:
+            mismatches.append(f"{answers}: DAG {actual}, engine {expected}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the decision DAG artifact")
+    parser.add_argument("--out", help="write the compiled artifact to this path")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--verify", metavar="PATH", help="check an artifact against the engine")
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.out:
+        started = time.perf_counter()
+        artifact = compile_decision_dag(args.workers)
+        cells = sum(len(leaf["cells"]) for leaf in artifact["leaves"].values())
+        with _open_artifact(args.out, "wt") as f:
+            json.dump(artifact, f, separators=(",", ":"))
+        print(
+            f"Compiled {len(artifact['leaves'])} leaves, {cells} cells, "
+            f"{len(artifact['outcomes'])} outcomes in {time.perf_counter() - started:.1f} s "
+            f"-> {args.out}"
+        )
+
+    if args.verify:
+        dag = DecisionDAG.load(args.verify)
+        mismatches = verify_against_engine(dag, args.samples)
+        for mismatch in mismatches[:10]:
+            print(f"MISMATCH {mismatch}")
+        if mismatches:
+            raise SystemExit(1)
+        print(f"Decision DAG matches the engine on {args.samples} random sessions.")
+
+
+if __name__ == "__main__":
+    main()
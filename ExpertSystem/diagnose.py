@@ -0,0 +1,69 @@
+"""One-shot diagnosis requests, shared by the CLI, batch mode and the daemon.
+
+A request is the JSON object `python app.py --cli` reads from stdin:
+{"answers": {ident: text, ...}}. A result names the most certain disease
+and lists the `DIFFERENTIAL_SIZE` most certain ones as its differential.
+Results are served from the shared result cache when the same answers were
+diagnosed before.
+"""
+
+import json
+
+from ExpertSystem.engine_factory import get_engine_factory
+from ExpertSystem.facts import Answer
+from ExpertSystem.result_cache import answers_key, get_result_cache, split_answer
+
+DIFFERENTIAL_SIZE = 5
+
+
+def result_from_diagnoses(best, ranked):
+    """The result dict for a final best Diagnosis (or None) and the ranked ones."""
+    if best:
+        return {
+            "disease": best.get("disease"),
+            "reasoning": best.get("reasoning"),
+            "confidence": best.get("cf"),
+            "differential": [
+                {"disease": diagnosis["disease"], "confidence": diagnosis["cf"]}
+                for diagnosis in ranked[:DIFFERENTIAL_SIZE]
+            ],
+        }
+    return {"error": "No confident diagnosis could be made."}
+
+
+def result_from_engine(engine):
+    """The result dict for an engine that has finished running."""
+    return result_from_diagnoses(engine.best_diagnosis, engine.differential(DIFFERENTIAL_SIZE))
+
+
+def diagnose(data, cache=None):
+    """Diagnose one CLI request, through `cache` (default: the shared one)."""
+    pairs = []
+    if "answers" in data and isinstance(data["answers"], dict):
+        for key, val in data["answers"].items():
+            pairs.extend((key, text) for text in split_answer(key, val))
+
+    cache = get_result_cache() if cache is None else cache
+    cache_key = answers_key(pairs, cache.version)
+    result = cache.get(cache_key)
+    if result is not None:
+        return result
+
+    engine = get_engine_factory().fork()
+    for ident, text in pairs:
+        engine.declare(Answer(ident=ident, text=text))
+    engine.run()
+
+    result = result_from_engine(engine)
+    cache.put(cache_key, result)
+    return result
+
+
+def diagnose_json(raw_input):
+    """Like `diagnose`, but takes raw JSON and reports every failure as a result."""
+    try:
+        return diagnose(json.loads(raw_input))
+    except json.JSONDecodeError:
+        return {"error": "Invalid JSON format."}
+    except Exception as e:
+        return {"error": f"An unexpected error occurred: {str(e)}"}
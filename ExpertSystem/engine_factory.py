@@ -0,0 +1,266 @@
+"""Build the rule-augmented DermatologyExpert once per process.
+
+`apply_question_flow` and `apply_diagnostic_rules` mutate the class they are
+given and re-create every rule closure, and experta prepares the rule set
+again for each new instance. The factory does both once, validates the
+result, and hands out fresh engines that reuse the prepared rules.
+
+Usage:
+    python -m ExpertSystem.engine_factory
+"""
+
+import logging
+import threading
+import time
+from functools import lru_cache
+
+from experta import Rule
+from experta.matchers import ReteMatcher
+from ExpertSystem.engine import DermatologyExpert, disease_info_lookup
+from ExpertSystem.facts import Answer, Diagnosis, NextQuestion
+from ExpertSystem.kb_artifact import get_knowledge_base
+from ExpertSystem.Questions.diagnosis import apply_diagnostic_rules
+from ExpertSystem.Questions.flow_compiler import rule_declarations
+from ExpertSystem.Questions.question import get_question_by_ident
+from ExpertSystem.Questions.question_flow import apply_question_flow
+from ExpertSystem.snapshot import EngineSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class RuleSetValidationError(Exception):
+    pass
+
+
+class PreparedRulesetMatcher(ReteMatcher):
+    """ReteMatcher that prepares the rule set once per engine class.
+
+    It also keeps its conflict set nodes per instance: the stock matcher
+    caches them in an lru_cache of size one shared by every instance, which
+    thrashes as soon as two engines are live, and snapshot forks need to
+    point at their own copied nodes anyway.
+    """
+
+    def _get_conflict_set_nodes(self):
+        nodes = self.__dict__.get("_conflict_set_nodes")
+        if nodes is None:
+            nodes = ReteMatcher._get_conflict_set_nodes.__wrapped__(self)
+            self._conflict_set_nodes = nodes
+        return nodes
+
+    @staticmethod
+    def prepare_ruleset(engine):
+        engine_class = type(engine)
+        ruleset = engine_class.__dict__.get("_prepared_ruleset")
+        if ruleset is None:
+            ruleset = ReteMatcher.prepare_ruleset(engine)
+            engine_class._prepared_ruleset = ruleset
+        return ruleset
+
+
+def _rules_of(engine_class):
+    return {name: rule for name, rule in vars(engine_class).items() if isinstance(rule, Rule)}
+
+
+def _referenced_idents(ce):
+    if isinstance(ce, Answer):
+        yield ce["ident"]
+    elif isinstance(ce, tuple):
+        for child in ce:
+            yield from _referenced_idents(child)
+
+
+class DermatologyEngineFactory:
+    """Frozen holder of the rule-augmented engine class.
+
+    With a `rule_filter`, only the flow and diagnostic rules it accepts are
+    kept (see ExpertSystem.branch_rules); by default every rule is.
+    """
+
+    def __init__(self, rule_filter=None, class_name="DermatologyExpertWithLogic"):
+        started = time.perf_counter()
+
+        engine_class = type(
+            class_name,
+            (DermatologyExpert,),
+            {"__matcher__": PreparedRulesetMatcher},
+        )
+        apply_question_flow(engine_class)
+        flow_rules = _rules_of(engine_class)
+        apply_diagnostic_rules(engine_class)
+        diagnostic_rules = {
+            name: rule
+            for name, rule in _rules_of(engine_class).items()
+            if name not in flow_rules
+        }
+        if rule_filter is not None:
+            for rules in (flow_rules, diagnostic_rules):
+                for name in [name for name, rule in rules.items() if not rule_filter(rule)]:
+                    delattr(engine_class, name)
+                    del rules[name]
+
+        self._engine_class = engine_class
+        self._flow_rule_names = frozenset(flow_rules)
+        self._diagnostic_rule_names = frozenset(diagnostic_rules)
+        knowledge_base = get_knowledge_base()
+        if knowledge_base is not None and (
+            knowledge_base.flow_rule_names == self._flow_rule_names
+            and knowledge_base.diagnostic_rule_names == self._diagnostic_rule_names
+        ):
+            # Validated when the artifact was built from these same sources.
+            self._warnings = knowledge_base.warnings
+        else:
+            self._warnings = tuple(self._validate(flow_rules, diagnostic_rules))
+        # A filtered rule set repeats a subset of the full set's warnings.
+        log = logger.warning if rule_filter is None else logger.debug
+        for warning in self._warnings:
+            log(warning)
+
+        # The first instance pays for preparing the rule set; later ones reuse
+        # it. Reset, it becomes the golden state every fork starts from.
+        golden = self._engine_class()
+        golden.reset()
+        self._snapshot = EngineSnapshot(golden)
+        self._build_seconds = time.perf_counter() - started
+
+        self._lock = threading.Lock()
+        self._stats = {
+            "create": {"count": 0, "seconds": 0.0, "last_seconds": None},
+            "fork": {"count": 0, "seconds": 0.0, "last_seconds": None},
+        }
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError("DermatologyEngineFactory is frozen")
+        super().__setattr__(name, value)
+
+    @staticmethod
+    def _validate(flow_rules, diagnostic_rules):
+        errors = []
+        warnings = []
+
+        for name, rule in {**flow_rules, **diagnostic_rules}.items():
+            for ident in _referenced_idents(tuple(rule)):
+                if get_question_by_ident(ident) is None:
+                    errors.append(f"{name} tests unknown question '{ident}'")
+
+        for name, rule in flow_rules.items():
+            for fact in rule_declarations(rule):
+                if isinstance(fact, NextQuestion) and get_question_by_ident(fact["ident"]) is None:
+                    errors.append(f"{name} asks unknown question '{fact['ident']}'")
+
+        for name, rule in diagnostic_rules.items():
+            for fact in rule_declarations(rule):
+                if isinstance(fact, Diagnosis) and fact["disease"] not in disease_info_lookup:
+                    warnings.append(
+                        f"{name} diagnoses '{fact['disease']}', which has no DiseaseInfo; "
+                        "age/duration/severity modifiers will not apply"
+                    )
+
+        if errors:
+            raise RuleSetValidationError("; ".join(errors))
+        return warnings
+
+    @property
+    def engine_class(self):
+        return self._engine_class
+
+    @property
+    def warnings(self):
+        return self._warnings
+
+    @property
+    def flow_rule_names(self):
+        return self._flow_rule_names
+
+    @property
+    def diagnostic_rule_names(self):
+        return self._diagnostic_rule_names
+
+    @property
+    def rule_names(self):
+        return self._flow_rule_names | self._diagnostic_rule_names
+
+    def _record(self, kind, started):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            stats = self._stats[kind]
+            stats["count"] += 1
+            stats["seconds"] += elapsed
+            stats["last_seconds"] = elapsed
+
+    def create(self):
+        """Return a new, not yet reset, engine instance."""
+        started = time.perf_counter()
+        engine = self._engine_class()
+        self._record("create", started)
+        return engine
+
+    def fork(self):
+        """Return an engine already in the post-reset state, without resetting."""
+        started = time.perf_counter()
+        engine = self._snapshot.fork()
+        self._record("fork", started)
+        return engine
+
+    def shared_ids(self):
+        """Ids of the objects every fork shares (see ExpertSystem.memory)."""
+        return self._snapshot.shared_ids()
+
+    def timings(self):
+        timings = {
+            "build_seconds": self._build_seconds,
+            "flow_rules": len(self._flow_rule_names),
+            "diagnostic_rules": len(self._diagnostic_rule_names),
+        }
+        with self._lock:
+            for kind, stats in self._stats.items():
+                count = stats["count"]
+                timings[f"{kind}_count"] = count
+                timings[f"{kind}_mean_seconds"] = stats["seconds"] / count if count else None
+                timings[f"{kind}_last_seconds"] = stats["last_seconds"]
+        return timings
+
+
+@lru_cache(maxsize=1)
+def get_engine_factory():
+    """The process-wide factory, built on first use."""
+    return DermatologyEngineFactory()
+
+
+def _create_and_reset_seconds(factory):
+    started = time.perf_counter()
+    factory.create().reset()
+    return time.perf_counter() - started
+
+
+def _legacy_session_seconds():
+    # What every session used to do, on a throwaway subclass so the shared
+    # DermatologyExpert class is left untouched.
+    started = time.perf_counter()
+    engine_class = type("LegacyDermatologyExpert", (DermatologyExpert,), {})
+    engine_class = apply_diagnostic_rules(apply_question_flow(engine_class))
+    engine_class()
+    return time.perf_counter() - started
+
+
+def main(sessions=20):
+    factory = get_engine_factory()
+    for _ in range(sessions):
+        factory.create()
+        factory.fork()
+    timings = factory.timings()
+
+    create_and_reset = [_create_and_reset_seconds(factory) for _ in range(sessions)]
+    legacy = [_legacy_session_seconds() for _ in range(sessions)]
+
+    print(f"Factory build:            {timings['build_seconds'] * 1000:8.2f} ms (once)")
+    print(f"Factory create():         {timings['create_mean_seconds'] * 1000:8.2f} ms")
+    print(f"Factory create()+reset(): {sum(create_and_reset) / sessions * 1000:8.2f} ms")
+    print(f"Factory fork():           {timings['fork_mean_seconds'] * 1000:8.2f} ms")
+    print(f"Per-session rebuild:      {sum(legacy) / sessions * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
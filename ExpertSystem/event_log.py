@@ -0,0 +1,80 @@
+"""Bounded, structured log of certainty factor adjustments.
+
+Every modifier and merge used to append an eagerly formatted string to an
+unbounded list that the API server never drained. RuleEventLog keeps the raw
+facts of each adjustment in a fixed-size ring buffer instead, and formats
+them only when someone reads them.
+
+An event is a tuple (seq, rule, disease, old_cf, new_cf, detail), where seq
+increases by one per event over the life of the log and detail carries the
+extra values a message needs (for merges: the merged-in CF and merge count).
+"""
+
+from collections import deque
+
+DEFAULT_CAPACITY = 256
+
+MESSAGES = {
+    "age_match_bonus": "✅ Age match bonus for {disease}: {old_cf:.3f} + 0.15 = {new_cf:.3f}",
+    "age_mismatch_penalty": "❌ Age mismatch penalty for {disease}: {old_cf:.3f} - 0.2 = {new_cf:.3f}",
+    "duration_match_bonus": "⏰ Duration match bonus for {disease}: {old_cf:.3f} + 0.1 = {new_cf:.3f}",
+    "duration_mismatch_penalty": "⏰ Duration mismatch penalty for {disease}: {old_cf:.3f} - 0.4 = {new_cf:.3f}",
+    "severity_match_bonus": "💪 Severity match bonus for {disease}: {old_cf:.3f} + 0.15 = {new_cf:.3f}",
+    "severity_mismatch_penalty": "💪 Severity mismatch penalty for {disease}: {old_cf:.3f} - 0.15 = {new_cf:.3f}",
+    "combine_duplicate_diagnosis": (
+        "🔄 Combining Diagnosis for {disease}: {old_cf:.3f} + {detail[0]:.3f} "
+        "= {new_cf:.3f} (merge count {detail[1]})"
+    ),
+}
+
+
+def format_event(event):
+    _, rule, disease, old_cf, new_cf, detail = event
+    return MESSAGES[rule].format(disease=disease, old_cf=old_cf, new_cf=new_cf, detail=detail)
+
+
+class RuleEventLog:
+    """Ring buffer of the last `capacity` adjustment events."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self._events = deque(maxlen=capacity)
+        self._next_seq = 0
+        self._drained_seq = 0
+
+    def __len__(self):
+        return len(self._events)
+
+    @property
+    def capacity(self):
+        return self._events.maxlen
+
+    @property
+    def last_seq(self):
+        """Sequence number of the newest event, -1 if none was ever recorded."""
+        return self._next_seq - 1
+
+    @property
+    def dropped(self):
+        """Events pushed out of the buffer by newer ones."""
+        return self._next_seq - len(self._events)
+
+    def record(self, rule, disease, old_cf, new_cf, detail=None):
+        self._events.append((self._next_seq, rule, disease, old_cf, new_cf, detail))
+        self._next_seq += 1
+
+    def events(self, since=0):
+        """Buffered events with seq >= `since`, oldest first."""
+        return [event for event in self._events if event[0] >= since]
+
+    def messages(self, since=0):
+        return [format_event(event) for event in self.events(since)]
+
+    def drain(self):
+        """Formatted messages not drained before, for incremental display."""
+        events = self.events(self._drained_seq)
+        self._drained_seq = self._next_seq
+        return [format_event(event) for event in events]
+
+    def clear(self):
+        self._events.clear()
+        self._drained_seq = self._next_seq
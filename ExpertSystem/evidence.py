@@ -0,0 +1,263 @@
+"""Per-disease certainty factor accumulator.
+
+The age, duration and severity modifiers and the duplicate merge used to be
+rules that retracted a Diagnosis fact and declared an adjusted copy, so every
+adjustment cost a retract, a declare and a full Rete re-match, and the merge
+rule joined every Diagnosis against every other one. The accumulator keeps one
+entry per disease and applies the same adjustments in place.
+
+Semantics (the same certainty factors as the former rules):
+
+* A new piece of evidence first receives every modifier whose answer is
+  known: age (+0.15 / -0.2), then duration (+0.1 / -0.4, only once age was
+  applied), then severity (+0.15 when age and duration were applied and the
+  severity is one of the disease's levels, -0.15 when age was applied and it
+  is not; the penalty also closes the duration step).
+* If the disease already has an entry, the two are combined with `combine_cf`
+  and the reasoning strings are joined with "; ", older evidence first. The
+  combined entry starts with no modifiers applied, so they are applied once
+  more on top of it.
+* An answer that arrives after evidence was recorded applies its modifier to
+  every entry still waiting for it.
+* Diseases without a DiseaseInfo never receive modifiers.
+
+`merge_count` is the number of merges folded into an entry. The old rule
+reset it whenever a modifier re-declared the fact, so it was almost always 1.
+
+The merged reasoning holds the same fragments as the old rule's but not
+always in the same order: the rule joined the two facts in whatever order
+the agenda paired them, which put the newer evidence first in some merges.
+Any session that merges a disease can show this; the certainty factors and
+the best diagnosis are unaffected.
+
+Each declared Diagnosis is merged with one dict lookup and one `combine_cf`,
+so n duplicates of a disease cost O(n) in total instead of the rule's O(n²)
+join. `python -m benchmarks.duplicate_merge` and `benchmarks.cf_accumulator`
+check the merged results against the baseline engine and count the
+reasonings whose fragments come in another order.
+
+The entries are also kept ranked by certainty factor (ties in order of first
+evidence), updated on every change, so the differential diagnosis can be read
+at any point of a session without scanning working memory.
+"""
+
+import bisect
+import copy
+
+from ExpertSystem.answers import DiseaseProfile, normalize_answer
+from ExpertSystem.facts import Diagnosis
+
+MODIFIER_IDENTS = ("age", "duration", "severity")
+
+
+def combine_cf(cf1, cf2):
+    if cf1 >= 0 and cf2 >= 0:
+        return cf1 + cf2 * (1 - cf1)
+    elif cf1 < 0 and cf2 < 0:
+        return cf1 + cf2 * (1 + cf1)
+    else:
+        denominator = 1 - min(abs(cf1), abs(cf2))
+        return (cf1 + cf2) / denominator if denominator != 0 else (cf1 + cf2)
+
+
+class _Evidence:
+    __slots__ = (
+        "disease",
+        "cf",
+        "reasoning",
+        "age_boosted",
+        "duration_boosted",
+        "severity_adjusted",
+        "merge_count",
+    )
+
+    def __init__(self, disease, cf, reasoning, merge_count=0):
+        self.disease = disease
+        self.cf = cf
+        self.reasoning = reasoning
+        self.age_boosted = False
+        self.duration_boosted = False
+        self.severity_adjusted = False
+        self.merge_count = merge_count
+
+    def adjust(self, delta, reason):
+        old_cf = self.cf
+        self.cf = combine_cf(old_cf, delta)
+        self.reasoning = f"{self.reasoning}; {reason}"
+        return old_cf
+
+    def as_fact(self):
+        return Diagnosis(
+            disease=self.disease,
+            cf=self.cf,
+            reasoning=self.reasoning,
+            age_boosted=self.age_boosted,
+            duration_boosted=self.duration_boosted,
+            severity_adjusted=self.severity_adjusted,
+            merge_count=self.merge_count,
+        )
+
+
+class DiagnosisAccumulator:
+    """One running certainty factor per disease.
+
+    `disease_info` maps a disease name to its DiseaseInfo fact and `log` is
+    the engine's RuleEventLog. Answers are normalized once, on arrival (see
+    ExpertSystem.answers).
+    """
+
+    def __init__(self, disease_info, log):
+        self._profiles = {name: DiseaseProfile(info) for name, info in disease_info.items()}
+        # ident -> (answer text, normalized value)
+        self._answers = {}
+        self._entries = {}
+        # sorted (-cf, first evidence order, disease) keys, and each disease's key
+        self._ranking = []
+        self._rank_keys = {}
+        self.log = log
+
+    def __deepcopy__(self, memo):
+        # Engine snapshots deep-copy their attributes; the disease profiles
+        # are immutable, so only the per-session state is copied.
+        clone = object.__new__(type(self))
+        clone._profiles = self._profiles
+        clone._answers = dict(self._answers)
+        clone._entries = {name: copy.copy(entry) for name, entry in self._entries.items()}
+        clone._ranking = list(self._ranking)
+        clone._rank_keys = dict(self._rank_keys)
+        clone.log = copy.deepcopy(self.log, memo)
+        return clone
+
+    def clear(self):
+        self._answers.clear()
+        self._entries.clear()
+        self._ranking.clear()
+        self._rank_keys.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, disease):
+        return disease in self._entries
+
+    def set_answer(self, ident, text, value=None):
+        """Record an age/duration/severity answer and apply it where pending.
+
+        `value` is the normalized answer, for callers that already have it.
+        """
+        if ident not in MODIFIER_IDENTS or ident in self._answers:
+            return
+        if value is None:
+            value = normalize_answer(ident, text)
+        self._answers[ident] = (text, value)
+        for entry in self._entries.values():
+            self._apply_modifiers(entry)
+            self._rerank(entry)
+
+    def add(self, disease, cf, reasoning):
+        """Fold one piece of evidence for `disease` into its running entry."""
+        entry = _Evidence(disease, cf, reasoning)
+        self._apply_modifiers(entry)
+
+        current = self._entries.get(disease)
+        if current is not None:
+            combined = _Evidence(
+                disease,
+                combine_cf(current.cf, entry.cf),
+                f"{current.reasoning}; {entry.reasoning}",
+                merge_count=current.merge_count + 1,
+            )
+            self.log.record(
+                "combine_duplicate_diagnosis",
+                disease,
+                current.cf,
+                combined.cf,
+                (entry.cf, combined.merge_count),
+            )
+            self._apply_modifiers(combined)
+            entry = combined
+        self._entries[disease] = entry
+        self._rerank(entry)
+
+    def _rerank(self, entry):
+        old_key = self._rank_keys.get(entry.disease)
+        if old_key is None:
+            order = len(self._rank_keys)
+        elif -old_key[0] == entry.cf:
+            return
+        else:
+            order = old_key[1]
+            del self._ranking[bisect.bisect_left(self._ranking, old_key)]
+        key = (-entry.cf, order, entry.disease)
+        bisect.insort(self._ranking, key)
+        self._rank_keys[entry.disease] = key
+
+    def _apply_modifiers(self, entry):
+        profile = self._profiles.get(entry.disease)
+        if profile is None:
+            return
+
+        age = self._answers.get("age")
+        if age is not None and not entry.age_boosted:
+            text, years = age
+            age_min, age_max = profile.age_min, profile.age_max
+            if age_min <= years <= age_max:
+                old_cf = entry.adjust(0.15, f"age match bonus ({text} in {age_min}-{age_max})")
+                self.log.record("age_match_bonus", entry.disease, old_cf, entry.cf)
+            else:
+                old_cf = entry.adjust(
+                    -0.2, f"age mismatch penalty ({text} not in {age_min}-{age_max})"
+                )
+                self.log.record("age_mismatch_penalty", entry.disease, old_cf, entry.cf)
+            entry.age_boosted = True
+
+        duration = self._answers.get("duration")
+        if duration is not None and entry.age_boosted and not entry.duration_boosted:
+            text, bucket = duration
+            disease_duration = profile.info["common_duration"]
+            if bucket in profile.duration_buckets:
+                old_cf = entry.adjust(
+                    0.1, f"duration match bonus ({text} matches {disease_duration})"
+                )
+                self.log.record("duration_match_bonus", entry.disease, old_cf, entry.cf)
+            else:
+                old_cf = entry.adjust(
+                    -0.4, f"duration mismatch penalty ({text} vs {disease_duration})"
+                )
+                self.log.record("duration_mismatch_penalty", entry.disease, old_cf, entry.cf)
+            entry.duration_boosted = True
+
+        severity = self._answers.get("severity")
+        if (
+            severity is not None
+            and profile.severities
+            and entry.age_boosted
+            and not entry.severity_adjusted
+        ):
+            text, level = severity
+            levels = profile.info["severity_levels"]
+            if level not in profile.severities:
+                old_cf = entry.adjust(-0.15, f"severity mismatch penalty ({text} not in {levels})")
+                self.log.record("severity_mismatch_penalty", entry.disease, old_cf, entry.cf)
+            elif entry.duration_boosted:
+                old_cf = entry.adjust(0.15, f"severity match bonus ({text} in {levels})")
+                self.log.record("severity_match_bonus", entry.disease, old_cf, entry.cf)
+            else:
+                return
+            entry.duration_boosted = True
+            entry.severity_adjusted = True
+
+    def diagnoses(self):
+        """Current diagnoses as Diagnosis facts, in order of first evidence."""
+        return [entry.as_fact() for entry in self._entries.values()]
+
+    def top(self, k=None):
+        """The `k` (default all) most certain diagnoses, highest CF first."""
+        ranking = self._ranking if k is None else self._ranking[:k]
+        return [self._entries[disease].as_fact() for _, _, disease in ranking]
+
+    def best(self):
+        """The Diagnosis with the highest certainty factor, or None."""
+        if not self._ranking:
+            return None
+        return self._entries[self._ranking[0][2]].as_fact()
@@ -0,0 +1,114 @@
+"""LLM explanations of finished sessions, generated once in the background.
+
+The status endpoint used to call the LLM on every poll of a finished
+session and wait for it. ExplanationService starts one explanation per
+session, on its own small thread pool, as soon as the session has a result;
+the session carries the explanation and its state:
+
+    session["explanation_status"]  None (not started), PENDING, READY or FAILED
+    session["explanation"]         the text once READY
+
+Listeners added with `add_listener(fn)` are called as `fn(session)` on the
+pool thread once the state is READY or FAILED.
+
+Configuration for the process-wide service (`get_explanation_service()`):
+    DERMATOLOGY_EXPLANATION_WORKERS   concurrent LLM calls (default 2)
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+WORKERS_ENV = "DERMATOLOGY_EXPLANATION_WORKERS"
+DEFAULT_WORKERS = 2
+
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+
+logger = logging.getLogger(__name__)
+
+
+def result_text(result):
+    """The diagnosis summary the LLM is asked to explain."""
+    return (
+        f"Primary Diagnosis: {result['disease']}\n"
+        f"Confidence: {result['confidence'] * 100:.1f}%\n"
+        f"Reasoning: {result['reasoning']}"
+    )
+
+
+def _explain_with_llm(text):
+    # Imported per call: the LLM client is slow to import and only needed here.
+    from AI.llm import explain_result_with_llm
+
+    return explain_result_with_llm(text)
+
+
+class ExplanationService:
+    """Generates each session's explanation once, off the request path."""
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, explain=None):
+        self.max_workers = max_workers
+        self._explain = explain or _explain_with_llm
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="explanation")
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.started = 0
+        self.ready = 0
+        self.failed = 0
+
+    def start(self, session):
+        """Start explaining the session's result, unless already started; return whether it did."""
+        result = session.get("result")
+        with self._lock:
+            if session.get("explanation_status") is not None or not result or "disease" not in result:
+                return False
+            session["explanation_status"] = PENDING
+            self.started += 1
+        self._pool.submit(self._generate, session, result_text(result))
+        return True
+
+    def add_listener(self, listener):
+        """Call `listener(session)` whenever an explanation is ready or has failed."""
+        self._listeners.append(listener)
+
+    def _generate(self, session, text):
+        try:
+            explanation = self._explain(text)
+        except Exception:
+            logger.exception("Explanation of session %s failed", session.get("session_id"))
+            with self._lock:
+                self.failed += 1
+            session["explanation_status"] = FAILED
+        else:
+            session["explanation"] = explanation
+            with self._lock:
+                self.ready += 1
+            session["explanation_status"] = READY
+        for listener in self._listeners:
+            try:
+                listener(session)
+            except Exception:
+                logger.exception("Explanation listener failed")
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "started": self.started,
+                "ready": self.ready,
+                "failed": self.failed,
+                "pending": self.started - self.ready - self.failed,
+            }
+
+
+@lru_cache(maxsize=1)
+def get_explanation_service():
+    """The process-wide service, configured from the environment on first use."""
+    return ExplanationService(max_workers=int(os.environ.get(WORKERS_ENV, DEFAULT_WORKERS)))
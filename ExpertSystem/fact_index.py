@@ -0,0 +1,96 @@
+"""Fact list with secondary indexes by fact class and by key field.
+
+Callers used to find NextQuestion, Answer and `results_processed` facts by
+scanning every fact in working memory. IndexedFactList keeps the lookups
+up to date on declare and retract, so they cost O(1) plus the size of the
+result.
+"""
+
+from experta import Fact
+from experta.factlist import FactList
+from ExpertSystem.facts import Answer, Diagnosis, DiseaseInfo, NextQuestion
+
+# fact class -> field whose value facts are indexed by
+KEY_FIELDS = {
+    Answer: "ident",
+    NextQuestion: "ident",
+    Diagnosis: "disease",
+    DiseaseInfo: "name",
+    Fact: "id",
+}
+
+
+class IndexedFactList(FactList):
+    def __init__(self):
+        super().__init__()
+        self._by_class = {}
+        self._by_key = {}
+
+    @classmethod
+    def from_factlist(cls, facts):
+        indexed = cls()
+        indexed.update(facts)
+        indexed.last_index = facts.last_index
+        indexed.reference_counter = facts.reference_counter.copy()
+        indexed.added = list(facts.added)
+        indexed.removed = list(facts.removed)
+        indexed.duplication = facts.duplication
+        for idx, fact in facts.items():
+            indexed._index(idx, fact)
+        return indexed
+
+    def copy_indexes(self, other):
+        """Give this list (a copy of `other`'s facts) its own copy of the indexes."""
+        self._by_class = {cls: dict(facts) for cls, facts in other._by_class.items()}
+        self._by_key = {
+            cls: {value: dict(facts) for value, facts in values.items()}
+            for cls, values in other._by_key.items()
+        }
+
+    def _index(self, idx, fact):
+        cls = type(fact)
+        self._by_class.setdefault(cls, {})[idx] = fact
+        field = KEY_FIELDS.get(cls)
+        if field is not None and field in fact:
+            values = self._by_key.setdefault(cls, {})
+            values.setdefault(fact[field], {})[idx] = fact
+
+    def _unindex(self, idx, fact):
+        cls = type(fact)
+        facts = self._by_class[cls]
+        facts.pop(idx, None)
+        if not facts:
+            del self._by_class[cls]
+        field = KEY_FIELDS.get(cls)
+        if field is not None and field in fact:
+            values = self._by_key[cls]
+            matching = values[fact[field]]
+            matching.pop(idx, None)
+            if not matching:
+                del values[fact[field]]
+                if not values:
+                    del self._by_key[cls]
+
+    def declare(self, fact):
+        declared = super().declare(fact)
+        if declared is not None:
+            self._index(declared.__factid__, declared)
+        return declared
+
+    def retract(self, idx_or_fact):
+        idx = idx_or_fact if isinstance(idx_or_fact, int) else idx_or_fact.__factid__
+        fact = self.get(idx)
+        idx = super().retract(idx_or_fact)
+        self._unindex(idx, fact)
+        return idx
+
+    def of_class(self, cls):
+        """Facts whose class is exactly `cls`, in declaration order."""
+        return list(self._by_class.get(cls, {}).values())
+
+    def with_key(self, cls, value):
+        """Facts of class `cls` whose key field (see KEY_FIELDS) equals `value`."""
+        return list(self._by_key.get(cls, {}).get(value, {}).values())
+
+    def has_key(self, cls, value):
+        return value in self._by_key.get(cls, {})
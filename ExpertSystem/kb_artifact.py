@@ -0,0 +1,193 @@
+"""Prebuilt knowledge base artifact for fast process startup.
+
+Every process that serves diagnoses (the API server, the daemon, batch and
+DAG pool workers) used to rebuild the same derived data on startup: the
+question flow table, the diagnostic rule features, and a validation pass
+over every rule. This module compiles all of that into one binary file:
+
+    header   magic, format version, knowledge base version (64 hex chars),
+             SHA-256 of the payload
+    payload  marshal dump of plain dicts, lists, tuples and scalars
+
+Loading hashes and decodes the payload straight from a memory map of the
+file, without reading it into an intermediate buffer; `marshal.loads` still
+builds the objects on each process's own heap, so processes do not share
+them. Decoding builtins costs a fraction of a millisecond. The knowledge
+base version is the same source hash the result cache and the decision DAG
+are keyed by; an artifact built from other sources is refused.
+
+The experta rule network itself is not stored: its nodes hold the rule
+closures, which cannot be serialized. It is still built per process by
+ExpertSystem.engine_factory. Neither are the questions and the DiseaseInfo
+records: the engine needs them as experta Facts, and question.py and
+disease.py build those in a few milliseconds, about what decoding and
+converting them would cost.
+
+Usage:
+    python -m ExpertSystem.kb_artifact --out knowledge_base.kb
+    python -m ExpertSystem.kb_artifact --info knowledge_base.kb
+
+Set DERMATOLOGY_KB_ARTIFACT to the file to have `get_knowledge_base()`, and
+through it the flow resolver, the engine factory and the batch scorer, use it.
+"""
+
+import argparse
+import hashlib
+import logging
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+import time
+from functools import lru_cache
+
+from ExpertSystem.result_cache import knowledge_base_version
+
+logger = logging.getLogger(__name__)
+
+KB_ENV = "DERMATOLOGY_KB_ARTIFACT"
+MAGIC = b"DSKB"
+FORMAT_VERSION = 3
+# marshal format 4 is readable by every Python 3.4+ interpreter.
+MARSHAL_VERSION = 4
+HEADER = struct.Struct("<4sH64s32s")
+
+
+class KnowledgeBaseArtifactError(Exception):
+    pass
+
+
+def build_payload():
+    """The plain-data form of everything the artifact carries."""
+    from ExpertSystem.batch_scorer import extract_diagnostic_rules
+    from ExpertSystem.engine_factory import get_engine_factory
+    from ExpertSystem.Questions.flow_compiler import compile_question_flow
+
+    factory = get_engine_factory()
+    return {
+        "flow_table": compile_question_flow(),
+        "diagnostic_rules": extract_diagnostic_rules(),
+        "flow_rule_names": sorted(factory.flow_rule_names),
+        "diagnostic_rule_names": sorted(factory.diagnostic_rule_names),
+        "warnings": list(factory.warnings),
+    }
+
+
+def write_artifact(path, payload=None, version=None):
+    """Serialize `payload` (default: `build_payload()`) to `path` atomically."""
+    if payload is None:
+        payload = build_payload()
+    version = version or knowledge_base_version()
+    body = marshal.dumps(payload, MARSHAL_VERSION)
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, version.encode("ascii"), hashlib.sha256(body).digest()
+    )
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            f.write(body)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return HEADER.size + len(body)
+
+
+class KnowledgeBaseArtifact:
+    """The contents of a loaded artifact."""
+
+    def __init__(self, payload, version, content_hash):
+        self.version = version
+        self.content_hash = content_hash
+        self.flow_table = payload["flow_table"]
+        self.diagnostic_rules = payload["diagnostic_rules"]
+        self.flow_rule_names = frozenset(payload["flow_rule_names"])
+        self.diagnostic_rule_names = frozenset(payload["diagnostic_rule_names"])
+        self.warnings = tuple(payload["warnings"])
+
+    @classmethod
+    def load(cls, path, version=None):
+        """Map and decode `path`; raises KnowledgeBaseArtifactError if unusable."""
+        expected = version or knowledge_base_version()
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if len(mapped) < HEADER.size:
+                raise KnowledgeBaseArtifactError(f"{path} is truncated")
+            magic, fmt, kb_version, digest = HEADER.unpack_from(mapped)
+            if magic != MAGIC:
+                raise KnowledgeBaseArtifactError(f"{path} is not a knowledge base artifact")
+            if fmt != FORMAT_VERSION:
+                raise KnowledgeBaseArtifactError(f"Unsupported artifact format: {fmt}")
+            kb_version = kb_version.decode("ascii")
+            if kb_version != expected:
+                raise KnowledgeBaseArtifactError(
+                    f"{path} was built from another knowledge base version"
+                )
+            with memoryview(mapped)[HEADER.size :] as body:
+                if hashlib.sha256(body).digest() != digest:
+                    raise KnowledgeBaseArtifactError(f"{path} is corrupt")
+                payload = marshal.loads(body)
+        return cls(payload, kb_version, digest.hex())
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "content_hash": self.content_hash,
+            "flow_states": len(self.flow_table["questions"]),
+            "flow_rules": len(self.flow_rule_names),
+            "diagnostic_rules": len(self.diagnostic_rule_names),
+        }
+
+
+@lru_cache(maxsize=1)
+def get_knowledge_base():
+    """The artifact named by KB_ENV, or None if unset, missing or stale."""
+    path = os.environ.get(KB_ENV)
+    if not path:
+        return None
+    try:
+        return KnowledgeBaseArtifact.load(path)
+    except (OSError, ValueError, EOFError, KnowledgeBaseArtifactError) as e:
+        logger.warning("Not using the knowledge base artifact at %s: %s", path, e)
+        return None
+
+
+def _compile_seconds():
+    from ExpertSystem.batch_scorer import extract_diagnostic_rules
+    from ExpertSystem.Questions.flow_compiler import compile_question_flow
+
+    started = time.perf_counter()
+    compile_question_flow()
+    extract_diagnostic_rules()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect the knowledge base artifact.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--out", help="write the artifact to this path")
+    group.add_argument("--info", metavar="PATH", help="load an artifact and describe it")
+    args = parser.parse_args()
+
+    if args.out:
+        started = time.perf_counter()
+        size = write_artifact(args.out)
+        elapsed = time.perf_counter() - started
+        print(f"Wrote {args.out} ({size / 1024:.1f} KB) in {elapsed:.2f} s")
+        return
+
+    started = time.perf_counter()
+    artifact = KnowledgeBaseArtifact.load(args.info)
+    load_seconds = time.perf_counter() - started
+    for key, value in artifact.stats().items():
+        print(f"{key + ':':<18} {value}")
+    print(f"{'load:':<18} {load_seconds * 1000:.2f} ms")
+    print(f"{'compile instead:':<18} {_compile_seconds() * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Approximate memory accounting for object graphs.
+
+`retained_bytes` adds up `sys.getsizeof` over everything reachable from a
+root, following containers, instance `__dict__`s and slots. Classes,
+modules and functions are code, not per-object state, and are not followed.
+Objects whose id is in `shared` (typically everything reachable from a
+golden engine, see `EngineSnapshot.shared_ids`) are neither counted nor
+followed, so a forked session is charged only for what it does not share.
+"""
+
+import sys
+import types
+from collections import deque
+
+_NOT_FOLLOWED = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+    types.CodeType,
+)
+_ITERABLES = (list, tuple, set, frozenset, deque)
+
+
+def _referents(obj):
+    if isinstance(obj, dict):
+        # Fact is a dict subclass that also has a __dict__.
+        yield from obj.keys()
+        yield from obj.values()
+    elif isinstance(obj, _ITERABLES):
+        yield from obj
+    attributes = getattr(obj, "__dict__", None)
+    if isinstance(attributes, dict):
+        yield attributes
+    for cls in type(obj).__mro__:
+        for name in cls.__dict__.get("__slots__", ()):
+            if name not in ("__dict__", "__weakref__") and hasattr(obj, name):
+                yield getattr(obj, name)
+
+
+def walk(root, shared=frozenset()):
+    """Yield every object reachable from `root` once, skipping `shared` ids."""
+    seen = set(shared)
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _NOT_FOLLOWED):
+            continue
+        seen.add(id(obj))
+        yield obj
+        stack.extend(_referents(obj))
+
+
+def reachable_ids(root):
+    return frozenset(id(obj) for obj in walk(root))
+
+
+def retained_bytes(root, shared=frozenset()):
+    """Bytes of the objects reachable from `root` that are not in `shared`.
+
+    A container that is mutated during the walk raises RuntimeError; callers
+    that measure live objects from another thread retry later.
+    """
+    return sum(sys.getsizeof(obj) for obj in walk(root, shared))
@@ -0,0 +1,227 @@
+"""Seeded synthetic patients sampled from the disease knowledge base.
+
+Each patient is drawn from one DiseaseInfo:
+
+* age       uniform in [age_min, age_max]
+* duration  a DURATION_MAPPING answer matching `common_duration` (any
+            answer when none matches)
+* severity  one of `severity_levels`
+* locations one to three of `common_locations`
+* triggers  up to two of `triggers`
+* symptoms  each of `common_symptoms` with the probability of its weight
+            (SYMPTOM_PROBABILITY), plus rare unrelated symptoms
+
+Free-text entries such as "face (cheeks, nose)" contribute every part that
+is a valid answer to the matching question.
+
+The patient then answers the question flow exactly as a user would, walking
+the compiled flow table and only answering the questions it asks. A symptom
+question is answered from the sampled symptoms. A question the profile says
+nothing about (such as `has_symptom_lump_or_growth`) follows the patient's
+symptoms: it is answered "yes" when the symptoms only asked about behind its
+"yes" outweigh (by the probabilities above) those only asked about behind
+its "no", and the other way round. The trigger questions are answered from
+the sampled triggers.
+
+Records are {"id", "disease", "answers"}, the request format of
+`python app.py --cli` and `--batch` plus the source disease, one JSON object
+per line. Record `i` of seed `s` only depends on (s, i), so a corpus can be
+produced in shards with `--start`.
+
+Usage:
+    python -m ExpertSystem.patient_generator --count 1000000 --seed 7 > patients.jsonl
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+from functools import lru_cache
+
+from ExpertSystem.Data.disease import DURATION_MAPPING, diseases
+from ExpertSystem.Questions.flow_compiler import WILDCARD, get_resolver
+from ExpertSystem.Questions.question import get_question_by_ident
+
+SYMPTOM_PREFIX = "has_symptom_"
+SYMPTOM_PROBABILITY = {"high": 0.9, "medium": 0.6, "low": 0.3}
+# Chance of reporting a symptom the disease does not list.
+UNRELATED_SYMPTOM_PROBABILITY = 0.03
+MAX_LOCATIONS = 3
+MAX_TRIGGERS = 2
+
+# yes/no trigger questions -> triggers that make the answer "yes"
+TRIGGER_QUESTIONS = {
+    "trigger_contact_related": frozenset(
+        {"allergens", "chemicals", "fragrances", "metals", "nickel", "plants", "poison_ivy",
+         "skin_contact"}
+    ),
+    "trigger_medications": frozenset(
+        {"antibiotics", "birth_control_pills", "chemotherapy", "medications", "nsaids"}
+    ),
+}
+
+
+def _terms(entries, valid):
+    """Valid answers named by `entries`, including the parts in parentheses."""
+    terms = []
+    for entry in entries:
+        for part in re.split(r"[(),]", entry):
+            part = part.strip().replace(" ", "_")
+            if part in valid and part not in terms:
+                terms.append(part)
+    return terms
+
+
+class DiseaseSampler:
+    """The answer choices of one DiseaseInfo, resolved against the questions."""
+
+    def __init__(self, info):
+        self.name = info["name"]
+        self.age_range = (info["age_min"], info["age_max"])
+        self.durations = [
+            text for text, matches in DURATION_MAPPING.items()
+            if info["common_duration"] in matches
+        ] or list(DURATION_MAPPING)
+        severities = get_question_by_ident("severity")["valid"]
+        self.severities = [s for s in info["severity_levels"] if s in severities] or severities
+        self.locations = _terms(
+            info["common_locations"], set(get_question_by_ident("locations")["valid"])
+        ) or list(get_question_by_ident("locations")["valid"])
+        self.triggers = _terms(info["triggers"], set(get_question_by_ident("triggers")["valid"]))
+        self.symptoms = [
+            (symptom, SYMPTOM_PROBABILITY.get(weight, UNRELATED_SYMPTOM_PROBABILITY))
+            for symptom, weight in info["common_symptoms"].items()
+        ]
+
+    def sample(self, rng):
+        """A new patient: (fixed answers, {symptom: probability}, trigger set)."""
+        answers = {
+            "age": str(rng.randint(*self.age_range)),
+            "duration": rng.choice(self.durations),
+            "severity": rng.choice(self.severities),
+            "locations": rng.sample(
+                self.locations, rng.randint(1, min(MAX_LOCATIONS, len(self.locations)))
+            ),
+        }
+        symptoms = {symptom: p for symptom, p in self.symptoms if rng.random() < p}
+        triggers = set(
+            rng.sample(self.triggers, rng.randint(0, min(MAX_TRIGGERS, len(self.triggers))))
+        )
+        return answers, symptoms, triggers
+
+
+def _reachable_symptoms(resolver, state, memo):
+    if state not in memo:
+        memo[state] = frozenset()  # guards against cycles; the flow has none
+        ident = resolver.question(state)
+        found = set()
+        if ident is not None:
+            if ident.startswith(SYMPTOM_PREFIX):
+                found.add(ident[len(SYMPTOM_PREFIX):])
+            for next_state in resolver.edges(state).values():
+                found |= _reachable_symptoms(resolver, next_state, memo)
+        memo[state] = frozenset(found)
+    return memo[state]
+
+
+@lru_cache(maxsize=1)
+def _branch_symptoms():
+    """state -> (symptoms only asked behind "yes", only behind "no") to its question."""
+    resolver = get_resolver()
+    memo = {}
+    branches = {}
+    for state in range(resolver.state_count):
+        edges = resolver.edges(state)
+        if "yes" not in edges:
+            continue
+        yes = _reachable_symptoms(resolver, edges["yes"], memo)
+        no_state = edges.get("no", edges.get(WILDCARD))
+        no = _reachable_symptoms(resolver, no_state, memo) if no_state is not None else frozenset()
+        branches[state] = (yes - no, no - yes)
+    return branches
+
+
+@lru_cache(maxsize=1)
+def _all_samplers():
+    return tuple(DiseaseSampler(info) for info in diseases)
+
+
+def _samplers(disease_names=None):
+    if not disease_names:
+        return _all_samplers()
+    samplers = tuple(s for s in _all_samplers() if s.name in disease_names)
+    unknown = set(disease_names) - {s.name for s in samplers}
+    if unknown:
+        raise ValueError(f"No DiseaseInfo named {', '.join(sorted(unknown))}")
+    return samplers
+
+
+def _answer(ident, state, fixed, symptoms, triggers, known, rng):
+    if ident in fixed:
+        return fixed[ident]
+    if ident in TRIGGER_QUESTIONS:
+        return "yes" if triggers & TRIGGER_QUESTIONS[ident] else "no"
+    if ident.startswith(SYMPTOM_PREFIX):
+        symptom = ident[len(SYMPTOM_PREFIX):]
+        if symptom in symptoms:
+            return "yes"
+        if symptom in known:
+            return "no"
+    yes_only, no_only = _branch_symptoms().get(state, (frozenset(), frozenset()))
+    behind_yes = sum(symptoms[symptom] for symptom in symptoms.keys() & yes_only)
+    behind_no = sum(symptoms[symptom] for symptom in symptoms.keys() & no_only)
+    if behind_yes != behind_no:
+        return "yes" if behind_yes > behind_no else "no"
+    return "yes" if rng.random() < UNRELATED_SYMPTOM_PROBABILITY else "no"
+
+
+def generate_patient(seed, index, samplers=None):
+    """Record `index` of the corpus for `seed`, drawn from `samplers` (default: all)."""
+    rng = random.Random(seed * 2**32 + index)
+    samplers = samplers or _all_samplers()
+    sampler = samplers[rng.randrange(len(samplers))]
+    fixed, symptoms, triggers = sampler.sample(rng)
+    known = {symptom for symptom, _ in sampler.symptoms}
+
+    resolver = get_resolver()
+    state = resolver.start_state
+    answers = {}
+    ident = resolver.question(state)
+    while ident is not None:
+        value = _answer(ident, state, fixed, symptoms, triggers, known, rng)
+        answers[ident] = value
+        state = resolver.advance(state, ident, value if isinstance(value, str) else value[0])
+        ident = resolver.question(state)
+    return {"id": index, "disease": sampler.name, "answers": answers}
+
+
+def generate_patients(count, seed=0, start=0, disease_names=None):
+    """Yield records `start` .. `start + count - 1` of the corpus for `seed`."""
+    samplers = _samplers(disease_names)
+    for index in range(start, start + count):
+        yield generate_patient(seed, index, samplers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic patient generator (JSON Lines)")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start", type=int, default=0, help="index of the first record")
+    parser.add_argument(
+        "--disease", action="append", help="only sample this DiseaseInfo name (repeatable)"
+    )
+    parser.add_argument("--out", help="write here instead of stdout")
+    args = parser.parse_args()
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        for record in generate_patients(args.count, args.seed, args.start, args.disease):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    finally:
+        if args.out:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
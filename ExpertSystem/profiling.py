@@ -0,0 +1,235 @@
+"""Opt-in per-rule profiling for DermatologyExpert.
+
+    profiler = RuleProfiler()
+    engine.enable_profiling(profiler)
+    ... declare / run ...
+    profiler.to_json()      # per-rule counts and timings, agenda samples
+    profiler.to_folded()    # collapsed stacks for flamegraph.pl / speedscope
+
+One profiler can be shared by many engines to aggregate a whole workload.
+Counts and total times are exact. The p95 is computed over a uniform
+reservoir sample of at most `max_duration_samples` firing times per rule, so
+a long-lived profiler uses bounded memory; it is exact until a rule has
+fired that many times.
+An engine without a profiler runs the stock experta loop; the only cost is a
+single attribute check per `run()` call.
+
+Usage:
+    python -m ExpertSystem.profiling [--json out.json] [--folded out.folded]
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+
+from experta import watchers
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _rule_origin(rule):
+    """Short name of the module that defines the rule (question_flow, diagnosis, ...)."""
+    module = getattr(rule._wrapped, "__module__", None) or "unknown"
+    return module.rsplit(".", 1)[-1]
+
+
+class _RuleStats:
+    __slots__ = ("origin", "salience", "activations", "firings", "seconds", "durations")
+
+    def __init__(self, rule):
+        self.origin = _rule_origin(rule)
+        self.salience = rule.salience
+        self.activations = 0
+        self.firings = 0
+        self.seconds = 0.0
+        self.durations = []
+
+
+class _ProfilingStrategy:
+    """Wraps the engine's strategy to count activations as they are added."""
+
+    def __init__(self, strategy, profiler):
+        self.wrapped = strategy
+        self.profiler = profiler
+
+    def update_agenda(self, agenda, added, removed):
+        self.wrapped.update_agenda(agenda, added, removed)
+        self.profiler._record_agenda(agenda, added)
+
+
+class RuleProfiler:
+    """Activation and firing counts, wall time per rule, and agenda size."""
+
+    def __init__(self, max_agenda_samples=100000, max_duration_samples=10000):
+        self._lock = threading.Lock()
+        self._rules = {}
+        self._agenda_samples = []
+        self._max_agenda_samples = max_agenda_samples
+        self._max_duration_samples = max_duration_samples
+        self._random = random.Random(0)
+        self._started = time.perf_counter()
+        self._firings = 0
+
+    def _stats(self, rule):
+        stats = self._rules.get(rule.__name__)
+        if stats is None:
+            stats = self._rules[rule.__name__] = _RuleStats(rule)
+        return stats
+
+    def _record_agenda(self, agenda, added):
+        with self._lock:
+            for activation in added:
+                self._stats(activation.rule).activations += 1
+            if len(self._agenda_samples) < self._max_agenda_samples:
+                self._agenda_samples.append(
+                    (time.perf_counter() - self._started, self._firings, len(agenda.activations))
+                )
+
+    def _record_firing(self, rule, seconds):
+        with self._lock:
+            stats = self._stats(rule)
+            stats.firings += 1
+            stats.seconds += seconds
+            if len(stats.durations) < self._max_duration_samples:
+                stats.durations.append(seconds)
+            else:
+                # Reservoir sampling: the n-th firing replaces a random
+                # sample with probability max_duration_samples / n.
+                slot = self._random.randrange(stats.firings)
+                if slot < self._max_duration_samples:
+                    stats.durations[slot] = seconds
+            self._firings += 1
+
+    def attach(self, engine):
+        if not isinstance(engine.strategy, _ProfilingStrategy):
+            engine.strategy = _ProfilingStrategy(engine.strategy, self)
+
+    @staticmethod
+    def detach(engine):
+        if isinstance(engine.strategy, _ProfilingStrategy):
+            engine.strategy = engine.strategy.wrapped
+
+    def run(self, engine, steps=float("inf")):
+        """KnowledgeEngine.run() with each rule firing timed."""
+        engine.running = True
+        execution = 0
+        while steps > 0 and engine.running:
+            added, removed = engine.get_activations()
+            engine.strategy.update_agenda(engine.agenda, added, removed)
+
+            activation = engine.agenda.get_next()
+            if activation is None:
+                break
+
+            steps -= 1
+            execution += 1
+            watchers.RULES.info(
+                "FIRE %s %s: %s",
+                execution,
+                activation.rule.__name__,
+                ", ".join(str(f) for f in activation.facts),
+            )
+
+            context = {k: v for k, v in activation.context.items() if not k.startswith("__")}
+            started = time.perf_counter()
+            try:
+                activation.rule(engine, **context)
+            finally:
+                self._record_firing(activation.rule, time.perf_counter() - started)
+
+        engine.running = False
+
+    def rules(self):
+        """Per-rule statistics, most expensive first."""
+        with self._lock:
+            rows = []
+            for name, stats in self._rules.items():
+                durations = sorted(stats.durations)
+                rows.append(
+                    {
+                        "rule": name,
+                        "origin": stats.origin,
+                        "salience": stats.salience,
+                        "activations": stats.activations,
+                        "firings": stats.firings,
+                        "total_seconds": stats.seconds,
+                        "mean_seconds": stats.seconds / stats.firings if stats.firings else None,
+                        "p95_seconds": _percentile(durations, 0.95),
+                    }
+                )
+        return sorted(rows, key=lambda row: row["total_seconds"], reverse=True)
+
+    def to_json(self):
+        with self._lock:
+            samples = [
+                {"seconds": seconds, "firings": firings, "agenda_size": size}
+                for seconds, firings, size in self._agenda_samples
+            ]
+            firings = self._firings
+        return {"firings": firings, "rules": self.rules(), "agenda": samples}
+
+    def to_folded(self):
+        """Collapsed stacks, one `engine;origin;rule microseconds` line per rule."""
+        return "".join(
+            f"engine;{row['origin']};{row['rule']} {round(row['total_seconds'] * 1e6)}\n"
+            for row in self.rules()
+            if row["firings"]
+        )
+
+
+def profile_sessions(profiler=None, ages=("8", "35", "70")):
+    """Replay every question-flow path the way the API does, profiled."""
+    from experta import Fact
+    from ExpertSystem.engine_factory import get_engine_factory
+    from ExpertSystem.facts import Answer
+    from ExpertSystem.Questions.flow_compiler import concrete_paths
+
+    factory = get_engine_factory()
+    profiler = profiler or RuleProfiler()
+    for age in ages:
+        for path in concrete_paths(number=age):
+            engine = factory.fork()
+            engine.enable_profiling(profiler)
+            engine.declare(Fact(start=True))
+            engine.run()
+            for ident, text in path:
+                engine.retract_next_question(ident)
+                engine.declare(Answer(ident=ident, text=text))
+                engine.run()
+    return profiler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the rules over every question-flow path")
+    parser.add_argument("--json", help="write the JSON profile to this path")
+    parser.add_argument("--folded", help="write collapsed flame-graph stacks to this path")
+    args = parser.parse_args()
+
+    profiler = profile_sessions()
+    report = profiler.to_json()
+    print(f"{'rule':<45} {'act':>6} {'fire':>6} {'total ms':>9} {'p95 us':>8}")
+    for row in report["rules"][:20]:
+        p95 = row["p95_seconds"] * 1e6 if row["p95_seconds"] is not None else 0.0
+        print(
+            f"{row['rule']:<45} {row['activations']:>6} {row['firings']:>6} "
+            f"{row['total_seconds'] * 1000:>9.2f} {p95:>8.1f}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.folded:
+        with open(args.folded, "w", encoding="utf-8") as f:
+            f.write(profiler.to_folded())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Content-addressed cache of diagnosis results.
+
+The triage trees have few leaves, so many patients give identical answers.
+A result is keyed by a hash of the Answer facts an answer set declares
+(multi-valued answers such as `locations` split into one fact per value,
+the whole set sorted) together with the knowledge base version, a hash of
+the modules that define the rules and the disease data and of those that
+compile, run and report them. Editing any of them changes every key, so
+stale results are never served.
+
+The cache has a size-bounded in-memory LRU and, optionally, an on-disk tier
+of one JSON file per result that survives restarts and is shared between
+processes (batch workers, the daemon, the API server). Each knowledge base
+version gets its own subdirectory, `kb-<version>`, holding a marker file;
+on startup the cache removes the subdirectories of other versions, and only
+those, since they can no longer be hit. The disk tier is best effort: a
+directory that cannot be created or written to costs cache hits, never a
+request.
+
+Configuration for the process-wide cache (`get_result_cache()`):
+    DERMATOLOGY_RESULT_CACHE_SIZE   in-memory entries (default 4096, 0 disables)
+    DERMATOLOGY_RESULT_CACHE_DIR    directory of the disk tier (default: none)
+"""
+
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+SIZE_ENV = "DERMATOLOGY_RESULT_CACHE_SIZE"
+DIR_ENV = "DERMATOLOGY_RESULT_CACHE_DIR"
+DEFAULT_MAX_ENTRIES = 4096
+
+VERSION_DIR_PREFIX = "kb-"
+VERSION_DIR_PATTERN = re.compile(rf"{VERSION_DIR_PREFIX}[0-9a-f]{{64}}")
+# Present in every version directory the cache created.
+MARKER_FILE = ".dermatology-result-cache"
+
+MULTI_VALUED_IDENTS = frozenset({"locations"})
+
+# Modules whose source decides what a set of answers diagnoses: the rules
+# and data, and the code that compiles them (the flow table, the per-branch
+# rule sets, the batch scorer's rule features and the decision DAG), runs
+# them and builds the result dict.
+KNOWLEDGE_BASE_MODULES = (
+    "ExpertSystem.answers",
+    "ExpertSystem.batch_scorer",
+    "ExpertSystem.branch_rules",
+    "ExpertSystem.Data.disease",
+    "ExpertSystem.decision_dag",
+    "ExpertSystem.diagnose",
+    "ExpertSystem.engine",
+    "ExpertSystem.engine_factory",
+    "ExpertSystem.evidence",
+    "ExpertSystem.facts",
+    "ExpertSystem.Questions.diagnosis",
+    "ExpertSystem.Questions.flow_compiler",
+    "ExpertSystem.Questions.question",
+    "ExpertSystem.Questions.question_flow",
+)
+
+
+@lru_cache(maxsize=1)
+def knowledge_base_version():
+    """SHA-256 over the source of KNOWLEDGE_BASE_MODULES, without importing them."""
+    digest = hashlib.sha256()
+    for name in KNOWLEDGE_BASE_MODULES:
+        with open(importlib.util.find_spec(name).origin, "rb") as f:
+            digest.update(name.encode("utf-8") + b"\0" + f.read() + b"\0")
+    return digest.hexdigest()
+
+
+def split_answer(ident, value):
+    """Answer texts declared for one answer; multi-valued ones give one per value."""
+    if ident not in MULTI_VALUED_IDENTS:
+        return [value]
+    if isinstance(value, str):
+        value = value.split(",")
+    return [text.strip() for text in value if text.strip()]
+
+
+def answers_key(pairs, version=None):
+    """Cache key of the (ident, text) Answer facts a request declares."""
+    canonical = sorted({(str(ident), str(text)) for ident, text in pairs})
+    digest = hashlib.sha256((version or knowledge_base_version()).encode("utf-8"))
+    digest.update(json.dumps(canonical, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """In-memory LRU of JSON results, backed by an optional directory."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, directory=None, version=None):
+        self.max_entries = max_entries
+        self.version = version or knowledge_base_version()
+        self.directory = None
+        if directory:
+            self.directory = os.path.join(directory, VERSION_DIR_PREFIX + self.version)
+            try:
+                self._make_directory()
+            except OSError as e:
+                logger.warning("Result cache disk tier disabled: %s", e)
+                self.directory = None
+            else:
+                self._remove_other_versions(directory)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _make_directory(self):
+        os.makedirs(self.directory, exist_ok=True)
+        marker = os.path.join(self.directory, MARKER_FILE)
+        if not os.path.exists(marker):
+            with open(marker, "w", encoding="utf-8") as f:
+                f.write(self.version + "\n")
+
+    def _remove_other_versions(self, directory):
+        """Delete version directories of this cache, never anything else."""
+        current = os.path.basename(self.directory)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(directory, name)
+            if (
+                name != current
+                and VERSION_DIR_PATTERN.fullmatch(name)
+                and not os.path.islink(path)
+                and os.path.isfile(os.path.join(path, MARKER_FILE))
+            ):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _remember(self, key, raw):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = raw
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        """A fresh copy of the cached result for `key`, or None."""
+        with self._lock:
+            raw = self._entries.get(key)
+            if raw is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(raw)
+
+        if self.directory:
+            try:
+                with open(self._path(key), encoding="utf-8") as f:
+                    raw = f.read()
+                result = json.loads(raw)
+            except (OSError, ValueError):
+                pass
+            else:
+                with self._lock:
+                    self._remember(key, raw)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return result
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result):
+        raw = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, raw)
+        if self.directory:
+            try:
+                self._write(key, raw)
+            except FileNotFoundError:
+                # Another process removed the directory (a different
+                # knowledge base version started); recreate it once.
+                try:
+                    self._make_directory()
+                    self._write(key, raw)
+                except OSError:
+                    pass
+            except OSError:
+                pass
+
+    def _write(self, key, raw):
+        # Write-then-rename, so concurrent readers never see a partial file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(raw)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def clear(self):
+        """Drop the in-memory entries; the disk tier is left in place."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "disk": self.directory,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+@lru_cache(maxsize=1)
+def get_result_cache():
+    """The process-wide cache, configured from the environment on first use."""
+    return ResultCache(
+        max_entries=int(os.environ.get(SIZE_ENV, DEFAULT_MAX_ENTRIES)),
+        directory=os.environ.get(DIR_ENV) or None,
+    )
@@ -0,0 +1,165 @@
+"""Server-sent events for API sessions, in place of status polling.
+
+The frontend used to POST an answer and then GET the session status, and
+poll it again while the explanation was pending. A client can instead open
+one event stream per session (`GET /api/sessions/{id}/events`) and is sent
+
+    question           the session status, when the next question is known
+    diagnosis          the session status, when the flow has reached a result
+    explanation_ready  {"explanation", "explanation_status"} once generated
+    error              {"source", "detail"}, where source is
+                         "engine"       the engine run failed
+                         "explanation"  the explanation failed; the
+                                        diagnosis still stands
+                         "session"      the session was deleted or expired;
+                                        this is the stream's last event
+
+as soon as the engine halts. Each event carries the full state it reports,
+so a client that misses one (a full queue, a reconnect) only needs the next.
+A stream checks every keepalive interval that its session still exists, so
+it also ends when the session expires.
+
+SessionEvents keeps the subscribers of each session as bounded queues.
+`publish` is called on the event loop; `publish_threadsafe` from worker
+threads, such as the explanation pool.
+"""
+
+import asyncio
+import json
+from collections import defaultdict
+from functools import lru_cache
+
+QUESTION = "question"
+DIAGNOSIS = "diagnosis"
+EXPLANATION_READY = "explanation_ready"
+ERROR = "error"
+
+# Sources of an error event.
+ENGINE = "engine"
+EXPLANATION = "explanation"
+SESSION = "session"
+
+DEFAULT_QUEUE_SIZE = 16
+KEEPALIVE_SECONDS = 15.0
+
+
+def format_sse(event, data):
+    """One event in the text/event-stream format."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _session_gone(session_id, detail):
+    return format_sse(ERROR, {"session_id": session_id, "source": SESSION, "detail": detail})
+
+
+class _Subscriber:
+    __slots__ = ("loop", "queue")
+
+    def __init__(self, loop, queue_size):
+        self.loop = loop
+        self.queue = asyncio.Queue(queue_size)
+
+    def put(self, message):
+        # Events are snapshots, so when the client falls behind the oldest
+        # one is dropped rather than the stream blocking. None ends the stream.
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+
+class SessionEvents:
+    """Per-session fan-out of events to the open streams of that session."""
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, session_id):
+        """A new subscriber of the session; must be called from the event loop."""
+        subscriber = _Subscriber(asyncio.get_running_loop(), self.queue_size)
+        self._subscribers[session_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, session_id, subscriber):
+        subscribers = self._subscribers.get(session_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._subscribers[session_id]
+
+    def has_subscribers(self, session_id):
+        return session_id in self._subscribers
+
+    def send(self, subscriber, event, data):
+        """Send an event to one stream only; call on the event loop."""
+        subscriber.put(format_sse(event, data))
+        self.delivered += 1
+
+    def publish(self, session_id, event, data):
+        """Send an event to every stream of the session; call on the event loop."""
+        message = format_sse(event, data)
+        self.published += 1
+        for subscriber in self._subscribers.get(session_id, ()):
+            subscriber.put(message)
+            self.delivered += 1
+
+    def end(self, session_id, detail):
+        """Send the session's streams a final "session" error and close them."""
+        message = _session_gone(session_id, detail)
+        for subscriber in self._subscribers.pop(session_id, ()):
+            subscriber.put(message)
+            subscriber.put(None)
+            self.delivered += 1
+
+    def publish_threadsafe(self, session_id, event, data):
+        """`publish` from a worker thread."""
+        subscribers = self._subscribers.get(session_id)
+        if not subscribers:
+            return
+        loop = next(iter(subscribers)).loop
+        try:
+            loop.call_soon_threadsafe(self.publish, session_id, event, data)
+        except RuntimeError:
+            # The loop has closed: the server is shutting down.
+            pass
+
+    async def stream(self, session_id, subscriber, alive=None, keepalive=KEEPALIVE_SECONDS):
+        """The subscriber's events as text/event-stream chunks, until the
+        session ends or the client goes away.
+
+        `alive`, if given, is awaited as `alive()` whenever the stream has
+        been idle for `keepalive` seconds; once it returns False the stream
+        ends with a "session" error.
+        """
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    if alive is not None and not await alive():
+                        yield _session_gone(session_id, "Session not found")
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(session_id, subscriber)
+
+    def stats(self):
+        return {
+            "sessions": len(self._subscribers),
+            "streams": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+        }
+
+
+@lru_cache(maxsize=1)
+def get_session_events():
+    """The process-wide event hub of the API server."""
+    return SessionEvents()
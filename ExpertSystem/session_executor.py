@@ -0,0 +1,151 @@
+"""Engine work off the event loop, serialized per session.
+
+The API server used to run experta inside its `async def` handlers, which
+blocked the event loop for every request, and ran the engine of an answer
+as a BackgroundTask, so two quick answers could run one engine from two
+threads at once.
+
+SessionExecutor runs every operation on a session in a bounded thread pool,
+through a per-session actor: a FIFO of pending operations drained by one
+task, so operations on one session run one at a time and in the order they
+were submitted, while different sessions run in parallel. An actor only
+exists while its session has work queued.
+
+Threads rather than processes: an engine is a live Rete network that cannot
+be pickled into another process. experta is pure Python, so the pool keeps
+the event loop responsive and overlaps I/O (the LLM explanation, SQLite)
+rather than adding CPU parallelism.
+
+The backlog is bounded as well: beyond `max_pending` queued operations,
+`submit` raises ExecutorBusy instead of queueing more.
+
+Configuration for the process-wide executor (`get_session_executor()`):
+    DERMATOLOGY_ENGINE_WORKERS   worker threads (default 4)
+    DERMATOLOGY_ENGINE_QUEUE     queued operations over all sessions (default 1024)
+"""
+
+import asyncio
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+WORKERS_ENV = "DERMATOLOGY_ENGINE_WORKERS"
+QUEUE_ENV = "DERMATOLOGY_ENGINE_QUEUE"
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PENDING = 1024
+
+
+class ExecutorBusy(Exception):
+    pass
+
+
+class _Actor:
+    __slots__ = ("jobs", "task")
+
+    def __init__(self):
+        self.jobs = deque()
+        self.task = None
+
+
+class SessionExecutor:
+    """Bounded thread pool running each session's operations one at a time, in order."""
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="session-engine")
+        self._actors = {}
+        self._pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+
+    def submit(self, session_id, fn, *args):
+        """Queue `fn(*args)` behind the session's earlier operations; return its future.
+
+        Must be called from the event loop. The future may be ignored: the
+        operation runs either way.
+        """
+        loop = asyncio.get_running_loop()
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise ExecutorBusy(f"{self._pending} engine operations already queued")
+        future = loop.create_future()
+        actor = self._actors.get(session_id)
+        if actor is None or actor.task.done():
+            actor = self._actors[session_id] = _Actor()
+        actor.jobs.append((fn, args, future))
+        self._pending += 1
+        self.submitted += 1
+        self.max_queue_depth = max(self.max_queue_depth, len(actor.jobs))
+        if actor.task is None:
+            actor.task = loop.create_task(self._drain(session_id, actor))
+        return future
+
+    async def run(self, session_id, fn, *args):
+        """`fn(*args)` on a worker thread, after the session's earlier operations."""
+        return await self.submit(session_id, fn, *args)
+
+    async def _drain(self, session_id, actor):
+        loop = asyncio.get_running_loop()
+        try:
+            while actor.jobs:
+                fn, args, future = actor.jobs[0]
+                error = None
+                try:
+                    result = await loop.run_in_executor(self._pool, fn, *args)
+                except Exception as e:
+                    error = e
+                actor.jobs.popleft()
+                self._pending -= 1
+                if not actor.jobs:
+                    # Retire the actor before resolving the future, so the
+                    # caller never resumes while it is still registered.
+                    self._retire(session_id, actor)
+                if error is not None:
+                    self.failed += 1
+                    if not future.done():
+                        future.set_exception(error)
+                else:
+                    self.completed += 1
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            # Only left with jobs when cancelled, as its event loop shuts down.
+            self._retire(session_id, actor)
+            while actor.jobs:
+                _, _, future = actor.jobs.popleft()
+                self._pending -= 1
+                future.cancel()
+
+    def _retire(self, session_id, actor):
+        if self._actors.get(session_id) is actor:
+            del self._actors[session_id]
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "active_sessions": len(self._actors),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+
+@lru_cache(maxsize=1)
+def get_session_executor():
+    """The process-wide executor, configured from the environment on first use."""
+    return SessionExecutor(
+        max_workers=int(os.environ.get(WORKERS_ENV, DEFAULT_WORKERS)),
+        max_pending=int(os.environ.get(QUEUE_ENV, DEFAULT_MAX_PENDING)),
+    )
@@ -0,0 +1,145 @@
+"""State of one API consultation, and how it is rebuilt from its answers.
+
+A session is a dict holding a forked engine, the question flow state and
+the answers given so far. Everything in it follows from the ordered answer
+log, `session["answer_log"]` of (question_id, answer, is_multiple), so a
+session is persisted as `session_record(session)` -- the log and a few
+identifying fields -- and `restore_session(record)` replays the log on a
+fresh fork, exactly as the answers were applied the first time.
+
+The LLM explanation is the exception: it cannot be replayed, so a ready
+explanation is stored in the record as well. A pending or failed one is
+not, and is generated again once the restored session is read.
+
+`apply_answer` is the single code path for applying an answer, used both by
+the API server and by the replay.
+"""
+
+from datetime import datetime
+
+from experta import Fact
+from ExpertSystem.answers import validate_answer
+from ExpertSystem.branch_rules import get_branch_rule_sets
+from ExpertSystem.decision_dag import get_decision_dag
+from ExpertSystem.explanations import READY
+from ExpertSystem.facts import Answer
+from ExpertSystem.Questions.flow_compiler import get_resolver
+from ExpertSystem.result_cache import answers_key, get_result_cache, split_answer
+
+
+def flow_resolver():
+    """The resolver of the decision DAG if one is loaded, else the compiled flow's."""
+    decision_dag = get_decision_dag()
+    return decision_dag.resolver if decision_dag else get_resolver()
+
+
+def new_session(session_id, user_id=None, created_at=None):
+    """A session on a fresh triage engine, run up to its first question."""
+    now = datetime.now()
+    expert_system = get_branch_rule_sets().fork()
+    session = {
+        "session_id": session_id,
+        "user_id": user_id,
+        "expert_system": expert_system,
+        "status": "initialized",
+        "created_at": created_at or now,
+        "last_updated": now,
+        "answers": {},
+        "answer_facts": [],
+        "answer_log": [],
+        "result": None,
+        "flow_state": flow_resolver().start_state,
+        "current_question": None,
+        "diagnosis": None,
+        "explanation": None,
+        "explanation_status": None,
+    }
+    expert_system.declare(Fact(start=True))
+    expert_system.run()
+    session["status"] = "processed"
+    return session
+
+
+def apply_answer(session, question_id, answer, is_multiple=False):
+    """Apply one answer; return True when the engine still has to be run.
+
+    Raises ValueError if the flow does not accept `answer` to `question_id`
+    in the session's current state, or the answer is not a valid value (a
+    non-numeric age); the session is then left unchanged. Everything is
+    checked before the engine is touched, and the session's own fields are
+    only written once the engine has taken the answer.
+    """
+    resolver = flow_resolver()
+    flow_state = resolver.advance(session["flow_state"], question_id, answer)
+
+    is_multi_select_question = question_id in ["locations"]
+    if is_multi_select_question and is_multiple:
+        texts = [a.lower() for a in split_answer(question_id, answer)]
+    else:
+        texts = [answer.lower()]
+    for text in texts:
+        validate_answer(question_id, text)
+    answer_facts = session["answer_facts"] + [(question_id, text) for text in texts]
+
+    expert_system = session["expert_system"]
+    expert_system.retract_next_question(question_id)
+    for text in texts:
+        expert_system.declare(Answer(ident=question_id, text=text))
+    session["expert_system"] = get_branch_rule_sets().advance(expert_system, answer_facts)
+
+    session["flow_state"] = flow_state
+    session["answers"][question_id] = answer
+    session["answer_log"].append((question_id, answer, is_multiple))
+    session["answer_facts"] = answer_facts
+    session["last_updated"] = datetime.now()
+
+    # The last answer of a path: look the result up in the result cache,
+    # then in the decision DAG, and only run the engine if both miss.
+    if resolver.question(session["flow_state"]) is None:
+        result_cache = get_result_cache()
+        decision_dag = get_decision_dag()
+        cache_key = answers_key(session["answer_facts"])
+        session["result"] = result_cache.get(cache_key)
+        if session["result"] is None and decision_dag:
+            answers = {}
+            for ident, text in session["answer_facts"]:
+                answers.setdefault(ident, []).append(text)
+            session["result"] = decision_dag.diagnosis(session["flow_state"], answers)
+            if session["result"] is not None:
+                result_cache.put(cache_key, session["result"])
+    if session["result"] is not None:
+        session["status"] = "processed"
+        return False
+    session["status"] = "processing"
+    return True
+
+
+def session_record(session):
+    """The JSON-serializable part of a session that `restore_session` needs."""
+    record = {
+        "session_id": session["session_id"],
+        "user_id": session["user_id"],
+        "created_at": session["created_at"].isoformat(),
+        "answer_log": [list(step) for step in session["answer_log"]],
+    }
+    if session["explanation_status"] == READY:
+        record["explanation"] = session["explanation"]
+        record["explanation_status"] = READY
+    return record
+
+
+def restore_session(record):
+    """Rebuild a session by replaying its answer log on a fresh engine."""
+    session = new_session(
+        record["session_id"],
+        record.get("user_id"),
+        datetime.fromisoformat(record["created_at"]),
+    )
+    for question_id, answer, is_multiple in record["answer_log"]:
+        if apply_answer(session, question_id, answer, is_multiple):
+            session["expert_system"].run()
+            session["status"] = "processed"
+    if record.get("explanation_status") == READY:
+        session["explanation"] = record["explanation"]
+        session["explanation_status"] = READY
+    return session
@@ -0,0 +1,392 @@
+"""Bounded store of API sessions.
+
+Every session holds a forked engine, and sessions used to live in a plain
+dict until the frontend deleted them, so abandoned ones were never freed.
+SessionStore bounds them two ways:
+
+* idle TTL   a session not read or written for `ttl_seconds` expires; a
+             lookup of an expired session finds nothing, and the sweeper
+             removes the ones nobody looks up
+* capacity   beyond `max_sessions`, the least recently used session is
+             evicted
+
+The sweeper (`sweep`, run periodically by `sweep_periodically`) also
+measures the memory of sessions touched since their last measurement with
+`sizer`, so the health endpoint can report what sessions cost. Measuring
+walks the session's objects (see ExpertSystem.memory), so at most
+`measure_batch` sessions are measured per sweep.
+
+With a `backend`, sessions also survive restarts and eviction. The backend
+keeps `dump(session)` -- the session's ordered answer log, see
+ExpertSystem.session_state -- written on `put` and `save`. Resident
+sessions are then only a hot set of `max_sessions`: a lookup of a session
+that is not resident rebuilds it with `restore(record)`, which replays its
+answers on a fresh engine. Expiry applies to both tiers; the sweeper writes
+the access times of resident sessions back, so a session that is only read
+does not expire on disk.
+
+Configuration for the process-wide store (`get_session_store()`):
+    DERMATOLOGY_SESSION_TTL             idle seconds before expiry (default 1800, 0 disables)
+    DERMATOLOGY_MAX_SESSIONS            resident sessions (default 1000)
+    DERMATOLOGY_SESSION_SWEEP_INTERVAL  seconds between sweeps (default 30)
+    DERMATOLOGY_SESSION_DB              SQLite file persisting sessions (default: none)
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from ExpertSystem.memory import retained_bytes
+
+TTL_ENV = "DERMATOLOGY_SESSION_TTL"
+MAX_SESSIONS_ENV = "DERMATOLOGY_MAX_SESSIONS"
+SWEEP_INTERVAL_ENV = "DERMATOLOGY_SESSION_SWEEP_INTERVAL"
+DB_ENV = "DERMATOLOGY_SESSION_DB"
+DEFAULT_TTL_SECONDS = 1800
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_SWEEP_INTERVAL = 30
+DEFAULT_MEASURE_BATCH = 64
+
+logger = logging.getLogger(__name__)
+
+
+def session_bytes(session):
+    """Bytes a session keeps alive beyond the golden engines its engine was forked from."""
+    from ExpertSystem.branch_rules import get_branch_rule_sets
+
+    return retained_bytes(session, get_branch_rule_sets().shared_ids())
+
+
+class SQLiteSessionBackend:
+    """Session records as JSON rows of one SQLite table, safe to share between threads."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, record TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)"
+        )
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def save(self, session_id, record):
+        raw = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                (session_id, raw, time.time()),
+            )
+
+    def load(self, session_id, max_idle=None):
+        """The record of `session_id`, or None if unknown or idle for over `max_idle` s."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT record, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None or (max_idle and time.time() - row[1] > max_idle):
+            return None
+        return json.loads(row[0])
+
+    def exists(self, session_id, max_idle=None):
+        """Whether `session_id` is stored and was updated within `max_idle` s."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row is not None and not (max_idle and time.time() - row[0] > max_idle)
+
+    def touch(self, session_ids):
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "UPDATE sessions SET updated_at = ? WHERE session_id = ?",
+                ((now, session_id) for session_id in session_ids),
+            )
+
+    def delete(self, session_id):
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        return cursor.rowcount > 0
+
+    def delete_idle(self, max_idle):
+        """Delete the records idle for over `max_idle` seconds; return how many."""
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM sessions WHERE updated_at < ?", (time.time() - max_idle,)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class _Entry:
+    __slots__ = ("session", "last_access", "bytes", "dirty", "accessed")
+
+    def __init__(self, session, now):
+        self.session = session
+        self.last_access = now
+        self.bytes = None
+        self.dirty = True
+        self.accessed = True
+
+
+class SessionStore:
+    """Sessions by id, expired when idle and evicted least recently used first."""
+
+    def __init__(
+        self,
+        ttl_seconds=DEFAULT_TTL_SECONDS,
+        max_sessions=DEFAULT_MAX_SESSIONS,
+        sizer=None,
+        measure_batch=DEFAULT_MEASURE_BATCH,
+        clock=time.monotonic,
+        backend=None,
+        dump=None,
+        restore=None,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.measure_batch = measure_batch
+        self.backend = backend
+        self._sizer = sizer
+        self._clock = clock
+        self._dump = dump
+        self._restore = restore
+        self._lock = threading.Lock()
+        # session id -> [lock, waiters]; a restore only excludes restores of
+        # the same session.
+        self._restore_locks = {}
+        self._entries = OrderedDict()
+        self.created = 0
+        self.deleted = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.restores = 0
+        self.restore_seconds = 0.0
+        self.sweeps = 0
+        self.last_sweep_seconds = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, session_id):
+        """Whether `session_id` is live, without restoring it or renewing its TTL."""
+        found, session = self._resident(session_id, touch=False)
+        if found:
+            return session is not None
+        return self.backend is not None and self.backend.exists(session_id, self.ttl_seconds)
+
+    def _expired(self, entry, now):
+        return self.ttl_seconds > 0 and now - entry.last_access > self.ttl_seconds
+
+    def _resident(self, session_id, touch):
+        """(found, session) among the resident sessions; found is False if not resident."""
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return False, None
+            expired = self._expired(entry, now)
+            if expired:
+                del self._entries[session_id]
+                self.expirations += 1
+            elif touch:
+                entry.last_access = now
+                entry.dirty = entry.accessed = True
+                self._entries.move_to_end(session_id)
+        if expired:
+            # Outside the lock, as in sweep(): the backend does I/O.
+            if self.backend is not None:
+                self.backend.delete(session_id)
+            return True, None
+        return True, entry.session
+
+    @contextlib.contextmanager
+    def _restoring(self, session_id):
+        with self._lock:
+            slot = self._restore_locks.setdefault(session_id, [threading.Lock(), 0])
+            slot[1] += 1
+        try:
+            with slot[0]:
+                yield
+        finally:
+            with self._lock:
+                slot[1] -= 1
+                if not slot[1]:
+                    del self._restore_locks[session_id]
+
+    def get(self, session_id, touch=True):
+        """The live session `session_id`, or None if unknown or expired.
+
+        Callers mutate the session in place, so by default the lookup counts
+        as an access: it renews the TTL and marks the session for measuring.
+        A persisted session that is not resident is restored first.
+        """
+        found, session = self._resident(session_id, touch)
+        if found or self.backend is None:
+            return session
+        with self._restoring(session_id):
+            # Another thread may have restored it while this one waited.
+            found, session = self._resident(session_id, touch)
+            if found:
+                return session
+            started = time.perf_counter()
+            try:
+                record = self.backend.load(session_id, self.ttl_seconds)
+                if record is None:
+                    return None
+                session = self._restore(record)
+            except sqlite3.Error:
+                # The database is unavailable, not the record broken.
+                raise
+            except Exception as e:
+                # A malformed record, or answers that no longer fit the
+                # question flow: the session is lost either way.
+                logger.warning(
+                    "Dropping session %s that cannot be restored: %r", session_id, e
+                )
+                self.backend.delete(session_id)
+                return None
+            with self._lock:
+                self.restores += 1
+                self.restore_seconds += time.perf_counter() - started
+            self._insert(session_id, session)
+            return session
+
+    def _insert(self, session_id, session):
+        with self._lock:
+            self._entries[session_id] = _Entry(session, self._clock())
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                # With a backend the evicted session stays persisted.
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def put(self, session_id, session):
+        with self._lock:
+            if session_id not in self._entries:
+                self.created += 1
+        self._insert(session_id, session)
+        self.save(session_id, session)
+
+    def save(self, session_id, session):
+        """Persist the session's current answers, if there is a backend."""
+        if self.backend is not None:
+            self.backend.save(session_id, self._dump(session))
+
+    def delete(self, session_id):
+        """Remove a session; return False if it was not live."""
+        with self._lock:
+            found = self._entries.pop(session_id, None) is not None
+        if self.backend is not None:
+            found = self.backend.delete(session_id) or found
+        if found:
+            with self._lock:
+                self.deleted += 1
+        return found
+
+    def sweep(self):
+        """Remove expired sessions and measure recently used ones; return how many expired."""
+        started = time.perf_counter()
+        now = self._clock()
+        with self._lock:
+            expired = [sid for sid, entry in self._entries.items() if self._expired(entry, now)]
+            for session_id in expired:
+                del self._entries[session_id]
+            accessed = [sid for sid, entry in self._entries.items() if entry.accessed]
+            for session_id in accessed:
+                self._entries[session_id].accessed = False
+            to_measure = [
+                entry for entry in self._entries.values() if entry.dirty
+            ][: self.measure_batch] if self._sizer else []
+
+        if self.backend is not None:
+            for session_id in expired:
+                self.backend.delete(session_id)
+            self.backend.touch(accessed)
+            if self.ttl_seconds > 0:
+                expired += [None] * self.backend.delete_idle(self.ttl_seconds)
+        with self._lock:
+            self.expirations += len(expired)
+
+        for entry in to_measure:
+            entry.dirty = False
+            try:
+                entry.bytes = self._sizer(entry.session)
+            except RuntimeError:
+                # Mutated by a request while being walked; measure next sweep.
+                entry.dirty = True
+
+        with self._lock:
+            self.sweeps += 1
+            self.last_sweep_seconds = time.perf_counter() - started
+        return len(expired)
+
+    async def sweep_periodically(self, interval):
+        """Sweep every `interval` seconds, off the event loop, until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception:
+                logger.exception("Session sweep failed")
+
+    def stats(self):
+        with self._lock:
+            sizes = [entry.bytes for entry in self._entries.values() if entry.bytes is not None]
+            return {
+                "sessions": len(self._entries),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "created": self.created,
+                "deleted": self.deleted,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "persisted": self.backend.path if self.backend is not None else None,
+                "restores": self.restores,
+                "restore_mean_seconds": self.restore_seconds / self.restores if self.restores else None,
+                "sweeps": self.sweeps,
+                "last_sweep_seconds": self.last_sweep_seconds,
+                "measured_sessions": len(sizes),
+                "bytes": sum(sizes),
+                "mean_bytes": sum(sizes) / len(sizes) if sizes else None,
+                "max_bytes": max(sizes, default=None),
+            }
+
+
+def sweep_interval():
+    return float(os.environ.get(SWEEP_INTERVAL_ENV, DEFAULT_SWEEP_INTERVAL))
+
+
+@lru_cache(maxsize=1)
+def get_session_store():
+    """The process-wide store, configured from the environment on first use."""
+    from ExpertSystem.session_state import restore_session, session_record
+
+    path = os.environ.get(DB_ENV)
+    return SessionStore(
+        ttl_seconds=float(os.environ.get(TTL_ENV, DEFAULT_TTL_SECONDS)),
+        max_sessions=int(os.environ.get(MAX_SESSIONS_ENV, DEFAULT_MAX_SESSIONS)),
+        sizer=session_bytes,
+        backend=SQLiteSessionBackend(path) if path else None,
+        dump=session_record,
+        restore=restore_session,
+    )
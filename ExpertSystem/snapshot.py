@@ -0,0 +1,175 @@
+"""Copy-on-write snapshots of a reset engine.
+
+`reset()` declares the start fact and all DiseaseInfo facts, and every one of
+them is pushed through the Rete network again. Every session does exactly
+the same work, so the factory resets one "golden" engine and forks it.
+
+A fork shares everything that is immutable once declared -- facts, tokens,
+activations, rule checks -- and copies only the containers that later
+declares and retracts mutate: the fact list, the agenda and the per-node
+memories of the network.
+"""
+
+import copy
+
+from experta.agenda import Agenda
+from experta.matchers.rete.mixins import ChildNode
+from ExpertSystem.fact_index import IndexedFactList
+from ExpertSystem.memory import reachable_ids
+
+_ENGINE_STATE = ("facts", "agenda", "matcher", "strategy", "running", "profiler")
+_NODE_MEMORIES = ("memory", "added", "removed", "left_memory", "right_memory")
+
+
+def _copy_factlist(facts):
+    clone = type(facts)()
+    clone.update(facts)
+    clone.last_index = facts.last_index
+    clone.reference_counter = facts.reference_counter.copy()
+    clone.added = list(facts.added)
+    clone.removed = list(facts.removed)
+    clone.duplication = facts.duplication
+    if isinstance(facts, IndexedFactList):
+        clone.copy_indexes(facts)
+    return clone
+
+
+def _copy_agenda(agenda):
+    clone = Agenda()
+    clone.activations = list(agenda.activations)
+    return clone
+
+
+def _copy_node(node, memo):
+    clone = memo.get(id(node))
+    if clone is not None:
+        return clone
+
+    clone = copy.copy(node)
+    memo[id(node)] = clone
+    for name in _NODE_MEMORIES:
+        if name in node.__dict__:
+            clone.__dict__[name] = node.__dict__[name].copy()
+
+    clone.children = []
+    for child in node.children:
+        child_clone = _copy_node(child.node, memo)
+        clone.children.append(
+            ChildNode(child_clone, getattr(child_clone, child.callback.__name__))
+        )
+    return clone
+
+
+def _copy_matcher(matcher, engine):
+    memo = {}
+    clone = copy.copy(matcher)
+    clone.engine = engine
+    clone.root_node = _copy_node(matcher.root_node, memo)
+    clone._conflict_set_nodes = tuple(
+        memo[id(node)] for node in matcher._get_conflict_set_nodes()
+    )
+    return clone
+
+
+def _shell(engine):
+    clone = object.__new__(type(engine))
+    # One deepcopy call, so attributes that share an object keep sharing it.
+    clone.__dict__.update(
+        copy.deepcopy(
+            {k: v for k, v in engine.__dict__.items() if k not in _ENGINE_STATE}
+        )
+    )
+    clone.running = False
+    clone.facts = _copy_factlist(engine.facts)
+    clone.agenda = _copy_agenda(engine.agenda)
+    # A profiler holds a lock and aggregates many engines: the fork records
+    # into the same one, through a strategy of its own.
+    strategy = getattr(engine.strategy, "wrapped", engine.strategy)
+    clone.strategy = type(strategy)()
+    clone.profiler = getattr(engine, "profiler", None)
+    if clone.profiler is not None:
+        clone.profiler.attach(clone)
+    return clone
+
+
+def fork_engine(engine):
+    """Return an independent engine in the same state as `engine`.
+
+    `engine` must not be running and must use a matcher that keeps its
+    conflict set nodes per instance (see PreparedRulesetMatcher).
+    """
+    if engine.running:
+        raise RuntimeError("Cannot fork a running engine")
+
+    clone = _shell(engine)
+    clone.matcher = _copy_matcher(engine.matcher, clone)
+    return clone
+
+
+class _NetworkPlan:
+    """The golden network flattened once, so a fork is a single linear pass.
+
+    Each entry holds the node class, its attributes minus the children, and
+    the children as (index, callback name) pairs into the flattened list.
+    """
+
+    def __init__(self, matcher):
+        nodes = []
+        index = {}
+
+        def visit(node):
+            if id(node) in index:
+                return
+            index[id(node)] = len(nodes)
+            nodes.append(node)
+            for child in node.children:
+                visit(child.node)
+
+        visit(matcher.root_node)
+
+        self._entries = []
+        for node in nodes:
+            state = {k: v for k, v in node.__dict__.items() if k != "children"}
+            memories = tuple(name for name in _NODE_MEMORIES if name in state)
+            children = tuple(
+                (index[id(child.node)], child.callback.__name__) for child in node.children
+            )
+            self._entries.append((type(node), state, memories, children))
+        self._conflict_set_indexes = tuple(
+            index[id(node)] for node in matcher._get_conflict_set_nodes()
+        )
+
+    def build(self):
+        nodes = [object.__new__(cls) for cls, _, _, _ in self._entries]
+        for node, (_, state, memories, children) in zip(nodes, self._entries):
+            attributes = node.__dict__
+            attributes.update(state)
+            for name in memories:
+                attributes[name] = state[name].copy()
+            attributes["children"] = [
+                ChildNode(nodes[i], getattr(nodes[i], callback)) for i, callback in children
+            ]
+        return nodes[0], tuple(nodes[i] for i in self._conflict_set_indexes)
+
+
+class EngineSnapshot:
+    """A frozen engine state that can be forked into new sessions."""
+
+    def __init__(self, engine):
+        self._golden = fork_engine(engine)
+        self._plan = _NetworkPlan(self._golden.matcher)
+        self._shared_ids = None
+
+    def fork(self):
+        clone = _shell(self._golden)
+        matcher = copy.copy(self._golden.matcher)
+        matcher.engine = clone
+        matcher.root_node, matcher._conflict_set_nodes = self._plan.build()
+        clone.matcher = matcher
+        return clone
+
+    def shared_ids(self):
+        """Ids of every object of the golden state, which forks may share."""
+        if self._shared_ids is None:
+            self._shared_ids = reachable_ids((self._golden, self._plan))
+        return self._shared_ids
@@ -1,62 +1,100 @@
 import json
+import os
 import sys
 import collections
 import collections.abc
 from experta import *
-from ExpertSystem.engine import DermatologyExpert
-from ExpertSystem.Questions.question_flow import apply_question_flow
-from ExpertSystem.Questions.diagnosis import apply_diagnostic_rules
-from ExpertSystem.facts import Answer
-from gui import ModernFreshDermatologyGUI
+from ExpertSystem.diagnose import diagnose_json
+from ExpertSystem.engine_factory import get_engine_factory
+from ExpertSystem.result_cache import get_result_cache
 
 collections.Mapping = collections.abc.Mapping
 
 
 def cli_main():
-    try:
-        raw_input = sys.stdin.read()
-        if not raw_input:
-            print(json.dumps({"error": "No JSON input provided."}))
-            return
-
-        data = json.loads(raw_input)
-        DermatologyExpertWithLogic = apply_question_flow(DermatologyExpert)
-        DermatologyExpertWithLogic = apply_diagnostic_rules(DermatologyExpertWithLogic)
-
-        engine = DermatologyExpertWithLogic()
-        engine.reset()
-
-        if "answers" in data and isinstance(data["answers"], dict):
-            for key, val in data["answers"].items():
-                engine.declare(Answer(ident=key, text=val))
-
-        engine.run()
-
-        if engine.best_diagnosis:
-            final_diagnosis = engine.best_diagnosis
-            result = {
-                "disease": final_diagnosis.get("disease"),
-                "reasoning": final_diagnosis.get("reasoning"),
-                "confidence": final_diagnosis.get("cf"),
-            }
-            print(json.dumps(result, indent=2))
-        else:
-            print(json.dumps({"error": "No confident diagnosis could be made."}))
-
-    except json.JSONDecodeError:
-        print(json.dumps({"error": "Invalid JSON format."}))
-    except Exception as e:
-        print(json.dumps({"error": f"An unexpected error occurred: {str(e)}"}))
+    raw_input = sys.stdin.read()
+    if not raw_input:
+        print(json.dumps({"error": "No JSON input provided."}))
+        return
+    print(json.dumps(diagnose_json(raw_input), indent=2))
+
+
+def _init_batch_worker():
+    # Build the rule-augmented engine once per worker process.
+    get_engine_factory()
+    get_result_cache()
+
+
+def _diagnose_lines(lines):
+    results = []
+    for line_number, line in lines:
+        result = diagnose_json(line)
+        if "error" in result:
+            result["line"] = line_number
+        results.append(json.dumps(result))
+    return results
+
+
+def _numbered_chunks(stream, chunk_size):
+    chunk = []
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        chunk.append((line_number, line))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _write_results(results):
+    for result in results:
+        sys.stdout.write(result + "\n")
+    sys.stdout.flush()
+
+
+def batch_main(argv=()):
+    """Stream JSON Lines requests from stdin to JSON Lines results on stdout.
+
+    Results keep the input order. At most `workers * 2` chunks are in flight,
+    so memory stays bounded however long the input is.
+    """
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor
+
+    parser = argparse.ArgumentParser(prog="app.py --batch")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=32)
+    args = parser.parse_args(argv)
+
+    pending = collections.deque()
+    with ProcessPoolExecutor(
+        max_workers=args.workers, initializer=_init_batch_worker
+    ) as executor:
+        for chunk in _numbered_chunks(sys.stdin, args.chunk_size):
+            pending.append(executor.submit(_diagnose_lines, chunk))
+            while len(pending) >= args.workers * 2:
+                _write_results(pending.popleft().result())
+        while pending:
+            _write_results(pending.popleft().result())
 
 
 def main():
     if len(sys.argv) > 1 and sys.argv[1] == "--cli":
         cli_main()
+    elif len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        batch_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "--daemon":
+        from daemon import serve
+
+        serve(sys.argv[2:])
     else:
+        # tkinter and the LLM client are only loaded for the GUI.
+        from gui import ModernFreshDermatologyGUI
+
         print("Starting Dermatology Expert System GUI...")
-        DermatologyExpertWithLogic = apply_question_flow(DermatologyExpert)
-        DermatologyExpertWithLogic = apply_diagnostic_rules(DermatologyExpertWithLogic)
-        app = ModernFreshDermatologyGUI(DermatologyExpertWithLogic)
+        app = ModernFreshDermatologyGUI(get_engine_factory())
         app.run()
 
 
@@ -0,0 +1,133 @@
+"""Modifier match cost per declared Answer: typed answers vs. text parsing.
+
+Every disease with a DiseaseInfo gets one piece of evidence, then an age, a
+duration and a severity Answer are declared, each of which is matched
+against every entry. The resulting diagnoses must be those of the baseline
+engine's modifier rules (run from its commit by benchmarks.legacy), which
+parsed the answer text on every check.
+
+The match predicates are timed both ways: parsing the text on every check
+(`int(age)`, a DURATION_MAPPING list scan, a severity list test), as the
+baseline did, and comparing the normalized values.
+
+Usage:
+    python -m benchmarks.answer_matching [--repeat N]
+"""
+
+import argparse
+import itertools
+import time
+
+from benchmarks.legacy import baseline_outputs
+from ExpertSystem.answers import DiseaseProfile, normalize_answer
+from ExpertSystem.Data.disease import DURATION_MAPPING
+from ExpertSystem.engine import disease_info_facts
+from ExpertSystem.evidence import DiagnosisAccumulator
+from ExpertSystem.event_log import RuleEventLog
+
+AGES = ("8", "35", "70")
+SEVERITIES = ("mild", "moderate", "severe", "unknown")
+
+
+def _answer_sets():
+    return list(itertools.product(AGES, DURATION_MAPPING, SEVERITIES))
+
+
+def _run(answer_sets, repeat):
+    """Return (final diagnoses per answer set, seconds per declared Answer).
+
+    The fastest of `repeat` passes is kept.
+    """
+    accumulator = DiagnosisAccumulator(disease_info_facts, RuleEventLog())
+    results = []
+    fastest = float("inf")
+    for _ in range(repeat):
+        results = []
+        elapsed = 0.0
+        for age, duration, severity in answer_sets:
+            accumulator.clear()
+            for disease in disease_info_facts:
+                accumulator.add(disease, 0.5, "benchmark evidence")
+            started = time.perf_counter()
+            accumulator.set_answer("age", age)
+            accumulator.set_answer("duration", duration)
+            accumulator.set_answer("severity", severity)
+            elapsed += time.perf_counter() - started
+            results.append(
+                sorted(
+                    [d["disease"], round(d["cf"], 9), d["reasoning"]]
+                    for d in accumulator.diagnoses()
+                )
+            )
+        fastest = min(fastest, elapsed)
+    return results, fastest / (len(answer_sets) * 3)
+
+
+def _baseline(answer_sets):
+    cases = [
+        [
+            [["diagnosis", disease, 0.5, "benchmark evidence"] for disease in disease_info_facts]
+            + [["answer", "age", age], ["answer", "duration", duration], ["answer", "severity", severity]]
+        ]
+        for age, duration, severity in answer_sets
+    ]
+    return [
+        [[d[0], d[1], d[3]] for d in result["diagnoses"]]
+        for result in baseline_outputs(cases, rules="base")
+    ]
+
+
+def _predicate_cost(answer_sets, repeat):
+    """Seconds per (answer, disease) match check: (text parsing, typed)."""
+    profiles = [DiseaseProfile(info) for info in disease_info_facts.values()]
+    infos = [profile.info for profile in profiles]
+    checks = repeat * len(answer_sets) * len(profiles) * 3
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for age, duration, severity in answer_sets:
+            for info in infos:
+                info["age_min"] <= int(age) <= info["age_max"]
+                info["common_duration"] in DURATION_MAPPING.get(duration, [])
+                severity in info["severity_levels"]
+    text_seconds = (time.perf_counter() - started) / checks
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for age, duration, severity in answer_sets:
+            years = normalize_answer("age", age)
+            bucket = normalize_answer("duration", duration)
+            level = normalize_answer("severity", severity)
+            for profile in profiles:
+                profile.age_min <= years <= profile.age_max
+                bucket in profile.duration_buckets
+                level in profile.severities
+    typed_seconds = (time.perf_counter() - started) / checks
+    return text_seconds, typed_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    answer_sets = _answer_sets()
+    typed, typed_seconds = _run(answer_sets, args.repeat)
+    baseline = _baseline(answer_sets)
+
+    text_check, typed_check = _predicate_cost(answer_sets, args.repeat)
+
+    mismatches = sum(1 for a, b in zip(typed, baseline) if a != b)
+    print(f"Answer sets:         {len(answer_sets)} x {len(disease_info_facts)} diagnoses")
+    print(
+        f"Per declared Answer: {typed_seconds * 1e6:.1f} us "
+        f"({typed_seconds / len(disease_info_facts) * 1e9:.0f} ns per diagnosis)"
+    )
+    print(f"Per match check:     {text_check * 1e9:.0f} ns -> {typed_check * 1e9:.0f} ns")
+    print(f"Result mismatches:   {mismatches}")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
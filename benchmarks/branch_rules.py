@@ -0,0 +1,153 @@
+"""Sessions on branch-partitioned rule sets vs. the full rule set.
+
+Every concrete question-flow path and a set of synthetic patients is run as
+a step-by-step session twice: on a fork of the full engine, and on the
+triage engine of ExpertSystem.branch_rules, which switches to the branch
+engine once the triage answers settle the branch. Both must produce the
+same result. Reported per branch: rules in the network, mean time of a
+`declare(Answer)` + `run()` step, the time of the step that switches from
+the triage engine to the branch engine, whole sessions, and the memory a
+finished session keeps alive.
+
+Usage:
+    python -m benchmarks.branch_rules [--patients N] [--seed S] [--repeat N]
+"""
+
+import argparse
+import gc
+import logging
+import statistics
+import time
+import tracemalloc
+
+from ExpertSystem.branch_rules import BRANCH_ANSWERS, branch_for, get_branch_rule_sets
+from ExpertSystem.diagnose import result_from_engine
+from ExpertSystem.engine_factory import get_engine_factory
+from ExpertSystem.facts import Answer
+from ExpertSystem.patient_generator import generate_patients
+from ExpertSystem.Questions.flow_compiler import concrete_paths
+from ExpertSystem.result_cache import split_answer
+
+AGES = ("8", "35", "70")
+
+
+def _full_session(path, step_seconds, switch_seconds):
+    engine = get_engine_factory().fork()
+    engine.run()
+    answer_facts = []
+    for ident, answer in path:
+        started = time.perf_counter()
+        texts = split_answer(ident, answer)
+        for text in texts:
+            engine.declare(Answer(ident=ident, text=text))
+        answer_facts.extend((ident, text) for text in texts)
+        engine.run()
+        step_seconds.append(time.perf_counter() - started)
+    return engine
+
+
+def _branched_session(path, step_seconds, switch_seconds):
+    rule_sets = get_branch_rule_sets()
+    engine = rule_sets.fork()
+    engine.run()
+    answer_facts = []
+    for ident, answer in path:
+        started = time.perf_counter()
+        texts = split_answer(ident, answer)
+        for text in texts:
+            engine.declare(Answer(ident=ident, text=text))
+        answer_facts.extend((ident, text) for text in texts)
+        previous, engine = engine, rule_sets.advance(engine, answer_facts)
+        engine.run()
+        elapsed = time.perf_counter() - started
+        (step_seconds if engine is previous else switch_seconds).append(elapsed)
+    return engine
+
+
+def _retained_bytes(session, path):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    engine = session(path, [], [])
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del engine
+    return retained
+
+
+def _branch(path):
+    return branch_for(
+        (ident, text) for ident, answer in path for text in split_answer(ident, answer)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    logging.getLogger("ExpertSystem.engine_factory").setLevel(logging.ERROR)
+
+    paths = [path for age in AGES for path in concrete_paths(number=age)]
+    paths += [
+        list(patient["answers"].items())
+        for patient in generate_patients(args.patients, args.seed)
+    ]
+    by_branch = {branch: [p for p in paths if _branch(p) == branch] for branch in BRANCH_ANSWERS}
+
+    # Build every engine class up front, so the timings only cover sessions.
+    rule_sets = get_branch_rule_sets()
+    full = get_engine_factory()
+    for partition in ("triage", *BRANCH_ANSWERS):
+        rule_sets.factory(partition)
+
+    mismatches = 0
+    print(
+        f"{'branch':<7}{'sessions':>9}{'rules':>14}{'step ms':>17}{'switch ms':>11}"
+        f"{'session ms':>18}{'session KB':>18}"
+    )
+    for branch, branch_paths in by_branch.items():
+        timings = {}
+        for name, session in (("full", _full_session), ("branched", _branched_session)):
+            fastest = None
+            for _ in range(args.repeat):
+                steps, switches = [], []
+                results = [
+                    result_from_engine(session(path, steps, switches)) for path in branch_paths
+                ]
+                if fastest is None or sum(steps) + sum(switches) < fastest[0]:
+                    fastest = (sum(steps) + sum(switches), steps, switches, results)
+            timings[name] = fastest
+        mismatches += sum(
+            1 for a, b in zip(timings["full"][3], timings["branched"][3]) if a != b
+        )
+
+        factory = rule_sets.factory(branch)
+        rules = len(factory.flow_rule_names) + len(factory.diagnostic_rule_names)
+        full_rules = len(full.flow_rule_names) + len(full.diagnostic_rule_names)
+        step = {name: statistics.fmean(timing[1]) * 1000 for name, timing in timings.items()}
+        switch = statistics.fmean(timings["branched"][2]) * 1000
+        session_ms = {
+            name: timing[0] / len(branch_paths) * 1000 for name, timing in timings.items()
+        }
+        memory = {
+            name: statistics.fmean(_retained_bytes(session, path) for path in branch_paths[:20])
+            / 1024
+            for name, session in (("full", _full_session), ("branched", _branched_session))
+        }
+        print(
+            f"{branch:<7}{len(branch_paths):>9}{full_rules:>7} -> {rules:<4}"
+            f"{step['full']:>8.3f} -> {step['branched']:<6.3f}{switch:>8.3f}"
+            f"{session_ms['full']:>11.2f} -> {session_ms['branched']:<6.2f}"
+            f"{memory['full']:>9.1f} -> {memory['branched']:<6.1f}"
+        )
+
+    print(f"Result mismatches: {mismatches}")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Result cache hit rate over a stream of synthetic patients.
+
+Patients from ExpertSystem.patient_generator are keyed exactly as
+ExpertSystem.diagnose keys requests, and replayed through in-memory
+ResultCaches of several sizes. Only the keys matter for the hit rate, so
+misses store a placeholder instead of running the engine.
+
+Usage:
+    python -m benchmarks.cache_hit_rate [--patients N] [--seed S] [--sizes 256,4096]
+"""
+
+import argparse
+import time
+
+from ExpertSystem.patient_generator import generate_patients
+from ExpertSystem.result_cache import ResultCache, answers_key, knowledge_base_version, split_answer
+
+
+def request_keys(patients, seed, version):
+    keys = []
+    for patient in generate_patients(patients, seed):
+        pairs = [
+            (ident, text)
+            for ident, value in patient["answers"].items()
+            for text in split_answer(ident, value)
+        ]
+        keys.append(answers_key(pairs, version))
+    return keys
+
+
+def replay(keys, max_entries, version):
+    cache = ResultCache(max_entries=max_entries, version=version)
+    for key in keys:
+        if cache.get(key) is None:
+            cache.put(key, {})
+    return cache.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sizes", default="256,4096,65536")
+    args = parser.parse_args()
+
+    version = knowledge_base_version()
+    started = time.perf_counter()
+    keys = request_keys(args.patients, args.seed, version)
+    elapsed = time.perf_counter() - started
+    print(
+        f"{len(keys)} patients, {len(set(keys))} distinct answer sets "
+        f"(generated and keyed in {elapsed:.1f} s)"
+    )
+    for size in (int(size) for size in args.sizes.split(",")):
+        stats = replay(keys, size, version)
+        print(
+            f"max_entries {size:>8}: hit rate {stats['hits'] / len(keys):6.1%}, "
+            f"{stats['evictions']} evictions"
+        )
+
+
+if __name__ == "__main__":
+    main()
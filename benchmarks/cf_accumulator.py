@@ -0,0 +1,133 @@
+"""Rule firings and latency: CF accumulator vs. retract/declare chains.
+
+Every concrete question-flow path is answered for a few ages, one answer at
+a time as the API does. Rule firings and latency are measured against the
+same engine class with the baseline's modifier and merge rules
+(benchmarks.legacy.LegacyRules), where every adjustment retracted a
+Diagnosis and declared a new one. The final certainty factors and reasoning
+fragments must be those of the baseline engine itself, run from its commit
+by benchmarks.legacy; sessions whose merged reasonings list the fragments in
+another order are counted.
+
+Usage:
+    python -m benchmarks.cf_accumulator [--repeat N]
+"""
+
+import argparse
+import logging
+import time
+
+from benchmarks.legacy import baseline_outputs, legacy_engine_class, reasoning_fragments
+from experta import Fact, watchers
+from ExpertSystem.engine_factory import get_engine_factory
+from ExpertSystem.facts import Answer
+from ExpertSystem.Questions.flow_compiler import concrete_paths
+from ExpertSystem.snapshot import EngineSnapshot
+
+AGES = ("8", "35", "70")
+
+
+class _FiringCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def _texts(ident, answer):
+    return answer.split(",") if ident == "locations" else [answer]
+
+
+def _session(snapshot, path):
+    engine = snapshot.fork()
+    engine.declare(Fact(start=True))
+    engine.run()
+    for ident, answer in path:
+        engine.retract_next_question(ident)
+        for text in _texts(ident, answer):
+            engine.declare(Answer(ident=ident, text=text))
+        engine.run()
+    return engine
+
+
+def _baseline_results(corpus):
+    cases = [
+        [[["answer", ident, text] for text in _texts(ident, answer)] for ident, answer in path]
+        for path in corpus
+    ]
+    return [
+        [(d[0], d[1], d[3]) for d in result["diagnoses"]] for result in baseline_outputs(cases)
+    ]
+
+
+def _final_results(engine):
+    return sorted(
+        (d["disease"], round(d["cf"], 9), d["reasoning"]) for d in engine.diagnoses()
+    )
+
+
+def _compare(current, baseline):
+    """(sessions with other CFs or fragments, sessions with reordered fragments)."""
+    mismatches = reordered = 0
+    for ours, theirs in zip(current, baseline):
+        if [(d[0], d[1], reasoning_fragments(d[2])) for d in ours] != [
+            (d[0], d[1], reasoning_fragments(d[2])) for d in theirs
+        ]:
+            mismatches += 1
+        elif ours != theirs:
+            reordered += 1
+    return mismatches, reordered
+
+
+def _run(snapshot, corpus, repeat):
+    counter = _FiringCounter()
+    watchers.RULES.addHandler(counter)
+    watchers.RULES.setLevel(logging.INFO)
+    watchers.RULES.propagate = False
+    try:
+        results = [_final_results(_session(snapshot, path)) for path in corpus]
+    finally:
+        watchers.RULES.removeHandler(counter)
+        watchers.RULES.setLevel(logging.NOTSET)
+        watchers.RULES.propagate = True
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for path in corpus:
+            _session(snapshot, path)
+    seconds = (time.perf_counter() - started) / (repeat * len(corpus))
+    return results, counter.count, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    factory = get_engine_factory()
+    current_engine = factory.create()
+    current_engine.reset()
+    legacy_engine = legacy_engine_class(factory)()
+    legacy_engine.reset()
+
+    corpus = [path for age in AGES for path in concrete_paths(number=age)]
+    current, current_firings, current_seconds = _run(
+        EngineSnapshot(current_engine), corpus, args.repeat
+    )
+    _, legacy_firings, legacy_seconds = _run(
+        EngineSnapshot(legacy_engine), corpus, args.repeat
+    )
+    mismatches, reordered = _compare(current, _baseline_results(corpus))
+    print(f"Sessions:            {len(corpus)}")
+    print(f"Rule firings:        {legacy_firings} -> {current_firings}")
+    print(f"Mean session:        {legacy_seconds * 1000:.2f} ms -> {current_seconds * 1000:.2f} ms")
+    print(f"Result mismatches:   {mismatches}")
+    print(f"Reordered reasonings: {reordered}")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
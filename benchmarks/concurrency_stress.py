@@ -0,0 +1,179 @@
+"""Concurrency stress test of the API server's session executor.
+
+Many synthetic patients walk the question flow through the API at once, on
+one event loop, the way concurrent browsers would. Every answer is submitted
+twice at the same moment (a double click), while a status poll races it.
+Checked:
+
+* operations on one session never overlap: every session operation of
+  test.py is wrapped to count how many run at once for its session;
+* exactly one of each pair of duplicate answers is accepted, and the other
+  is rejected with 400;
+* every session ends with the diagnosis a one-shot run gives its answers;
+* the event loop stays responsive: a ticker measures how late it wakes up.
+
+The LLM explanation is replaced by a sleep of --llm-latency seconds, so the
+run needs no network and explanations still take a while to become ready.
+
+Usage:
+    python -m benchmarks.concurrency_stress [--sessions N] [--workers N] [--llm-latency S]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import Counter
+
+
+def _guard(function, active, overlaps, in_flight, lock):
+    """`function(session_id, ...)` counting concurrent calls per session and overall."""
+
+    def guarded(session_id, *args):
+        with lock:
+            active[session_id] += 1
+            if active[session_id] > 1:
+                overlaps.append(session_id)
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        try:
+            return function(session_id, *args)
+        finally:
+            with lock:
+                active[session_id] -= 1
+                in_flight[0] -= 1
+
+    return guarded
+
+
+async def _ticker(lags, stop, interval=0.005):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - started - interval)
+
+
+async def _session(client, patient, latencies, duplicates, rejections):
+    async def timed(method, url, **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        latencies.append(time.perf_counter() - started)
+        return response
+
+    response = await timed("POST", "/api/sessions", json={})
+    session_id = response.json()["session_id"]
+    while True:
+        status = (await timed("GET", f"/api/sessions/{session_id}/status")).json()
+        question = status.get("current_question")
+        if not question:
+            return status
+        ident = question["question_id"]
+        value = patient["answers"][ident]
+        body = {
+            "question_id": ident,
+            "answer": ",".join(value) if isinstance(value, list) else value,
+            "is_multiple": isinstance(value, list),
+        }
+        url = f"/api/sessions/{session_id}/answer"
+        first, second, _ = await asyncio.gather(
+            timed("POST", url, json=body),
+            timed("POST", url, json=body),
+            timed("GET", f"/api/sessions/{session_id}/status"),
+        )
+        duplicates[(first.status_code == 200) + (second.status_code == 200)] += 1
+        rejections.update(r.status_code for r in (first, second) if r.status_code != 200)
+
+
+async def _run(server, patients, concurrency):
+    import httpx
+
+    latencies, lags, duplicates, rejections = [], [], Counter(), Counter()
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(lags, stop))
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=server.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://stress") as client:
+
+        async def one(patient):
+            async with semaphore:
+                return await _session(client, patient, latencies, duplicates, rejections)
+
+        started = time.perf_counter()
+        statuses = await asyncio.gather(*(one(patient) for patient in patients))
+        elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    return statuses, elapsed, latencies, lags, duplicates, rejections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50, help="sessions in flight at once")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Every run must reach the engine, so the result cache is off.
+    os.environ["DERMATOLOGY_RESULT_CACHE_SIZE"] = "0"
+    os.environ["DERMATOLOGY_ENGINE_WORKERS"] = str(args.workers)
+    logging.getLogger("ExpertSystem.engine_factory").setLevel(logging.ERROR)
+
+    import AI.llm
+    import test as server
+    from ExpertSystem.diagnose import diagnose
+    from ExpertSystem.patient_generator import generate_patients
+    from ExpertSystem.result_cache import ResultCache
+
+    def explain(result_text):
+        time.sleep(args.llm_latency)
+        return "explanation"
+
+    AI.llm.explain_result_with_llm = explain
+
+    active, overlaps, in_flight, lock = Counter(), [], [0, 0], threading.Lock()
+    for name in ("open_session", "session_status", "session_answer", "run_expert_system"):
+        setattr(server, name, _guard(getattr(server, name), active, overlaps, in_flight, lock))
+
+    patients = list(generate_patients(args.sessions, args.seed))
+    statuses, elapsed, latencies, lags, duplicates, rejections = asyncio.run(
+        _run(server, patients, args.concurrency)
+    )
+
+    mismatches = 0
+    for patient, status in zip(patients, statuses):
+        expected = diagnose({"answers": patient["answers"]}, cache=ResultCache(max_entries=0))
+        diagnosis = (status.get("diagnosis") or {}).get("diagnosis")
+        got = (diagnosis["disease"], round(diagnosis["cf"], 9)) if diagnosis else None
+        want = (expected["disease"], round(expected["confidence"], 9)) if "disease" in expected else None
+        mismatches += got != want
+
+    latencies.sort()
+    print(f"sessions          {len(patients)} ({args.concurrency} at once, {args.workers} workers)")
+    print(f"requests          {len(latencies)} in {elapsed:.2f} s ({len(latencies) / elapsed:.0f}/s)")
+    print(
+        f"latency ms        p50 {latencies[len(latencies) // 2] * 1000:.1f}"
+        f"  p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f}"
+        f"  max {latencies[-1] * 1000:.1f}"
+    )
+    print(
+        f"event loop lag ms mean {statistics.fmean(lags) * 1000:.2f}  max {max(lags) * 1000:.2f}"
+    )
+    print(f"operations at once (all sessions) max {in_flight[1]}")
+    print(f"duplicate answers accepted: {dict(sorted(duplicates.items()))} (want only 1)")
+    print(f"duplicate answers rejected with: {dict(sorted(rejections.items()))} (want only 400)")
+    print(f"overlapping operations on one session: {len(overlaps)}")
+    print(f"diagnosis mismatches: {mismatches}")
+    print(f"executor: {server.session_executor.stats()}")
+    if overlaps or mismatches or set(duplicates) != {1} or set(rejections) - {400}:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Regression check and scaling of the duplicate-diagnosis merge.
+
+Psoriasis, eczema and contact dermatitis each have four diagnostic rules, so
+one patient can produce several Diagnosis facts for the same disease. They
+used to be merged by a `combine_duplicate_diagnosis` rule that joined every
+Diagnosis against every other one of the same disease; the accumulator in
+ExpertSystem.evidence folds each one into the disease's entry as it is
+declared.
+
+For every combination of two or more rules of such a disease, and a spread
+of ages, durations and severities, a full answer set is built (the rules'
+answers, completed along the question flow) and diagnosed. The results must
+match the outputs of the baseline engine (see benchmarks.legacy) stored in
+benchmarks/duplicate_merge_golden.json: the same diseases with the same
+certainty factors, and reasonings made of the same fragments. The fragments
+of a merged reasoning may come in another order, and merge_count is not
+compared: the baseline's modifier rules re-declared a merged Diagnosis
+without it, resetting it to 0, while the accumulator counts every merge.
+
+`--update` records the stored outputs again by running the baseline commit.
+
+The merge cost for one disease with n duplicate Diagnosis facts is timed on
+the accumulator and on the baseline's pairwise rule (benchmarks.legacy.LegacyRules).
+
+Usage:
+    python -m benchmarks.duplicate_merge [--update]
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+
+from benchmarks.legacy import (
+    BASELINE_COMMIT,
+    answer_steps,
+    baseline_outputs,
+    legacy_engine_class,
+    reasoning_fragments,
+)
+from ExpertSystem.batch_scorer import extract_diagnostic_rules
+from ExpertSystem.engine_factory import get_engine_factory
+from ExpertSystem.facts import Answer, Diagnosis
+from ExpertSystem.Questions.flow_compiler import get_resolver
+from ExpertSystem.Questions.question import get_question_by_ident
+from ExpertSystem.result_cache import MULTI_VALUED_IDENTS
+from ExpertSystem.snapshot import EngineSnapshot
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "duplicate_merge_golden.json")
+AGES = ("8", "35", "70")
+DURATIONS = ("chronic with flares", "1-2 weeks")
+SEVERITIES = ("mild", "severe")
+SCALING = (2, 4, 8, 16, 32)
+
+
+def _merged_rule_sets():
+    """Feature sets of every consistent combination of 2+ rules of one disease."""
+    by_disease = defaultdict(list)
+    for _, features, disease, _, _ in extract_diagnostic_rules():
+        by_disease[disease].append(features)
+
+    for disease, rules in by_disease.items():
+        for size in range(2, len(rules) + 1):
+            for combination in itertools.combinations(rules, size):
+                features = {}
+                consistent = True
+                for ident, text in itertools.chain.from_iterable(combination):
+                    if ident in MULTI_VALUED_IDENTS:
+                        features.setdefault(ident, []).append(text)
+                    elif features.setdefault(ident, text) != text:
+                        consistent = False
+                if consistent:
+                    yield disease, features
+
+
+def _complete(features):
+    """`features` plus answers for every other question along the flow."""
+    resolver = get_resolver()
+    answers = dict(features)
+    state = resolver.start_state
+    ident = resolver.question(state)
+    while ident is not None:
+        if ident not in answers:
+            valid = get_question_by_ident(ident)["valid"]
+            answers[ident] = "no" if "no" in valid else [valid[0]]
+        value = answers[ident]
+        state = resolver.advance(state, ident, value if isinstance(value, str) else value[0])
+        ident = resolver.question(state)
+    return answers
+
+
+def _key(answers):
+    return json.dumps(sorted((ident, value) for ident, value in answers.items()))
+
+
+def answer_sets():
+    """Distinct (disease, answers) built from every merged rule set and modifier."""
+    seen = set()
+    for disease, features in _merged_rule_sets():
+        for age, duration, severity in itertools.product(AGES, DURATIONS, SEVERITIES):
+            modifiers = {"age": age, "duration": duration, "severity": severity}
+            answers = _complete({**modifiers, **features})
+            if _key(answers) not in seen:
+                seen.add(_key(answers))
+                yield disease, answers
+
+
+def _declare_answers(engine, answers):
+    for ident, value in answers.items():
+        for text in value if isinstance(value, list) else [value]:
+            engine.declare(Answer(ident=ident, text=text))
+
+
+def _legacy_snapshot(factory):
+    engine = legacy_engine_class(factory)()
+    engine.reset()
+    return EngineSnapshot(engine)
+
+
+def current_outputs(factory, sets):
+    outputs = {}
+    for _, answers in sets:
+        engine = factory.fork()
+        _declare_answers(engine, answers)
+        engine.run()
+        outputs[_key(answers)] = [
+            [d["disease"], round(d["cf"], 9), d["merge_count"], d["reasoning"]]
+            for d in sorted(engine.diagnoses(), key=lambda d: d["disease"])
+        ]
+    return outputs
+
+
+def golden_outputs(sets):
+    """The baseline engine's diagnoses of every answer set."""
+    results = baseline_outputs([[answer_steps(answers)] for _, answers in sets])
+    return {
+        _key(answers): result["diagnoses"] for (_, answers), result in zip(sets, results)
+    }
+
+
+def compare(outputs, golden):
+    """(failures, answer sets whose reasoning fragments only come in another order)."""
+    failures, reordered = [], 0
+    for key, diagnoses in outputs.items():
+        expected = golden.get(key)
+        if expected is None:
+            failures.append(f"no stored output for {key}; rerun with --update")
+            continue
+        if [(d[0], d[1]) for d in diagnoses] != [(d[0], d[1]) for d in expected]:
+            failures.append(f"diagnoses or CFs changed for {key}")
+        elif [reasoning_fragments(d[3]) for d in diagnoses] != [reasoning_fragments(d[3]) for d in expected]:
+            failures.append(f"reasoning changed for {key}")
+        elif [d[3] for d in diagnoses] != [d[3] for d in expected]:
+            reordered += 1
+    return failures, reordered
+
+
+def _merge_seconds(snapshot_or_factory, disease, count, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        engine = snapshot_or_factory.fork()
+        facts = [
+            Diagnosis(disease=disease, cf=0.5, reasoning=f"evidence {i}") for i in range(count)
+        ]
+        started = time.perf_counter()
+        engine.declare(*facts)
+        engine.run()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--update", action="store_true", help="rewrite the stored outputs")
+    args = parser.parse_args()
+    logging.getLogger("ExpertSystem.engine_factory").setLevel(logging.ERROR)
+
+    factory = get_engine_factory()
+    legacy = _legacy_snapshot(factory)
+    sets = list(answer_sets())
+    outputs = current_outputs(factory, sets)
+
+    if args.update:
+        golden = golden_outputs(sets)
+        with open(GOLDEN_PATH, "w", encoding="utf-8") as f:
+            json.dump(
+                {"recorded_from": BASELINE_COMMIT, "outputs": golden},
+                f, indent=1, ensure_ascii=False, sort_keys=True,
+            )
+            f.write("\n")
+        print(f"Stored the baseline's outputs for {len(golden)} answer sets in {GOLDEN_PATH}")
+    else:
+        with open(GOLDEN_PATH, encoding="utf-8") as f:
+            golden = json.load(f)["outputs"]
+    failures, reordered = compare(outputs, golden)
+
+    merged = sum(1 for diagnoses in outputs.values() if any(d[2] > 0 for d in diagnoses))
+    print(f"Answer sets:  {len(sets)} ({merged} with merged diagnoses)")
+    print(f"Reasoning fragments in another order than the baseline's: {reordered}")
+    print(f"{'duplicates':>10}  {'pairwise rule':>14}  {'accumulator':>12}")
+    for count in SCALING:
+        legacy_seconds = _merge_seconds(legacy, "Psoriasis", count)
+        current_seconds = _merge_seconds(factory, "Psoriasis", count)
+        print(f"{count:>10}  {legacy_seconds * 1000:>11.2f} ms  {current_seconds * 1000:>9.2f} ms")
+
+    for failure in failures[:20]:
+        print(f"FAIL {failure}")
+    if failures:
+        raise SystemExit(1)
+    print(f"Merge results match the outputs of the baseline ({BASELINE_COMMIT}).")
+
+
+if __name__ == "__main__":
+    main()
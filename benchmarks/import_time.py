@@ -0,0 +1,82 @@
+"""Cold-start import cost of each entry point, from `python -X importtime`.
+
+Every target is imported in a fresh interpreter a few times and the fastest
+run is kept. The run fails when the CLI path (`import app`) exceeds its
+budget, or when an entry point imports a module it must only load lazily.
+
+Usage:
+    python -m benchmarks.import_time [--runs N] [--budget-ms MS]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# entry point module -> modules it must not import at start-up
+TARGETS = {
+    "app": ("gui", "tkinter", "AI.llm", "huggingface_hub", "numpy"),
+    "test": ("gui", "tkinter", "AI.llm", "huggingface_hub", "numpy"),
+    "gui": ("AI.llm", "huggingface_hub"),
+}
+BUDGETED = "app"
+DEFAULT_BUDGET_MS = 150.0
+
+
+def import_profile(module):
+    """Return ({imported module: cumulative us}, total us) for one cold import."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr}")
+
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, total, name = line[len("import time:"):].split("|")
+        cumulative[name.strip()] = int(total)
+    return cumulative, cumulative.get(module, 0)
+
+
+def measure(module, runs):
+    best = None
+    for _ in range(runs):
+        cumulative, total = import_profile(module)
+        if best is None or total < best[1]:
+            best = (cumulative, total)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entry point import-time benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    args = parser.parse_args()
+
+    failures = []
+    for module, forbidden in TARGETS.items():
+        cumulative, total = measure(module, args.runs)
+        leaked = [name for name in forbidden if name in cumulative]
+        print(f"import {module:<6} {total / 1000:8.1f} ms  ({len(cumulative)} modules)")
+        if leaked:
+            failures.append(f"import {module} loads {', '.join(leaked)} eagerly")
+        if module == BUDGETED and total / 1000 > args.budget_ms:
+            failures.append(
+                f"import {module} took {total / 1000:.1f} ms, budget is {args.budget_ms:.1f} ms"
+            )
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
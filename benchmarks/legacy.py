@@ -0,0 +1,285 @@
+"""The engine as of the baseline commit, the one reference of the benchmarks.
+
+Benchmarks that check a rewritten part of the engine compare its results
+with the engine before the series of changes: commit BASELINE_COMMIT. Rather
+than keeping a copy of its rules per benchmark, `baseline_outputs` runs that
+commit's own code, checked out into a temporary git worktree, in a separate
+interpreter (both trees are the `ExpertSystem` package, so they cannot share
+one). It needs git and the repository history.
+
+A case is a list of steps and a step a list of facts, each one of
+
+    ["answer", ident, text]
+    ["diagnosis", disease, cf, reasoning]
+
+declared on a reset engine, which is run after every step. The result of a
+case is {"diagnoses": [[disease, cf, merge_count, reasoning], ...] sorted by
+disease, "best": the best diagnosis's disease or None}, with CFs rounded to
+9 places.
+
+With rules="full" the engine has the question flow and diagnostic rules, as
+the baseline API server built it; with rules="base" only the modifier, merge
+and final-result rules of DermatologyExpert.
+
+LegacyRules are the baseline's modifier and merge rules on the current
+engine class, for the benchmarks that time the old rule chains against the
+accumulator in the same process. Their results are checked against the
+baseline by benchmarks.cf_accumulator.
+"""
+
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from experta import AS, MATCH, NOT, TEST, W, Fact, KnowledgeEngine, Rule
+from ExpertSystem.Data.disease import DURATION_MAPPING
+from ExpertSystem.facts import Answer, Diagnosis, DiseaseInfo, NextQuestion
+
+BASELINE_COMMIT = "1995b85"
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_RUNNER = """
+import json, sys
+from ExpertSystem.engine import DermatologyExpert
+from ExpertSystem.facts import Answer, Diagnosis
+from ExpertSystem.Questions.diagnosis import apply_diagnostic_rules
+from ExpertSystem.Questions.question_flow import apply_question_flow
+
+job = json.load(sys.stdin)
+engine_class = DermatologyExpert
+if job["rules"] == "full":
+    engine_class = apply_diagnostic_rules(apply_question_flow(DermatologyExpert))
+results = []
+for case in job["cases"]:
+    engine = engine_class()
+    engine.reset()
+    for step in case:
+        for kind, *fields in step:
+            if kind == "answer":
+                engine.declare(Answer(ident=fields[0], text=fields[1]))
+            else:
+                engine.declare(Diagnosis(disease=fields[0], cf=fields[1], reasoning=fields[2]))
+        engine.run()
+    diagnoses = [f for f in engine.facts.values() if isinstance(f, Diagnosis)]
+    best = engine.best_diagnosis
+    results.append({
+        "diagnoses": sorted(
+            [d["disease"], round(d["cf"], 9), d["merge_count"], d["reasoning"]]
+            for d in diagnoses
+        ),
+        "best": best["disease"] if best is not None else None,
+    })
+json.dump(results, sys.stdout)
+"""
+
+
+@contextlib.contextmanager
+def baseline_checkout(commit=BASELINE_COMMIT):
+    """A temporary worktree of `commit`, removed on exit."""
+    with tempfile.TemporaryDirectory(prefix="dermatology-baseline-") as parent:
+        path = os.path.join(parent, "tree")
+        subprocess.run(
+            ["git", "worktree", "add", "--detach", "--quiet", path, commit],
+            cwd=REPO_ROOT,
+            check=True,
+        )
+        try:
+            yield path
+        finally:
+            subprocess.run(
+                ["git", "worktree", "remove", "--force", path], cwd=REPO_ROOT, check=False
+            )
+
+
+def baseline_outputs(cases, rules="full", checkout=None):
+    """The baseline engine's result for every case, in order."""
+    if checkout is None:
+        with baseline_checkout() as path:
+            return baseline_outputs(cases, rules, path)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [checkout] + [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p]
+    )
+    completed = subprocess.run(
+        [sys.executable, "-c", _RUNNER],
+        cwd=checkout,
+        env=env,
+        input=json.dumps({"rules": rules, "cases": cases}),
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"The baseline engine failed:\n{completed.stderr}")
+    return json.loads(completed.stdout)
+
+
+def answer_steps(answers):
+    """One step declaring every answer of an {ident: text or [texts]} dict."""
+    return [
+        ["answer", ident, text]
+        for ident, value in answers.items()
+        for text in (value if isinstance(value, list) else [value])
+    ]
+
+
+def reasoning_fragments(reasoning):
+    """The "; "-separated fragments of a reasoning string, in sorted order.
+
+    The accumulator joins merged reasonings in order of evidence, the
+    baseline's merge rule in the order the agenda paired the two facts, so
+    the benchmarks compare reasonings as fragments.
+    """
+    return sorted(part.strip() for part in reasoning.split(";"))
+
+
+def legacy_engine_class(factory):
+    """The current engine class with the baseline's modifier and merge rules."""
+    return type("LegacyChainExpert", (LegacyRules, factory.engine_class), {})
+
+
+class LegacyRules:
+    """The retract/declare modifier and merge rules of the baseline engine."""
+
+    def declare(self, *facts):
+        return KnowledgeEngine.declare(self, *facts)
+
+    def diagnoses(self):
+        return [f for f in self.facts.values() if isinstance(f, Diagnosis)]
+
+    @property
+    def fired_rules_log(self):
+        # The old engine formatted every message eagerly into a plain list.
+        return self.__dict__.setdefault("_fired_rules_log", [])
+
+    def _replace(self, diagnosis, log_message, **fields):
+        self.fired_rules_log.append(log_message)
+        self.retract(diagnosis)
+        self.declare(Diagnosis(**fields))
+
+    @Rule(
+        AS.diagnosis << Diagnosis(disease=MATCH.disease, cf=MATCH.old_cf,
+                                  reasoning=MATCH.old_reasoning, age_boosted=False),
+        DiseaseInfo(name=MATCH.disease, age_min=MATCH.age_min, age_max=MATCH.age_max),
+        Answer(ident="age", text=MATCH.age_str),
+        TEST(lambda age_str, age_min, age_max: age_min <= int(age_str) <= age_max),
+        salience=50,
+    )
+    def age_match_bonus(self, diagnosis, disease, old_cf, old_reasoning, age_str, age_min, age_max):
+        new_cf = self.combine_cf(old_cf, 0.15)
+        self._replace(
+            diagnosis, f"✅ Age match bonus for {disease}: {old_cf:.3f} + 0.15 = {new_cf:.3f}",
+            disease=disease, cf=new_cf, age_boosted=True,
+            reasoning=f"{old_reasoning}; age match bonus ({age_str} in {age_min}-{age_max})",
+        )
+
+    @Rule(
+        AS.diagnosis << Diagnosis(disease=MATCH.disease, cf=MATCH.old_cf,
+                                  reasoning=MATCH.old_reasoning, age_boosted=False),
+        DiseaseInfo(name=MATCH.disease, age_min=MATCH.age_min, age_max=MATCH.age_max),
+        Answer(ident="age", text=MATCH.age_str),
+        TEST(lambda age_str, age_min, age_max: not (age_min <= int(age_str) <= age_max)),
+        salience=50,
+    )
+    def age_mismatch_penalty(self, diagnosis, disease, old_cf, old_reasoning, age_str, age_min, age_max):
+        new_cf = self.combine_cf(old_cf, -0.2)
+        self._replace(
+            diagnosis, f"❌ Age mismatch penalty for {disease}: {old_cf:.3f} - 0.2 = {new_cf:.3f}",
+            disease=disease, cf=new_cf, age_boosted=True,
+            reasoning=f"{old_reasoning}; age mismatch penalty ({age_str} not in {age_min}-{age_max})",
+        )
+
+    @Rule(
+        AS.diagnosis << Diagnosis(disease=MATCH.disease, cf=MATCH.old_cf, reasoning=MATCH.old_reasoning,
+                                  age_boosted=True, duration_boosted=False),
+        DiseaseInfo(name=MATCH.disease, common_duration=MATCH.disease_duration),
+        Answer(ident="duration", text=MATCH.user_duration),
+        TEST(lambda user_duration, disease_duration:
+             disease_duration not in DURATION_MAPPING.get(user_duration, [])),
+        salience=45,
+    )
+    def duration_mismatch_penalty(self, diagnosis, disease, old_cf, old_reasoning, user_duration, disease_duration):
+        new_cf = self.combine_cf(old_cf, -0.4)
+        self._replace(
+            diagnosis, f"⏰ Duration mismatch penalty for {disease}: {old_cf:.3f} - 0.4 = {new_cf:.3f}",
+            disease=disease, cf=new_cf, age_boosted=True, duration_boosted=True,
+            reasoning=f"{old_reasoning}; duration mismatch penalty ({user_duration} vs {disease_duration})",
+        )
+
+    @Rule(
+        AS.diagnosis << Diagnosis(disease=MATCH.disease, cf=MATCH.old_cf, reasoning=MATCH.old_reasoning,
+                                  age_boosted=True, duration_boosted=False),
+        DiseaseInfo(name=MATCH.disease, common_duration=MATCH.disease_duration),
+        Answer(ident="duration", text=MATCH.user_duration),
+        TEST(lambda user_duration, disease_duration:
+             disease_duration in DURATION_MAPPING.get(user_duration, [])),
+        salience=45,
+    )
+    def duration_match_bonus(self, diagnosis, disease, old_cf, old_reasoning, user_duration, disease_duration):
+        new_cf = self.combine_cf(old_cf, 0.1)
+        self._replace(
+            diagnosis, f"⏰ Duration match bonus for {disease}: {old_cf:.3f} + 0.1 = {new_cf:.3f}",
+            disease=disease, cf=new_cf, age_boosted=True, duration_boosted=True,
+            reasoning=f"{old_reasoning}; duration match bonus ({user_duration} matches {disease_duration})",
+        )
+
+    @Rule(
+        AS.diagnosis << Diagnosis(disease=MATCH.disease, cf=MATCH.old_cf, reasoning=MATCH.old_reasoning,
+                                  age_boosted=True, duration_boosted=True, severity_adjusted=False),
+        DiseaseInfo(name=MATCH.disease, severity_levels=MATCH.levels),
+        Answer(ident="severity", text=MATCH.user_severity),
+        TEST(lambda user_severity, levels: levels and user_severity in levels),
+        salience=40,
+    )
+    def severity_match_bonus(self, diagnosis, disease, old_cf, old_reasoning, user_severity, levels):
+        new_cf = self.combine_cf(old_cf, 0.15)
+        self._replace(
+            diagnosis, f"💪 Severity match bonus for {disease}: {old_cf:.3f} + 0.15 = {new_cf:.3f}",
+            disease=disease, cf=new_cf, age_boosted=True, duration_boosted=True, severity_adjusted=True,
+            reasoning=f"{old_reasoning}; severity match bonus ({user_severity} in {levels})",
+        )
+
+    @Rule(
+        AS.diagnosis << Diagnosis(disease=MATCH.disease, cf=MATCH.old_cf, reasoning=MATCH.old_reasoning,
+                                  age_boosted=True, severity_adjusted=False),
+        DiseaseInfo(name=MATCH.disease, severity_levels=MATCH.levels),
+        Answer(ident="severity", text=MATCH.user_severity),
+        TEST(lambda user_severity, levels: levels and user_severity not in levels),
+        salience=40,
+    )
+    def severity_mismatch_penalty(self, diagnosis, disease, old_cf, old_reasoning, user_severity, levels):
+        new_cf = self.combine_cf(old_cf, -0.15)
+        self._replace(
+            diagnosis, f"💪 Severity mismatch penalty for {disease}: {old_cf:.3f} - 0.15 = {new_cf:.3f}",
+            disease=disease, cf=new_cf, age_boosted=True, duration_boosted=True, severity_adjusted=True,
+            reasoning=f"{old_reasoning}; severity mismatch penalty ({user_severity} not in {levels})",
+        )
+
+    @Rule(
+        AS.old_diag << Diagnosis(disease=MATCH.disease, cf=MATCH.old_cf,
+                                 reasoning=MATCH.old_reasoning, merge_count=MATCH.old_count),
+        AS.new_diag << Diagnosis(disease=MATCH.disease, cf=MATCH.new_cf,
+                                 reasoning=MATCH.new_reasoning, merge_count=MATCH.new_count),
+        TEST(lambda old_diag, new_diag: old_diag != new_diag),
+    )
+    def combine_duplicate_diagnosis(self, old_diag, new_diag, disease, old_cf, new_cf,
+                                    old_reasoning, new_reasoning, old_count, new_count):
+        combined_cf = self.combine_cf(old_cf, new_cf)
+        merge_count = max(old_count, new_count) + 1
+        self.fired_rules_log.append(
+            f"🔄 Combining Diagnosis for {disease}: {old_cf:.3f} + {new_cf:.3f} "
+            f"= {combined_cf:.3f} (merge count {merge_count})"
+        )
+        self.retract(old_diag)
+        self.retract(new_diag)
+        self.declare(Diagnosis(disease=disease, cf=combined_cf,
+                               reasoning=f"{old_reasoning}; {new_reasoning}", merge_count=merge_count))
+
+    @Rule(NOT(NextQuestion(W())), NOT(Fact(id="results_processed")), salience=-1000)
+    def process_final_results(self):
+        self.declare(Fact(id="results_processed"))
+        diagnoses = self.diagnoses()
+        self.best_diagnosis = max(diagnoses, key=lambda d: d["cf"]) if diagnoses else None
+        self.halt()
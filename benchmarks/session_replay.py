@@ -0,0 +1,124 @@
+"""Replaying persisted sessions vs. keeping them resident.
+
+Synthetic patients answer the question flow through
+ExpertSystem.session_state, as API sessions do. After every answer the
+session is stored in a SQLite backend, loaded back and restored by
+replaying its answer log, and the restored session must be in the same
+state as the live one (flow state, answers, differential and result).
+
+Reported per number of answers given: the memory a resident session keeps
+alive, the size of its persisted record, and the time to save it, load it
+and replay it.
+
+Usage:
+    python -m benchmarks.session_replay [--patients N] [--seed S] [--repeat N]
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+
+from ExpertSystem.diagnose import result_from_engine
+from ExpertSystem.patient_generator import generate_patients
+from ExpertSystem.session_state import apply_answer, new_session, restore_session, session_record
+from ExpertSystem.session_store import SQLiteSessionBackend, session_bytes
+
+
+def _answer_value(ident, value):
+    if isinstance(value, list):
+        return ",".join(value), True
+    return value, False
+
+
+def _state(session):
+    engine = session["expert_system"]
+    return (
+        session["flow_state"],
+        session["answer_facts"],
+        [(d["disease"], round(d["cf"], 9)) for d in engine.differential()],
+        session["result"] or (result_from_engine(engine) if engine.results_processed() else None),
+    )
+
+
+def _best_seconds(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        value = function()
+        best = min(best, time.perf_counter() - started)
+    return best, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patients", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    logging.getLogger("ExpertSystem.engine_factory").setLevel(logging.ERROR)
+
+    rows = defaultdict(lambda: defaultdict(list))
+    mismatches = 0
+    with tempfile.TemporaryDirectory() as directory:
+        backend = SQLiteSessionBackend(os.path.join(directory, "sessions.db"))
+        for patient in generate_patients(args.patients, args.seed):
+            session_id = f"patient-{patient['id']}"
+            session = new_session(session_id)
+            for ident, value in patient["answers"].items():
+                if apply_answer(session, ident, *_answer_value(ident, value)):
+                    session["expert_system"].run()
+                    session["status"] = "processed"
+
+                record = session_record(session)
+                save_seconds, _ = _best_seconds(
+                    lambda: backend.save(session_id, record), args.repeat
+                )
+                load_seconds, loaded = _best_seconds(
+                    lambda: backend.load(session_id), args.repeat
+                )
+                replay_seconds, restored = _best_seconds(
+                    lambda: restore_session(loaded), args.repeat
+                )
+                mismatches += _state(restored) != _state(session)
+
+                row = rows[len(session["answer_log"])]
+                row["resident"].append(session_bytes(session))
+                row["record"].append(len(json.dumps(record, ensure_ascii=False)))
+                row["save"].append(save_seconds)
+                row["load"].append(load_seconds)
+                row["replay"].append(replay_seconds)
+        backend.close()
+
+    print(
+        f"{'answers':>7}{'steps':>7}{'resident KB':>13}{'record B':>10}"
+        f"{'save ms':>9}{'load ms':>9}{'replay ms':>11}"
+    )
+    for answers in sorted(rows):
+        row = rows[answers]
+        print(
+            f"{answers:>7}{len(row['replay']):>7}"
+            f"{statistics.fmean(row['resident']) / 1024:>13.1f}"
+            f"{statistics.fmean(row['record']):>10.0f}"
+            f"{statistics.fmean(row['save']) * 1000:>9.3f}"
+            f"{statistics.fmean(row['load']) * 1000:>9.3f}"
+            f"{statistics.fmean(row['replay']) * 1000:>11.2f}"
+        )
+    resident = statistics.fmean(b for row in rows.values() for b in row["resident"])
+    record = statistics.fmean(b for row in rows.values() for b in row["record"])
+    replay = statistics.fmean(s for row in rows.values() for s in row["replay"])
+    print(
+        f"A resident session keeps {resident / 1024:.1f} KB alive on average; persisted it "
+        f"takes {record:.0f} bytes and {replay * 1000:.2f} ms to replay."
+    )
+    print(f"Restored state mismatches: {mismatches}")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""Startup and per-step latency suite, compared against a stored baseline.
+
+Measures, in milliseconds:
+
+* import.<entry>          cold import of app, test and gui (gui without
+                          opening a window), via benchmarks.import_time
+* engine.class_build      building the rule-augmented engine class, as
+                          every session used to do
+* engine.factory_build    DermatologyEngineFactory(): class, validation,
+                          first instance and golden snapshot
+* engine.create / engine.reset / engine.fork
+* step.<branch>.*         one answer as the API server applies it
+                          (ExpertSystem.session_state.apply_answer, then
+                          `run()`), over the synthetic patients
+                          (ExpertSystem.patient_generator) whose answers take
+                          triage branch A (growths), B (hair and nails), C
+                          (rashes) or D (other conditions): mean, p50, p95
+                          and max
+* session.<branch>.mean   a whole session: new_session, every answer, result
+* session.all.mean
+
+Every step is run by the engine: the suite disables the result cache and
+the decision DAG for its own process.
+
+Each timing keeps the fastest of `--repeat` passes. Results are written as
+JSON; with a baseline, every metric more than `--tolerance` slower than the
+baseline (and by more than `--min-delta-ms`) is reported as a regression
+and the run fails; the `.max` samples are shown but not gated.
+
+Usage:
+    python -m benchmarks.suite [--out results.json] [--baseline PATH]
+    python -m benchmarks.suite --update-baseline
+
+The baseline defaults to benchmarks/baseline.json.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+from benchmarks.import_time import TARGETS, measure
+from ExpertSystem.decision_dag import DAG_ENV
+from ExpertSystem.diagnose import result_from_engine
+from ExpertSystem.engine import DermatologyExpert
+from ExpertSystem.engine_factory import DermatologyEngineFactory, get_engine_factory
+from ExpertSystem.patient_generator import generate_patients
+from ExpertSystem.Questions.diagnosis import apply_diagnostic_rules
+from ExpertSystem.Questions.question_flow import apply_question_flow
+from ExpertSystem.result_cache import (
+    DIR_ENV,
+    MULTI_VALUED_IDENTS,
+    SIZE_ENV,
+    knowledge_base_version,
+)
+from ExpertSystem.session_state import apply_answer, new_session
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# Single worst samples are reported but too noisy to fail a run on.
+UNGATED_SUFFIXES = (".max",)
+
+# The triage questions in the order the flow asks them; the first one
+# answered "yes" picks the branch, and a path answering all of them "no"
+# belongs to branch D.
+TRIAGE = (
+    ("has_symptom_lump_or_growth", "A"),
+    ("affects_nails_or_hair", "B"),
+    ("has_symptom_rash", "C"),
+)
+BRANCHES = ("A", "B", "C", "D")
+
+
+def branch_of(path):
+    answers = dict(path)
+    for ident, branch in TRIAGE:
+        if answers.get(ident) == "yes":
+            return branch
+    return "D"
+
+
+def _fastest(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def import_metrics(runs):
+    return {f"import.{module}": measure(module, runs)[1] / 1000 for module in TARGETS}
+
+
+def engine_metrics(repeat):
+    def build_class():
+        engine_class = type("BenchmarkDermatologyExpert", (DermatologyExpert,), {})
+        apply_diagnostic_rules(apply_question_flow(engine_class))
+
+    factory = get_engine_factory()
+    engines = [factory.create() for _ in range(repeat)]
+    return {
+        "engine.class_build": _fastest(build_class, repeat),
+        "engine.factory_build": _fastest(DermatologyEngineFactory, repeat),
+        "engine.create": _fastest(factory.create, repeat),
+        "engine.reset": _fastest(lambda: engines.pop().reset(), repeat),
+        "engine.fork": _fastest(factory.fork, repeat),
+    }
+
+
+def _session(path, step_seconds):
+    session = new_session("benchmark")
+    for ident, answer in path:
+        started = time.perf_counter()
+        if apply_answer(session, ident, answer, ident in MULTI_VALUED_IDENTS):
+            session["expert_system"].run()
+        step_seconds.append(time.perf_counter() - started)
+    return result_from_engine(session["expert_system"])
+
+
+def session_metrics(repeat, patients, seed):
+    paths = {branch: [] for branch in BRANCHES}
+    for patient in generate_patients(patients, seed):
+        path = list(patient["answers"].items())
+        paths[branch_of(path)].append(path)
+
+    metrics = {}
+    all_sessions = []
+    for branch in BRANCHES:
+        if not paths[branch]:
+            continue
+        fastest_steps = None
+        fastest_sessions = None
+        for _ in range(repeat):
+            steps = []
+            sessions = []
+            for path in paths[branch]:
+                started = time.perf_counter()
+                _session(path, steps)
+                sessions.append(time.perf_counter() - started)
+            if fastest_sessions is None or sum(sessions) < sum(fastest_sessions):
+                fastest_steps, fastest_sessions = steps, sessions
+
+        steps = sorted(seconds * 1000 for seconds in fastest_steps)
+        metrics[f"step.{branch}.mean"] = statistics.fmean(steps)
+        metrics[f"step.{branch}.p50"] = _percentile(steps, 0.5)
+        metrics[f"step.{branch}.p95"] = _percentile(steps, 0.95)
+        metrics[f"step.{branch}.max"] = steps[-1]
+        metrics[f"session.{branch}.mean"] = statistics.fmean(fastest_sessions) * 1000
+        all_sessions.extend(fastest_sessions)
+    metrics["session.all.mean"] = statistics.fmean(all_sessions) * 1000
+    return metrics, {branch: len(branch_paths) for branch, branch_paths in paths.items()}
+
+
+def run_suite(repeat, import_runs, patients, seed, with_imports=True):
+    metrics = import_metrics(import_runs) if with_imports else {}
+    metrics.update(engine_metrics(repeat))
+    session, path_counts = session_metrics(repeat, patients, seed)
+    metrics.update(session)
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "knowledge_base_version": knowledge_base_version(),
+            "patients": patients,
+            "seed": seed,
+            "patients_per_branch": path_counts,
+            "repeat": repeat,
+        },
+        "metrics_ms": {name: round(value, 3) for name, value in metrics.items()},
+    }
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Return (report lines, regression lines) of `results` against `baseline`."""
+    current = results["metrics_ms"]
+    previous = baseline.get("metrics_ms", {})
+    lines = []
+    regressions = []
+    for name, value in current.items():
+        base = previous.get(name)
+        if base is None:
+            lines.append(f"{name:<22} {value:10.3f} ms  (new)")
+            continue
+        change = (value - base) / base if base else 0.0
+        line = f"{name:<22} {value:10.3f} ms  baseline {base:10.3f} ms  {change:+7.1%}"
+        if name.endswith(UNGATED_SUFFIXES):
+            line += "  (not gated)"
+        elif change > tolerance and value - base > min_delta_ms:
+            line += "  REGRESSION"
+            regressions.append(line)
+        lines.append(line)
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup and per-step latency benchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--import-runs", type=int, default=5)
+    parser.add_argument("--patients", type=int, default=200, help="synthetic sessions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-imports", action="store_true", help="skip the import timings")
+    parser.add_argument("--out", help="write the results JSON here")
+    parser.add_argument(
+        "--baseline", default=BASELINE_PATH, help="compare against this results JSON"
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="overwrite the baseline with these results instead of failing on regressions",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--min-delta-ms", type=float, default=0.05)
+    args = parser.parse_args()
+
+    # Every factory build repeats the rule set warnings.
+    logging.getLogger("ExpertSystem.engine_factory").setLevel(logging.ERROR)
+    # A cached or precompiled result would skip the engine on the last step.
+    os.environ[SIZE_ENV] = "0"
+    os.environ.pop(DIR_ENV, None)
+    os.environ.pop(DAG_ENV, None)
+    results = run_suite(
+        args.repeat, args.import_runs, args.patients, args.seed, with_imports=not args.no_imports
+    )
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if baseline is None:
+        for name, value in results["metrics_ms"].items():
+            print(f"{name:<22} {value:10.3f} ms")
+    else:
+        lines, regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        print("\n".join(lines))
+        if baseline["meta"].get("knowledge_base_version") != knowledge_base_version():
+            print("Note: the baseline was recorded for another knowledge base version.")
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            print("\n".join(regressions))
+            sys.exit(1)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
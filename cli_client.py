@@ -0,0 +1,56 @@
+"""Thin client for the warm CLI daemon (`python app.py --daemon`).
+
+Reads the same JSON request as `python app.py --cli` from stdin and prints
+the daemon's response. Only the standard library is imported, so a call
+costs an interpreter start and a socket round trip.
+
+Usage:
+    echo '{"answers": {...}}' | python cli_client.py [--socket PATH]
+"""
+
+import json
+import os
+import socket
+import sys
+import tempfile
+
+SOCKET_ENV = "DERMATOLOGY_EXPERT_SOCKET"
+
+
+def default_socket_path():
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return path
+    return os.path.join(tempfile.gettempdir(), f"dermatology-expert-{os.getuid()}.sock")
+
+
+def request(raw_input, path=None, timeout=30.0):
+    """Send one raw JSON request to the daemon and return the raw response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(path or default_socket_path())
+        client.sendall(raw_input.encode("utf-8"))
+        client.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return b"".join(chunks).decode("utf-8")
+
+
+def main():
+    path = None
+    if len(sys.argv) == 3 and sys.argv[1] == "--socket":
+        path = sys.argv[2]
+
+    try:
+        sys.stdout.write(request(sys.stdin.read(), path))
+    except OSError as e:
+        print(json.dumps({"error": f"Could not reach the diagnosis daemon: {e}"}))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
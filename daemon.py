@@ -0,0 +1,146 @@
+"""Warm CLI daemon serving `cli_main` requests over a Unix domain socket.
+
+The daemon builds the engine factory once and keeps it resident; every
+connection carries one JSON request (the client closes its write side when
+done) and gets back exactly what `python app.py --cli` would print. Each
+connection is handled on its own thread with its own forked engine, with at
+most --max-connections threads at once; further connections wait in the
+listen backlog. A client that sends nothing for REQUEST_TIMEOUT_SECONDS is
+answered with an error and disconnected, so a stalled client cannot hold a
+thread or delay shutdown.
+
+The socket is created with mode 0600, so only the daemon's user can
+connect.
+
+SIGTERM and SIGINT stop accepting connections, let in-flight requests
+finish and remove the socket file.
+
+Usage:
+    python app.py --daemon [--socket PATH] [--max-connections N]
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+
+from cli_client import default_socket_path
+from ExpertSystem.diagnose import diagnose_json
+from ExpertSystem.engine_factory import get_engine_factory
+
+MAX_REQUEST_BYTES = 1024 * 1024
+REQUEST_TIMEOUT_SECONDS = 10.0
+DEFAULT_MAX_CONNECTIONS = 32
+
+
+class DiagnosisRequestHandler(socketserver.StreamRequestHandler):
+    # Applied to the connection with settimeout() before handle().
+    timeout = REQUEST_TIMEOUT_SECONDS
+
+    def handle(self):
+        try:
+            raw_input = self.rfile.read(MAX_REQUEST_BYTES + 1)
+        except TimeoutError:
+            result = {"error": "Timed out waiting for the request."}
+        else:
+            result = self._diagnose(raw_input)
+        try:
+            self.wfile.write((json.dumps(result, indent=2) + "\n").encode("utf-8"))
+        except OSError:
+            # The client has gone away or stopped reading.
+            pass
+
+    @staticmethod
+    def _diagnose(raw_input):
+        if len(raw_input) > MAX_REQUEST_BYTES:
+            return {"error": "Request too large."}
+        if not raw_input:
+            return {"error": "No JSON input provided."}
+        return diagnose_json(raw_input.decode("utf-8", errors="replace"))
+
+
+class DiagnosisDaemon(socketserver.ThreadingUnixStreamServer):
+    # Joined on server_close(), so shutdown waits for in-flight requests;
+    # the request timeout bounds how long that can take.
+    daemon_threads = False
+    block_on_close = True
+    request_queue_size = 128
+
+    def __init__(self, path, handler_class, max_connections=DEFAULT_MAX_CONNECTIONS):
+        self._slots = threading.BoundedSemaphore(max_connections)
+        # Bind with a umask that leaves the socket file 0600 from the start,
+        # rather than chmod-ing it once other users could have connected.
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, handler_class)
+        finally:
+            os.umask(umask)
+
+    def process_request(self, request, client_address):
+        # Blocks the accept loop while every slot is busy.
+        self._slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
+
+
+def _remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)
+            return
+    raise RuntimeError(f"A daemon is already listening on {path}")
+
+
+def serve(argv=()):
+    parser = argparse.ArgumentParser(prog="app.py --daemon")
+    parser.add_argument("--socket", default=default_socket_path())
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=DEFAULT_MAX_CONNECTIONS,
+        help="requests handled at once",
+    )
+    args = parser.parse_args(argv)
+    if args.max_connections < 1:
+        parser.error("--max-connections must be at least 1")
+
+    factory = get_engine_factory()
+    _remove_stale_socket(args.socket)
+    server = DiagnosisDaemon(args.socket, DiagnosisRequestHandler, args.max_connections)
+
+    def request_shutdown(signum, frame):
+        # shutdown() blocks until serve_forever() returns, so it cannot run
+        # on the thread that is serving.
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+    print(
+        f"Diagnosis daemon listening on {args.socket} "
+        f"(engine built in {factory.timings()['build_seconds'] * 1000:.0f} ms)",
+        flush=True,
+    )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        print("Diagnosis daemon stopped", flush=True)
@@ -1,4 +1,4 @@
-import  { createContext, useContext, useState, useCallback } from "react";
+import  { createContext, useContext, useState, useCallback, useEffect, useRef } from "react";
 
 const BackendContext = createContext();
 
@@ -13,6 +13,89 @@ export function BackendProvider({ children }) {
 
   const API_BASE = "http://127.0.0.1:8000/api";
 
+  // Server-sent events of the session: question, diagnosis, explanation_ready
+  // and error are pushed as soon as the engine halts, so there is nothing to
+  // poll. Without EventSource (or once the stream fails) answers fall back to
+  // fetching the status.
+  const eventsRef = useRef(null);
+  const explanationRef = useRef(null);
+  const diagnosedRef = useRef(false);
+
+  const closeEvents = useCallback(() => {
+    if (eventsRef.current) {
+      eventsRef.current.close();
+      eventsRef.current = null;
+    }
+  }, []);
+
+  const openEvents = useCallback((id) => {
+    closeEvents();
+    explanationRef.current = null;
+    diagnosedRef.current = false;
+    if (typeof EventSource === "undefined") return;
+    const events = new EventSource(`${API_BASE}/sessions/${id}/events`);
+    // The explanation may be pushed before or after the diagnosis; nothing
+    // more happens in the session once both have arrived.
+    const closeIfFinished = () => {
+      if (diagnosedRef.current && explanationRef.current) closeEvents();
+    };
+    const showStatus = (e) => {
+      const data = JSON.parse(e.data);
+      setCurrentQuestion(data.current_question);
+      const explanation = explanationRef.current;
+      setDiagnosis(
+        data.diagnosis && explanation && !data.diagnosis.explanation
+          ? { ...data.diagnosis, ...explanation }
+          : data.diagnosis
+      );
+      setProgress(data.progress);
+      if (data.diagnosis) {
+        diagnosedRef.current = true;
+        if (data.diagnosis.explanation_status === "ready" && !explanationRef.current) {
+          explanationRef.current = {
+            explanation: data.diagnosis.explanation,
+            explanation_status: "ready",
+          };
+        }
+        closeIfFinished();
+      }
+    };
+    events.addEventListener("question", showStatus);
+    events.addEventListener("diagnosis", showStatus);
+    events.addEventListener("explanation_ready", (e) => {
+      const data = JSON.parse(e.data);
+      explanationRef.current = {
+        explanation: data.explanation,
+        explanation_status: data.explanation_status,
+      };
+      setDiagnosis((prev) => (prev ? { ...prev, ...explanationRef.current } : prev));
+      closeIfFinished();
+    });
+    events.addEventListener("error", (e) => {
+      if (!e.data) {
+        // A connection error: EventSource reconnects unless it gave up.
+        if (events.readyState === EventSource.CLOSED) eventsRef.current = null;
+        return;
+      }
+      const data = JSON.parse(e.data);
+      if (data.source === "explanation") {
+        // The diagnosis stands; only its explanation is missing.
+        explanationRef.current = { explanation: null, explanation_status: "failed" };
+        setDiagnosis((prev) => (prev ? { ...prev, ...explanationRef.current } : prev));
+        closeIfFinished();
+        return;
+      }
+      if (data.source === "session") {
+        // The session was deleted or expired; the server has closed the stream.
+        closeEvents();
+      }
+      setError(data.detail || "Diagnosis failed");
+    });
+    eventsRef.current = events;
+  }, [closeEvents]);
+
+  useEffect(() => closeEvents, [closeEvents]);
+
   // Fetch current status/question/diagnosis
   const fetchStatus = useCallback(async (id = sessionId) => {
     if (!id) return;
@@ -46,14 +129,15 @@ export function BackendProvider({ children }) {
       setAnswers([]);
       setDiagnosis(null);
       setProgress(0);
+      openEvents(data.session_id);
       // Immediately fetch first question
-      await fetchStatus(data.session_id);
+      if (!eventsRef.current) await fetchStatus(data.session_id);
     } catch (e) {
       setError("Failed to create session");
     } finally {
       setLoading(false);
     }
-  }, [fetchStatus]);
+  }, [fetchStatus, openEvents]);
 
   // Submit answer
   const submitAnswer = useCallback(async (answer) => {
@@ -71,7 +155,8 @@ export function BackendProvider({ children }) {
         }),
       });
       setAnswers((prev) => [...prev, { question: currentQuestion, answer }]);
-      await fetchStatus();
+      // The next question or the diagnosis arrives as an event.
+      if (!eventsRef.current) await fetchStatus();
     } catch (e) {
       setError("Failed to submit answer");
     } finally {
@@ -81,6 +166,7 @@ export function BackendProvider({ children }) {
 
   // Reset/delete session
   const resetSession = useCallback(async () => {
+    closeEvents();
     if (sessionId) {
       try {
         await fetch(`${API_BASE}/sessions/${sessionId}`, { method: "DELETE" });
@@ -92,7 +178,7 @@ export function BackendProvider({ children }) {
     setDiagnosis(null);
     setProgress(0);
     setError(null);
-  }, [sessionId]);
+  }, [sessionId, closeEvents]);
 
   return (
     <BackendContext.Provider
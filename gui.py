@@ -7,21 +7,23 @@ import tempfile
 import queue
 from threading import Thread
 import datetime
-from AI.llm import explain_result_with_llm
 from experta import Fact
-from ExpertSystem.facts import Answer, NextQuestion
+from ExpertSystem.facts import Answer
 from ExpertSystem.Questions.question import get_question_by_ident
+from ExpertSystem.Questions.flow_compiler import get_resolver
 
 
 class ModernFreshDermatologyGUI:
-    def __init__(self, engine_class):
+    def __init__(self, engine_factory):
         self.root = tk.Tk()
         self.setup_main_window()
         self.setup_modern_styles()
         self.create_main_interface()
 
-        self.engine_class = engine_class
+        self.engine_factory = engine_factory
         self.expert_system = None
+        self.flow_resolver = get_resolver()
+        self.flow_state = None
         self.current_question = None
         self.diagnosis_complete = False
         self.waiting_for_answer = False
@@ -529,8 +531,8 @@ class ModernFreshDermatologyGUI:
             self.update_status("Initializing assessment...", "warning")
             self.start_button.config(state="disabled")
 
-            self.expert_system = self.engine_class()
-            self.expert_system.reset()
+            self.expert_system = self.engine_factory.fork()
+            self.flow_state = self.flow_resolver.start_state
             self.diagnosis_complete = False
             self.waiting_for_answer = False
 
@@ -592,27 +594,12 @@ class ModernFreshDermatologyGUI:
             print(f"  Fact ID {fact_id}: {fact}")
         print("-----------------------------------------\n")
 
-        next_question_fact = next(
-            (
-                f
-                for f in self.expert_system.facts.values()
-                if isinstance(f, NextQuestion)
-            ),
-            None,
-        )
+        next_question_ident = self.flow_resolver.question(self.flow_state)
 
-        results_processed_fact = next(
-            (
-                f
-                for f in self.expert_system.facts.values()
-                if isinstance(f, Fact) and f.get("id") == "results_processed"
-            ),
-            None,
-        )
+        results_processed_fact = self.expert_system.results_processed()
 
-        if next_question_fact:
-            ident = next_question_fact["ident"]
-            self.handle_question(ident)
+        if next_question_ident:
+            self.handle_question(next_question_ident)
             self.waiting_for_answer = True
         elif results_processed_fact:
             self.diagnosis_complete = True
@@ -626,9 +613,8 @@ class ModernFreshDermatologyGUI:
 
     def update_log_from_engine(self):
         self.results_text.config(state="normal")
-        for message in self.expert_system.fired_rules_log:
+        for message in self.expert_system.event_log.drain():
             self.results_text.insert(tk.END, message)
-        self.expert_system.fired_rules_log.clear()
         self.results_text.see(tk.END)
         self.results_text.config(state="disabled")
 
@@ -900,13 +886,12 @@ class ModernFreshDermatologyGUI:
             self.progress_bar.start()
             self.progress_bar.pack()
 
-            next_q_fact_id = None
-            for fact_id, fact in self.expert_system.facts.items():
-                if isinstance(fact, NextQuestion) and fact["ident"] == question_ident:
-                    next_q_fact_id = fact_id
-                    break
+            self.flow_state = self.flow_resolver.advance(
+                self.flow_state, question_ident, answer
+            )
+
+            next_q_fact_id = self.expert_system.retract_next_question(question_ident)
             if next_q_fact_id is not None:
-                self.expert_system.retract(next_q_fact_id)
                 print(
                     f"DEBUG_PROCESS: Retracted NextQuestion({question_ident}) with ID {next_q_fact_id}"
                 )
@@ -996,9 +981,23 @@ class ModernFreshDermatologyGUI:
                 self.results_text.insert(tk.END, f"    Reasoning: {reasoning}\n")
             self.results_text.insert(tk.END, "\n")
 
+            alternatives = self.expert_system.differential(4)[1:]
+            if alternatives:
+                self.results_text.insert(tk.END, "🔍 Differential Diagnosis:\n")
+                for alternative in alternatives:
+                    line = f"    • {alternative['disease']}"
+                    if self.show_confidence.get():
+                        line += f" ({alternative['cf'] * 100:.1f}%)"
+                    self.results_text.insert(tk.END, line + "\n")
+                self.results_text.insert(tk.END, "\n")
+
             result_text = f"Primary Diagnosis: {disease}\nConfidence: {confidence:.1f}%\nReasoning: {reasoning}"
 
             def insert_llm_explanation():
+                # Imported on first use: huggingface_hub alone costs longer
+                # than the rest of the GUI start-up.
+                from AI.llm import explain_result_with_llm
+
                 explanation = explain_result_with_llm(result_text)
                 self.results_text.config(state="normal")
                 self.results_text.insert(
@@ -1073,6 +1072,7 @@ class ModernFreshDermatologyGUI:
 
     def reset_diagnosis(self):
         self.expert_system = None
+        self.flow_state = None
         self.current_question = None
         self.diagnosis_complete = False
         self.waiting_for_answer = False
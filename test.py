@@ -1,5 +1,6 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, List, Optional, Any
 import uuid
@@ -7,13 +8,27 @@ import json
 from datetime import datetime
 import asyncio
 from contextlib import asynccontextmanager
-from ExpertSystem.engine import DermatologyExpert
-from ExpertSystem.Questions.question_flow import apply_question_flow
-from ExpertSystem.Questions.diagnosis import apply_diagnostic_rules
-from ExpertSystem.facts import Answer, NextQuestion
+from ExpertSystem.branch_rules import get_branch_rule_sets
+from ExpertSystem.decision_dag import get_decision_dag
+from ExpertSystem.diagnose import result_from_engine
+from ExpertSystem.event_log import format_event
+from ExpertSystem.explanations import PENDING, READY, get_explanation_service
+from ExpertSystem.kb_artifact import get_knowledge_base
 from ExpertSystem.Questions.question import get_question_by_ident
-from AI.llm import explain_result_with_llm
-from experta import Fact
+from ExpertSystem.Questions.flow_compiler import get_resolver
+from ExpertSystem.result_cache import answers_key, get_result_cache
+from ExpertSystem.session_events import (
+    DIAGNOSIS,
+    ENGINE,
+    ERROR,
+    EXPLANATION,
+    EXPLANATION_READY,
+    QUESTION,
+    get_session_events,
+)
+from ExpertSystem.session_executor import ExecutorBusy, get_session_executor
+from ExpertSystem.session_state import apply_answer, new_session
+from ExpertSystem.session_store import get_session_store, sweep_interval
 
 
 class SessionCreate(BaseModel):
@@ -45,11 +60,41 @@ class DiagnosisResponse(BaseModel):
     session_id: str
     diagnosis: Optional[Dict[str, Any]]
     explanation: Optional[str]
+    explanation_status: Optional[str] = None
     confidence: Optional[float]
     reasoning: Optional[str]
     completed: bool
 
 
+class TraceEvent(BaseModel):
+    seq: int
+    rule: str
+    disease: str
+    old_cf: float
+    new_cf: float
+    message: str
+
+
+class SessionTrace(BaseModel):
+    session_id: str
+    events: List[TraceEvent]
+    last_seq: int
+    dropped: int
+
+
+class DifferentialEntry(BaseModel):
+    rank: int
+    disease: str
+    confidence: float
+    reasoning: Optional[str]
+
+
+class SessionDifferential(BaseModel):
+    session_id: str
+    diagnoses: List[DifferentialEntry]
+    completed: bool
+
+
 class SessionStatus(BaseModel):
     session_id: str
     status: str
@@ -58,14 +103,30 @@ class SessionStatus(BaseModel):
     progress: float
 
 
-active_sessions: Dict[str, Dict] = {}
+active_sessions = get_session_store()
+session_executor = get_session_executor()
+explanations = get_explanation_service()
+session_events = get_session_events()
+branch_rule_sets = get_branch_rule_sets()
+knowledge_base = get_knowledge_base()
+decision_dag = get_decision_dag()
+flow_resolver = decision_dag.resolver if decision_dag else get_resolver()
+result_cache = get_result_cache()
+# The server's event loop, for callbacks from worker threads; set on startup.
+event_loop: Optional[asyncio.AbstractEventLoop] = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global event_loop
     print("Starting Dermatology Expert System API...")
+    event_loop = asyncio.get_running_loop()
+    sweeper = asyncio.create_task(active_sessions.sweep_periodically(sweep_interval()))
     yield
     print("Shutting down...")
+    sweeper.cancel()
+    session_executor.shutdown()
+    explanations.shutdown()
 
 
 app = FastAPI(
@@ -84,52 +145,127 @@ app.add_middleware(
 )
 
 
-def create_expert_system():
-    """Create and configure the expert system with all rules"""
-    DermatologyExpertWithLogic = apply_question_flow(DermatologyExpert)
-    DermatologyExpertWithLogic = apply_diagnostic_rules(DermatologyExpertWithLogic)
-    return DermatologyExpertWithLogic()
+def session_result(session: Dict):
+    """The final result once the engine has processed it, else None"""
+    if session["result"] is None and session["expert_system"].results_processed():
+        session["result"] = result_from_engine(session["expert_system"])
+        result_cache.put(answers_key(session["answer_facts"]), session["result"])
+    return session["result"]
+
+
+def finished_diagnosis(session: Dict) -> Optional[DiagnosisResponse]:
+    """The diagnosis of a finished session; its explanation is generated once,
+    in the background, and reported as pending until ready"""
+    result = session_result(session)
+    if result is None or "disease" not in result:
+        return None
+    explanations.start(session)
+    best_diagnosis = {
+        "disease": result["disease"],
+        "cf": result["confidence"],
+        "reasoning": result["reasoning"],
+    }
+    return DiagnosisResponse(
+        session_id=session["session_id"],
+        diagnosis=best_diagnosis,
+        explanation=session["explanation"],
+        explanation_status=session["explanation_status"],
+        confidence=best_diagnosis.get("cf", 0.0) * 100,
+        reasoning=best_diagnosis.get("reasoning"),
+        completed=True,
+    )
 
 
 def run_expert_system(session_id: str):
+    session = active_sessions.get(session_id)
+    if not session:
+        return
     try:
-        session = active_sessions.get(session_id)
-        if not session:
-            return
-
         expert_system = session["expert_system"]
         expert_system.run()
 
         session["status"] = "processed"
         session["last_updated"] = datetime.now()
+        if session_result(session) is not None:
+            explanations.start(session)
 
     except Exception as e:
-        if session_id in active_sessions:
-            active_sessions[session_id]["status"] = "error"
-            active_sessions[session_id]["error"] = str(e)
+        session["status"] = "error"
+        session["error"] = str(e)
+
+
+def explanation_event(session: Dict):
+    """The event reporting a finished explanation"""
+    if session["explanation_status"] == READY:
+        return EXPLANATION_READY, {
+            "session_id": session["session_id"],
+            "explanation": session["explanation"],
+            "explanation_status": session["explanation_status"],
+        }
+    return ERROR, {
+        "session_id": session["session_id"],
+        "source": EXPLANATION,
+        "detail": "Explanation failed",
+    }
+
+
+def save_explanation(explained: Dict):
+    """Persist a ready explanation with its session, unless the session is gone"""
+    session_id = explained["session_id"]
+    session = active_sessions.get(session_id, touch=False)
+    if session is None:
+        return
+    if session is not explained:
+        # Evicted and restored while the explanation was generated.
+        session["explanation"] = explained["explanation"]
+        session["explanation_status"] = explained["explanation_status"]
+    try:
+        active_sessions.save(session_id, session)
+    except Exception as e:
+        print(f"Could not persist the explanation of session {session_id}: {e}")
+
+
+def queue_save_explanation(session: Dict):
+    try:
+        session_executor.submit(session["session_id"], save_explanation, session)
+    except ExecutorBusy:
+        # Not persisted: a restored session generates it again.
+        pass
+
+
+def explanation_done(session: Dict):
+    session_events.publish_threadsafe(session["session_id"], *explanation_event(session))
+    # Saved on the session's actor, like every other change to it, so a
+    # session deleted in the meantime is not written back.
+    if session["explanation_status"] == READY and active_sessions.backend is not None:
+        if event_loop is not None:
+            try:
+                event_loop.call_soon_threadsafe(queue_save_explanation, session)
+            except RuntimeError:
+                # The loop has closed: the server is shutting down.
+                pass
+
+
+explanations.add_listener(explanation_done)
+
+
+# Everything that touches a session runs on session_executor, one operation
+# per session at a time and off the event loop; the handlers await it.
+
+
+def busy_error(e: ExecutorBusy):
+    return HTTPException(status_code=503, detail=f"Server busy: {str(e)}")
+
+
+def open_session(session_id: str, user_id: Optional[str]):
+    active_sessions.put(session_id, new_session(session_id, user_id))
 
 
 @app.post("/api/sessions", response_model=SessionResponse)
 async def create_session(session_data: SessionCreate):
     try:
         session_id = str(uuid.uuid4())
-        expert_system = create_expert_system()
-        expert_system.reset()
-
-        active_sessions[session_id] = {
-            "session_id": session_id,
-            "user_id": session_data.user_id,
-            "expert_system": expert_system,
-            "status": "initialized",
-            "created_at": datetime.now(),
-            "last_updated": datetime.now(),
-            "answers": {},
-            "current_question": None,
-            "diagnosis": None,
-        }
-
-        expert_system.declare(Fact(start=True))
-        run_expert_system(session_id)
+        await session_executor.run(session_id, open_session, session_id, session_data.user_id)
 
         return SessionResponse(
             session_id=session_id,
@@ -137,174 +273,292 @@ async def create_session(session_data: SessionCreate):
             message="Session created successfully",
         )
 
+    except ExecutorBusy as e:
+        raise busy_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating session: {str(e)}")
 
 
-@app.get("/api/sessions/{session_id}/status", response_model=SessionStatus)
-async def get_session_status(session_id: str):
-    """Get current session status and next question if available"""
-    try:
-        session = active_sessions.get(session_id)
-        if not session:
-            raise HTTPException(status_code=404, detail="Session not found")
+def session_status(session_id: str):
+    session = active_sessions.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
 
-        expert_system = session["expert_system"]
+    question_ident = flow_resolver.question(session["flow_state"])
 
-        next_question_fact = next(
-            (f for f in expert_system.facts.values() if isinstance(f, NextQuestion)),
-            None,
-        )
+    current_question = None
+    diagnosis = None
 
-        results_processed_fact = next(
-            (
-                f
-                for f in expert_system.facts.values()
-                if isinstance(f, Fact) and f.get("id") == "results_processed"
-            ),
-            None,
-        )
+    if question_ident:
+        question_data = get_question_by_ident(question_ident)
 
-        current_question = None
-        diagnosis = None
-
-        if next_question_fact:
-            question_ident = next_question_fact["ident"]
-            question_data = get_question_by_ident(question_ident)
-
-            if question_data:
-                is_multiple = "Select all that apply" in question_data["text"]
-                current_question = QuestionResponse(
-                    question_id=question_ident,
-                    question_text=question_data["text"],
-                    question_type=question_data["Type"],
-                    valid_responses=question_data["valid"],
-                    is_multiple_choice=is_multiple,
-                    session_id=session_id,
-                )
-                session["current_question"] = current_question
-
-        elif results_processed_fact:
-            best_diagnosis = expert_system.best_diagnosis
-            if best_diagnosis:
-                result_text = f"Primary Diagnosis: {best_diagnosis.get('disease')}\nConfidence: {best_diagnosis.get('cf', 0.0) * 100:.1f}%\nReasoning: {best_diagnosis.get('reasoning')}"
-                explanation = explain_result_with_llm(result_text)
-
-                diagnosis = DiagnosisResponse(
-                    session_id=session_id,
-                    diagnosis=best_diagnosis,
-                    explanation=explanation,
-                    confidence=best_diagnosis.get("cf", 0.0) * 100,
-                    reasoning=best_diagnosis.get("reasoning"),
-                    completed=True,
-                )
-                session["diagnosis"] = diagnosis
-        progress = len(session["answers"]) / 10.0 * 100
-        progress = min(progress, 95.0)
+        if question_data:
+            is_multiple = "Select all that apply" in question_data["text"]
+            current_question = QuestionResponse(
+                question_id=question_ident,
+                question_text=question_data["text"],
+                question_type=question_data["Type"],
+                valid_responses=question_data["valid"],
+                is_multiple_choice=is_multiple,
+                session_id=session_id,
+            )
+            session["current_question"] = current_question
 
+    else:
+        diagnosis = finished_diagnosis(session)
         if diagnosis:
-            progress = 100.0
+            session["diagnosis"] = diagnosis
+    progress = len(session["answers"]) / 10.0 * 100
+    progress = min(progress, 95.0)
 
-        return SessionStatus(
-            session_id=session_id,
-            status=session["status"],
-            current_question=current_question,
-            diagnosis=diagnosis,
-            progress=progress,
-        )
+    if diagnosis:
+        progress = 100.0
+
+    return SessionStatus(
+        session_id=session_id,
+        status=session["status"],
+        current_question=current_question,
+        diagnosis=diagnosis,
+        progress=progress,
+    )
+
+
+@app.get("/api/sessions/{session_id}/status", response_model=SessionStatus)
+async def get_session_status(session_id: str):
+    """Get current session status and next question if available"""
+    try:
+        return await session_executor.run(session_id, session_status, session_id)
 
+    except ExecutorBusy as e:
+        raise busy_error(e)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error getting session status: {str(e)}"
         )
 
 
-@app.post("/api/sessions/{session_id}/answer")
-async def submit_answer(
-    session_id: str, answer_data: AnswerSubmission, background_tasks: BackgroundTasks
-):
-    try:
-        session = active_sessions.get(session_id)
-        if not session:
-            raise HTTPException(status_code=404, detail="Session not found")
+def session_answer(session_id: str, answer_data: AnswerSubmission):
+    """Apply an answer; return True if the engine still has to run"""
+    session = active_sessions.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
 
-        expert_system = session["expert_system"]
-
-        next_q_fact_id = None
-        for fact_id, fact in expert_system.facts.items():
-            if (
-                isinstance(fact, NextQuestion)
-                and fact["ident"] == answer_data.question_id
-            ):
-                next_q_fact_id = fact_id
-                break
-
-        if next_q_fact_id is not None:
-            expert_system.retract(next_q_fact_id)
-
-        session["answers"][answer_data.question_id] = answer_data.answer
-
-        is_multi_select_question = answer_data.question_id in ["locations"]
-        if is_multi_select_question and answer_data.is_multiple:
-            individual_answers = [
-                a.strip() for a in answer_data.answer.split(",") if a.strip()
-            ]
-            for individual_ans in individual_answers:
-                expert_system.declare(
-                    Answer(ident=answer_data.question_id, text=individual_ans.lower())
-                )
-        else:
-            expert_system.declare(
-                Answer(ident=answer_data.question_id, text=answer_data.answer.lower())
-            )
+    try:
+        needs_run = apply_answer(
+            session, answer_data.question_id, answer_data.answer, answer_data.is_multiple
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    active_sessions.save(session_id, session)
+    if session["result"] is not None:
+        explanations.start(session)
+    return needs_run
+
+
+def session_event(session_id: str):
+    """The event reporting where the session stands: its next question, its
+    diagnosis or its error"""
+    status = session_status(session_id)
+    if status.status == "error":
+        session = active_sessions.get(session_id, touch=False) or {}
+        return ERROR, {"session_id": session_id, "source": ENGINE, "detail": session.get("error")}
+    if status.diagnosis:
+        return DIAGNOSIS, status.model_dump()
+    return QUESTION, status.model_dump()
+
+
+async def push_session_event(session_id: str):
+    """Tell the session's event streams, if any, where it stands now"""
+    if session_events.has_subscribers(session_id):
+        session_events.publish(
+            session_id, *await session_executor.run(session_id, session_event, session_id)
+        )
 
-        session["last_updated"] = datetime.now()
-        session["status"] = "processing"
 
-        background_tasks.add_task(run_expert_system, session_id)
+@app.post("/api/sessions/{session_id}/answer")
+async def submit_answer(session_id: str, answer_data: AnswerSubmission):
+    try:
+        if await session_executor.run(session_id, session_answer, session_id, answer_data):
+            await session_executor.run(session_id, run_expert_system, session_id)
+        await push_session_event(session_id)
 
         return {"message": "Answer submitted successfully", "session_id": session_id}
 
+    except ExecutorBusy as e:
+        raise busy_error(e)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error submitting answer: {str(e)}"
         )
 
 
+def session_opening_events(session_id: str):
+    """The events a new stream starts with: where the session stands and,
+    if already generated, its explanation"""
+    opening = [session_event(session_id)]
+    session = active_sessions.get(session_id, touch=False)
+    if session and session["explanation_status"] not in (None, PENDING):
+        opening.append(explanation_event(session))
+    return opening
+
+
+@app.get("/api/sessions/{session_id}/events")
+async def stream_session_events(session_id: str):
+    """Server-sent events: question, diagnosis, explanation_ready and error,
+    pushed as soon as the engine halts, in place of polling the status"""
+    # Subscribe first, so nothing published while the opening events are
+    # computed is missed.
+    subscriber = session_events.subscribe(session_id)
+    try:
+        opening = await session_executor.run(session_id, session_opening_events, session_id)
+    except ExecutorBusy as e:
+        session_events.unsubscribe(session_id, subscriber)
+        raise busy_error(e)
+    except BaseException:
+        session_events.unsubscribe(session_id, subscriber)
+        raise
+    for event, data in opening:
+        session_events.send(subscriber, event, data)
+
+    async def alive():
+        return await asyncio.to_thread(lambda: session_id in active_sessions)
+
+    return StreamingResponse(
+        session_events.stream(session_id, subscriber, alive),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def session_diagnosis(session_id: str):
+    session = active_sessions.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    diagnosis = None
+    if flow_resolver.question(session["flow_state"]) is None:
+        diagnosis = finished_diagnosis(session)
+    if diagnosis:
+        return diagnosis
+    else:
+        return DiagnosisResponse(
+            session_id=session_id,
+            diagnosis=None,
+            explanation=None,
+            confidence=None,
+            reasoning=None,
+            completed=False,
+        )
+
+
 @app.get("/api/sessions/{session_id}/diagnosis", response_model=DiagnosisResponse)
 async def get_diagnosis(session_id: str):
     try:
-        session = active_sessions.get(session_id)
-        if not session:
-            raise HTTPException(status_code=404, detail="Session not found")
-
-        if session.get("diagnosis"):
-            return session["diagnosis"]
-        else:
-            return DiagnosisResponse(
-                session_id=session_id,
-                diagnosis=None,
-                explanation=None,
-                confidence=None,
-                reasoning=None,
-                completed=False,
-            )
+        return await session_executor.run(session_id, session_diagnosis, session_id)
 
+    except ExecutorBusy as e:
+        raise busy_error(e)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error getting diagnosis: {str(e)}"
         )
 
 
+def session_trace(session_id: str, since: int):
+    session = active_sessions.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    event_log = session["expert_system"].event_log
+    events = [
+        TraceEvent(
+            seq=event[0],
+            rule=event[1],
+            disease=event[2],
+            old_cf=event[3],
+            new_cf=event[4],
+            message=format_event(event),
+        )
+        for event in event_log.events(since)
+    ]
+    return SessionTrace(
+        session_id=session_id,
+        events=events,
+        last_seq=event_log.last_seq,
+        dropped=event_log.dropped,
+    )
+
+
+@app.get("/api/sessions/{session_id}/trace", response_model=SessionTrace)
+async def get_session_trace(session_id: str, since: int = 0):
+    """CF adjustments recorded by the engine, oldest first, from seq `since`"""
+    try:
+        return await session_executor.run(session_id, session_trace, session_id, since)
+    except ExecutorBusy as e:
+        raise busy_error(e)
+
+
+def session_differential(session_id: str, k: Optional[int]):
+    session = active_sessions.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    expert_system = session["expert_system"]
+    result = session["result"]
+    if result is not None and not expert_system.results_processed():
+        # Served from the result cache; the engine never ran the last step.
+        ranked = [
+            (diagnosis["disease"], diagnosis["confidence"], None)
+            for diagnosis in result.get("differential", [])[:k]
+        ]
+    else:
+        ranked = [
+            (diagnosis["disease"], diagnosis["cf"], diagnosis.get("reasoning"))
+            for diagnosis in expert_system.differential(k)
+        ]
+    diagnoses = [
+        DifferentialEntry(
+            rank=rank, disease=disease, confidence=cf * 100, reasoning=reasoning
+        )
+        for rank, (disease, cf, reasoning) in enumerate(ranked, start=1)
+    ]
+    return SessionDifferential(
+        session_id=session_id,
+        diagnoses=diagnoses,
+        completed=result is not None or expert_system.results_processed(),
+    )
+
+
+@app.get("/api/sessions/{session_id}/differential", response_model=SessionDifferential)
+async def get_session_differential(session_id: str, k: Optional[int] = None):
+    """Diagnoses ranked by confidence so far, optionally only the top `k`"""
+    if k is not None and k < 1:
+        raise HTTPException(status_code=400, detail="k must be at least 1")
+    try:
+        return await session_executor.run(session_id, session_differential, session_id, k)
+    except ExecutorBusy as e:
+        raise busy_error(e)
+
+
 @app.delete("/api/sessions/{session_id}")
 async def delete_session(session_id: str):
     try:
-        if session_id in active_sessions:
-            del active_sessions[session_id]
+        if await session_executor.run(session_id, active_sessions.delete, session_id):
+            session_events.end(session_id, "Session deleted")
             return {"message": "Session deleted successfully"}
         else:
             raise HTTPException(status_code=404, detail="Session not found")
 
+    except ExecutorBusy as e:
+        raise busy_error(e)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting session: {str(e)}")
 
@@ -316,17 +570,31 @@ async def health_check():
         "status": "healthy",
         "timestamp": datetime.now(),
         "active_sessions": len(active_sessions),
+        "sessions": active_sessions.stats(),
+        "executor": session_executor.stats(),
+        "explanations": explanations.stats(),
+        "events": session_events.stats(),
+        "engine": branch_rule_sets.stats(),
+        "result_cache": result_cache.stats(),
+        "decision_dag": decision_dag.stats() if decision_dag else None,
+        "knowledge_base": knowledge_base.stats() if knowledge_base else None,
     }
 
 
 @app.exception_handler(404)
 async def not_found_handler(request, exc):
-    return {"error": "Not found", "detail": str(exc)}
+    return JSONResponse(
+        status_code=404,
+        content={"error": "Not found", "detail": getattr(exc, "detail", str(exc))},
+    )
 
 
 @app.exception_handler(500)
 async def internal_error_handler(request, exc):
-    return {"error": "Internal server error", "detail": str(exc)}
+    return JSONResponse(
+        status_code=500,
+        content={"error": "Internal server error", "detail": getattr(exc, "detail", str(exc))},
+    )
 
 
 if __name__ == "__main__":